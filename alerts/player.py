@@ -31,7 +31,7 @@ class PlayerAlertProvider(AlertProvider):
             with open(resolve_external_file_path("state/Player{}.json".format(channel))) as file:
                 self._states[channel] = json.loads(file.read())
 
-        funcs = [self._channel_count, self._initialised, self._start_time]
+        funcs = [self._channel_count, self._initialised, self._start_time, self._output_recoveries, self._audio_backend]
 
         alerts: List[Alert] = []
 
@@ -97,3 +97,50 @@ Please check player logs to investigate the cause. Please restart the server to
                     "severity": WARNING
                 }))
         return alerts
+
+    def _output_recoveries(self):
+        alerts: List[Alert] = []
+        for channel in range(self._player_count):
+            recoveries = self._states[channel].get("output_recoveries", 0) if self._states[channel] else 0
+            if recoveries:
+                alerts.append(Alert({
+                    "start_time": -1,
+                    "id": "player_{}_output_recovered".format(channel),
+                    "title": "Player {} had to recover its sound output.".format(channel),
+                    "description":
+                    """Player {} has re-initialised its sound output {} time(s) since it started, \
+because the output errored, stalled, or the device disappeared.
+
+Playback may have briefly dropped out. Please check the output device and Player logs to investigate the cause. \
+Please restart the server to clear this warning."""
+                    .format(channel, recoveries),
+                    "module": MODULE+str(channel),
+                    "severity": WARNING
+                }))
+        return alerts
+
+    def _audio_backend(self):
+        alerts: List[Alert] = []
+        for channel in range(self._player_count):
+            failed = self._states[channel].get("audio_backend_failed") if self._states[channel] else None
+            if failed:
+                backend = self._states[channel].get("audio_backend")
+                alerts.append(Alert({
+                    "start_time": -1,
+                    "id": "player_{}_audio_backend_failed".format(channel),
+                    "title": "Player {} couldn't start its audio backend, and is using {} instead.".format(channel, backend),
+                    "description":
+                    """Player {} failed to start the configured audio backend ({}), so fell back to the {} backend.
+
+{}Please check the 'Server Config' page, and Player logs to investigate the cause.
+This clears once the player has restarted with the configured backend."""
+                    .format(
+                        channel,
+                        failed,
+                        backend,
+                        "The dummy backend plays nothing, this channel will be silent! " if backend == "dummy" else "",
+                    ),
+                    "module": MODULE+str(channel),
+                    "severity": CRITICAL if backend == "dummy" else WARNING
+                }))
+        return alerts
@@ -0,0 +1,30 @@
+from typing import Optional
+
+from audio_backends.backend import DEFAULT_BUFFER_FRAMES, AudioBackend
+
+AUDIO_BACKENDS = ["pygame", "sounddevice", "dummy"]
+# The ones offered on the server config page.
+SELECTABLE_AUDIO_BACKENDS = ["pygame", "sounddevice", "dummy"]
+DEFAULT_AUDIO_BACKEND = "pygame"
+# Pygame's mixer is one per process, these can each play several channels from one process (see audio_engine.py).
+SHARED_PROCESS_AUDIO_BACKENDS = ["sounddevice", "dummy"]
+# Don't make a sound, so there's no point offering to play them from one process on the server config page.
+SILENT_AUDIO_BACKENDS = ["dummy"]
+
+
+# Backends are only imported when they're chosen, so a library we can't load only matters if it's actually used.
+# Raises ValueError if the name isn't a backend.
+def get_backend(name: Optional[str] = None, buffer_frames: Optional[int] = None) -> AudioBackend:
+    name = name or DEFAULT_AUDIO_BACKEND
+    buffer_frames = buffer_frames or DEFAULT_BUFFER_FRAMES
+
+    if name == "pygame":
+        from audio_backends.pygame_backend import PygameBackend
+        return PygameBackend(buffer_frames=buffer_frames)
+    if name == "sounddevice":
+        from audio_backends.sounddevice_backend import SoundDeviceBackend
+        return SoundDeviceBackend(buffer_frames=buffer_frames)
+    if name == "dummy":
+        from audio_backends.dummy_backend import DummyBackend
+        return DummyBackend(buffer_frames=buffer_frames)
+    raise ValueError("Unknown audio backend {}.".format(name))
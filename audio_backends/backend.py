@@ -0,0 +1,72 @@
+from typing import List, Optional
+
+DEFAULT_FREQUENCY = 44100
+DEFAULT_BUFFER_FRAMES = 1024
+
+
+class AudioBackend:
+    # Main audio backend class. All audio backends should inherit this.
+    # It plays one file at a time for the player, all positions and lengths are in seconds.
+    name: str = ""
+    frequency: int
+    buffer_frames: int
+    # Whether queue() can start another file the moment the current one ends.
+    supports_queue: bool = False
+
+    def __init__(self, frequency: int = DEFAULT_FREQUENCY, buffer_frames: int = DEFAULT_BUFFER_FRAMES):
+        self.frequency = frequency
+        self.buffer_frames = buffer_frames
+
+    # How far the position moves at a time.
+    @property
+    def buffer_s(self) -> float:
+        return self.buffer_frames / self.frequency
+
+    # How long audio takes to be heard after the backend's position has moved past it.
+    @property
+    def output_latency_s(self) -> float:
+        return self.buffer_s
+
+    # Opens the output (the default one if no device is given). Raises if it can't.
+    def init(self, device: Optional[str] = None):
+        raise NotImplementedError
+
+    def quit(self):
+        raise NotImplementedError
+
+    # The names init() accepts.
+    def output_devices(self) -> List[str]:
+        raise NotImplementedError
+
+    # For backends that only look for devices now and again, look again. Called before (re-)initialising the output.
+    def refresh_output_devices(self):
+        pass
+
+    # Raises if the file can't be loaded.
+    def load(self, filename: str):
+        raise NotImplementedError
+
+    # Whether the loaded file will actually play, for backends that can load a file without finding out.
+    def verify_loaded(self) -> bool:
+        return True
+
+    def unload(self):
+        raise NotImplementedError
+
+    def play(self, pos: float = 0):
+        raise NotImplementedError
+
+    # Also drops anything queued.
+    def stop(self):
+        raise NotImplementedError
+
+    def queue(self, filename: str):
+        raise NotImplementedError
+
+    # Raises if the output isn't initialised.
+    def get_busy(self) -> bool:
+        raise NotImplementedError
+
+    # How far into the current file playback has got since the last play(), restarting from 0 when a queued file starts.
+    def get_pos(self) -> float:
+        raise NotImplementedError
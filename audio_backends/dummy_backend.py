@@ -0,0 +1,84 @@
+import time
+from typing import List, Optional, Tuple
+
+from audio_backends.backend import AudioBackend
+from helpers.media_metadata import get_media_info
+
+DUMMY_DEVICE = "Dummy Output"
+
+
+class DummyBackend(AudioBackend):
+    # Doesn't make a sound, but keeps time as if it was playing, for running without any audio hardware (tests, CI).
+    name = "dummy"
+    supports_queue = True
+
+    _initialised: bool = False
+    # (filename, length)
+    _loaded: Optional[Tuple[str, float]] = None
+    _queued: Optional[Tuple[str, float]] = None
+    _playing: bool = False
+    _started: float = 0
+    _start_pos: float = 0
+
+    def init(self, device: Optional[str] = None):
+        if device and device != DUMMY_DEVICE:
+            raise ValueError("No such output device {}.".format(device))
+        self._initialised = True
+
+    def quit(self):
+        self._initialised = False
+        self._loaded = self._queued = None
+        self._playing = False
+
+    def output_devices(self) -> List[str]:
+        return [DUMMY_DEVICE]
+
+    def load(self, filename: str):
+        self._check_init()
+        self.stop()
+        self._loaded = (filename, get_media_info(filename).duration)
+
+    def unload(self):
+        self.stop()
+        self._loaded = None
+
+    def play(self, pos: float = 0):
+        self._check_init()
+        if not self._loaded:
+            raise RuntimeError("Nothing loaded to play.")
+        self._started = time.monotonic()
+        self._start_pos = pos
+        self._playing = True
+
+    def stop(self):
+        self._playing = False
+        self._queued = None
+
+    def queue(self, filename: str):
+        self._check_init()
+        self._queued = (filename, get_media_info(filename).duration)
+
+    def get_busy(self) -> bool:
+        self._check_init()
+        self._update()
+        return self._playing
+
+    def get_pos(self) -> float:
+        self._update()
+        return time.monotonic() - self._started if self._playing else 0
+
+    def _check_init(self):
+        if not self._initialised:
+            raise RuntimeError("Dummy output not initialised.")
+
+    # Catches up with anything that would have ended by now.
+    def _update(self):
+        while self._playing and self._loaded:
+            end = self._started + self._loaded[1] - self._start_pos
+            if time.monotonic() < end:
+                return
+            if self._queued:
+                self._loaded, self._queued = self._queued, None
+                self._started, self._start_pos = end, 0
+            else:
+                self._playing = False
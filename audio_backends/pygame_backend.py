@@ -0,0 +1,146 @@
+# Stop the Pygame Hello message.
+import os
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
+from helpers.os_environment import isLinux
+# It's the only one we could get to work.
+if isLinux():
+    os.putenv('SDL_AUDIODRIVER', 'pulseaudio')
+
+from typing import List, Optional
+from pygame import mixer
+from pygame._sdl2.audio import get_audio_device_names
+
+from audio_backends.backend import AudioBackend
+from helpers.mp3_seek_index import SeekIndex, read_seek_index
+
+
+# The file from a given byte offset onwards, so SDL starts decoding from exactly the frame we want.
+class OffsetFile:
+    def __init__(self, filename: str, offset: int):
+        self._file = open(filename, "rb")
+        self._offset = offset
+        self._file.seek(offset)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, pos: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            pos += self._offset
+        return self._file.seek(pos, whence) - self._offset
+
+    def tell(self) -> int:
+        return self._file.tell() - self._offset
+
+    def close(self):
+        self._file.close()
+
+
+class PygameBackend(AudioBackend):
+    # SDL's mixer, via pygame.
+    # WARNING! Pygame / SDL can't seek .wav files :/
+    # MP3s with a seek index (see helpers/mp3_seek_index.py) are seeked by loading them from the right frame onwards,
+    # rather than leaving SDL to find it, which is slow and inaccurate on long VBR files.
+    name = "pygame"
+    supports_queue = True
+
+    _filename: Optional[str] = None
+    _seek_index: Optional[SeekIndex] = None
+    # Where in the file the mixer's copy starts from, 0 if it's the whole file.
+    _loaded_offset: int = 0
+    # The time the frame we actually started from is at, minus the time we were asked to play from.
+    _pos_correction: float = 0
+    _queued: Optional[str] = None
+    _last_pos: float = 0
+
+    def init(self, device: Optional[str] = None):
+        if device:
+            mixer.init(self.frequency, -16, 2, self.buffer_frames, devicename=device)
+        else:
+            mixer.init(self.frequency, -16, 2, self.buffer_frames)
+
+    def quit(self):
+        mixer.quit()
+
+    def output_devices(self) -> List[str]:
+        return get_audio_device_names(False)
+
+    def load(self, filename: str):
+        mixer.music.load(filename)
+        self._loaded(filename)
+        self._queued = None
+
+    def _loaded(self, filename: str):
+        self._filename = filename
+        self._loaded_offset = 0
+        self._pos_correction = 0
+        self._last_pos = 0
+        # Only if something's already built one, this shouldn't hold up loading.
+        self._seek_index = read_seek_index(filename) if filename.lower().endswith(".mp3") else None
+
+    # Because Pygame/SDL is annoying, it'll happily "load" a file it can't play.
+    # We're not playing now, so we can quickly test run
+    # If that works, we're loaded.
+    def verify_loaded(self) -> bool:
+        try:
+            mixer.music.set_volume(0)
+            mixer.music.play(0)
+        except Exception:
+            try:
+                mixer.music.set_volume(1)
+            except Exception:
+                pass
+            return False
+        finally:
+            mixer.music.stop()
+
+        mixer.music.set_volume(1)
+        return True
+
+    def unload(self):
+        mixer.music.unload()
+        self._filename = self._seek_index = self._queued = None
+
+    def play(self, pos: float = 0):
+        self._pos_correction = 0
+        self._last_pos = 0
+        if self._seek_index and self._filename and pos > 0:
+            offset, frame_pos = self._seek_index.lookup(pos)
+            self._reload(offset)
+            mixer.music.play(0)
+            self._pos_correction = frame_pos - pos
+            return
+
+        if self._loaded_offset:
+            self._reload(0)
+        mixer.music.play(0, pos)
+
+    # Loading a file drops anything queued, so queue it again.
+    def _reload(self, offset: int):
+        if offset:
+            mixer.music.load(OffsetFile(self._filename, offset), "mp3")
+        else:
+            mixer.music.load(self._filename)
+        self._loaded_offset = offset
+        if self._queued:
+            mixer.music.queue(self._queued)
+
+    def stop(self):
+        mixer.music.stop()
+        self._queued = None
+
+    def queue(self, filename: str):
+        mixer.music.queue(filename)
+        self._queued = filename
+
+    def get_busy(self) -> bool:
+        return bool(mixer.music.get_busy())
+
+    def get_pos(self) -> float:
+        pos = max(0, mixer.music.get_pos() / 1000)
+        if self._queued and pos < self._last_pos:
+            # The mixer has moved onto the queued file, which is now what's loaded.
+            self._loaded(self._queued)
+            self._queued = None
+        self._last_pos = pos
+        return max(0, pos + self._pos_correction)
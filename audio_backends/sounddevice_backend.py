@@ -0,0 +1,228 @@
+from queue import Empty, Full, Queue
+from subprocess import DEVNULL, PIPE, Popen
+from threading import Lock, Thread
+from typing import List, Optional
+import sounddevice as sd
+from pydub import AudioSegment
+
+from audio_backends.backend import AudioBackend
+from helpers.media_metadata import get_media_info
+
+CHANNELS = 2
+SAMPLE_WIDTH = 2  # 16 bit
+DTYPE = "int16"
+FRAME_BYTES = CHANNELS * SAMPLE_WIDTH
+# Decoded audio is handed to the stream in chunks of whole frames, about 0.1s each at 44.1kHz.
+DECODE_CHUNK_BYTES = 4096 * FRAME_BYTES
+# How many chunks the decoder can get ahead of playback, about 5s.
+DECODE_BUFFER_CHUNKS = 50
+
+# PortAudio is one per process, shared by every channel in the audio engine (see audio_engine.py),
+# so it can only be refreshed when none of them have a stream open.
+_open_streams = 0
+# Sounddevice has no public way to restart PortAudio, so only do it if these (private) functions are still there.
+# If an upgrade takes them away, the device list just stays as it was when sounddevice was imported.
+_terminate_portaudio = getattr(sd, "_terminate", None)
+_initialize_portaudio = getattr(sd, "_initialize", None)
+
+
+# Decodes the file from a given position with ffmpeg (or avconv, whichever pydub found), a chunk at a time,
+# staying no more than DECODE_BUFFER_CHUNKS ahead. The chunks are raw PCM, with None once the file's ended.
+# Everything, even starting ffmpeg, happens on the decoder's own thread, so nothing here waits on it.
+class Decoder:
+    chunks: "Queue[Optional[bytes]]"
+    # Set once the first chunk is ready. Until then, the stream plays silence without counting it as an underflow.
+    started: bool = False
+
+    def __init__(self, filename: str, pos: float, frequency: int):
+        self.chunks = Queue(maxsize=DECODE_BUFFER_CHUNKS)
+        self._command = [
+            AudioSegment.converter, "-nostdin", "-loglevel", "error",
+            "-ss", "{:.6f}".format(pos), "-i", filename,
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(CHANNELS), "-ar", str(frequency), "-",
+        ]
+        self._lock = Lock()
+        self._stopped = False
+        self._process: Optional[Popen] = None
+        Thread(target=self._decode, name="SoundDeviceDecoder", daemon=True).start()
+
+    def _decode(self):
+        process = None
+        try:
+            process = Popen(self._command, stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL)
+            with self._lock:
+                self._process = process
+                if self._stopped:
+                    process.kill()
+            while not self._stopped:
+                # A whole chunk, unless the file's ended, so chunks are always whole frames.
+                chunk = process.stdout.read(DECODE_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self._put(chunk)
+                self.started = True
+        except (OSError, ValueError):
+            pass  # Couldn't start ffmpeg, or stopped under us, either way there's no more to play.
+        finally:
+            self._put(None)
+            if process:
+                process.stdout.close()
+                process.wait()
+
+    def _put(self, chunk: Optional[bytes]):
+        while not self._stopped:
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    # Only kills ffmpeg, the decoder's thread tidies up after it.
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            if self._process:
+                self._process.kill()
+
+
+class SoundDeviceBackend(AudioBackend):
+    # Decodes the file to PCM as it plays (with ffmpeg, like pydub does), feeding it to a PortAudio callback stream.
+    # So seeking works in any format, and the position is an exact count of the frames played.
+    # Seeking restarts the decoder from the new position, so only a few seconds of audio are ever in memory.
+    # Nothing waits on the decoder, the stream starts straight away, and plays silence until there's audio.
+    name = "sounddevice"
+
+    underflows: int = 0
+
+    _initialised: bool = False
+    _device: Optional[str] = None
+    _filename: Optional[str] = None
+    _decoder: Optional[Decoder] = None
+    # What's left of the chunk the callback is part way through.
+    _pending: memoryview = memoryview(b"")
+    _stream: Optional[sd.RawOutputStream] = None
+    # Only ever moved on by the stream's callback, once playing.
+    _frame: int = 0
+    _start_frame: int = 0
+
+    @property
+    def output_latency_s(self) -> float:
+        # PortAudio only knows what it actually ended up with once the stream is open.
+        if self._stream:
+            return self._stream.latency
+        return self.buffer_s
+
+    def init(self, device: Optional[str] = None):
+        # Make sure the device is there, and can play what we'll give it.
+        sd.check_output_settings(device=device, channels=CHANNELS, dtype=DTYPE, samplerate=self.frequency)
+        self._device = device
+        self._initialised = True
+
+    def quit(self):
+        self.stop()
+        self._filename = None
+        self._initialised = False
+
+    # PortAudio only looks for devices when it's initialised, so this is the list from when it last did.
+    def output_devices(self) -> List[str]:
+        return [device["name"] for device in sd.query_devices() if device["max_output_channels"] > 0]
+
+    # Starts PortAudio again, so it notices devices being plugged in or taken away. It's one per process,
+    # so this only happens when no stream is open, in this channel or any other in the audio engine.
+    # Until then, a device going away shows up as playback stalling, and the player re-initialising the output.
+    def refresh_output_devices(self):
+        if _open_streams or not (_terminate_portaudio and _initialize_portaudio):
+            return
+        _terminate_portaudio()
+        _initialize_portaudio()
+
+    # Doesn't decode anything yet, just makes sure it's something we can play.
+    def load(self, filename: str):
+        self._check_init()
+        self.stop()
+        get_media_info(filename)
+        self._filename = filename
+
+    def unload(self):
+        self.stop()
+        self._filename = None
+
+    def play(self, pos: float = 0):
+        global _open_streams
+        self._check_init()
+        if self._filename is None:
+            raise RuntimeError("Nothing loaded to play.")
+        self.stop()
+
+        self._decoder = Decoder(self._filename, pos, self.frequency)
+        self._pending = memoryview(b"")
+        self._start_frame = self._frame = int(pos * self.frequency)
+
+        self._stream = sd.RawOutputStream(
+            samplerate=self.frequency,
+            blocksize=self.buffer_frames,
+            device=self._device,
+            channels=CHANNELS,
+            dtype=DTYPE,
+            latency=self.buffer_s,
+            callback=self._callback,
+        )
+        _open_streams += 1
+        self._stream.start()
+
+    def stop(self):
+        global _open_streams
+        if self._stream:
+            self._stream.abort()
+            self._stream.close()
+            self._stream = None
+            _open_streams -= 1
+        if self._decoder:
+            self._decoder.stop()
+            self._decoder = None
+
+    def get_busy(self) -> bool:
+        self._check_init()
+        return bool(self._stream and self._stream.active)
+
+    def get_pos(self) -> float:
+        return (self._frame - self._start_frame) / self.frequency
+
+    def _check_init(self):
+        if not self._initialised:
+            raise RuntimeError("Sounddevice output not initialised.")
+
+    # Runs on PortAudio's thread, keep it quick.
+    def _callback(self, outdata, frames: int, time, status: sd.CallbackFlags):
+        if status.output_underflow:
+            self.underflows += 1
+
+        size = len(outdata)
+        filled = 0
+        ended = False
+        while filled < size:
+            if not self._pending:
+                try:
+                    chunk = self._decoder.chunks.get_nowait() if self._decoder else None
+                except Empty:
+                    # The rest of this block will have to be silence. Only an underflow if it's fallen behind,
+                    # not if it's still starting up.
+                    if self._decoder.started:
+                        self.underflows += 1
+                    break
+                if chunk is None:
+                    ended = True
+                    break
+                self._pending = memoryview(chunk)
+
+            count = min(size - filled, len(self._pending))
+            outdata[filled:filled + count] = self._pending[:count]
+            self._pending = self._pending[count:]
+            filled += count
+
+        self._frame += filled // FRAME_BYTES
+        if filled < size:
+            outdata[filled:] = bytes(size - filled)
+            if ended:
+                # That's the end of the file, let the stream finish.
+                raise sd.CallbackStop
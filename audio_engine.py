@@ -0,0 +1,144 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Audio Engine
+
+    Plays every channel from one process, rather than a process per channel, for setups with a lot of channels.
+    Each channel is still its own Player, with its own queues, state, logs and output, it just doesn't have
+    a whole interpreter (and copy of every audio library) to itself.
+"""
+import asyncio
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+from queue import Empty
+import time
+from typing import Dict, List, Optional
+
+from setproctitle import setproctitle
+
+from helpers.download_registry import DownloadRegistry
+from helpers.logging_manager import LoggingManager
+from helpers.myradio_api import close_async_session, close_sync_session
+from helpers.shared_status import PositionClock, StatusSlot
+from helpers.state_manager import StateManager
+from player import Player
+
+# Don't let one very chatty channel hold up the others, move on after this many messages.
+MAX_MESSAGES_PER_WAKE = 20
+
+
+class AudioEngine:
+    logger: LoggingManager
+    players: List[Player]
+    # When each channel next has scheduled work to do (monotonic).
+    next_tick: List[float]
+    # The queue pipes of the channels still running, to the channel.
+    readers: Dict = {}
+
+    def __init__(
+        self,
+        channel_to_q: List[multiprocessing.Queue],
+        channel_from_q: List[multiprocessing.Queue],
+        server_state: StateManager,
+        status_slots: Optional[List[StatusSlot]] = None,
+        position_clocks: Optional[List[PositionClock]] = None,
+        download_registry: Optional[DownloadRegistry] = None,
+    ):
+        process_title = "Audio Engine"
+        setproctitle(process_title)
+        multiprocessing.current_process().name = process_title
+
+        self.logger = LoggingManager("AudioEngine")
+        self.channel_to_q = channel_to_q
+
+        self.players = []
+        for channel in range(len(channel_to_q)):
+            self.players.append(
+                Player(
+                    channel,
+                    channel_to_q[channel],
+                    channel_from_q[channel],
+                    server_state,
+                    status_slots[channel] if status_slots else None,
+                    position_clocks[channel] if position_clocks else None,
+                    shared_process=True,
+                    download_registry=download_registry,
+                )
+            )
+        self.next_tick = [0] * len(self.players)
+        self.logger.log.info("Playing {} channels.".format(len(self.players)))
+
+        try:
+            self._run()
+        except KeyboardInterrupt:
+            self.logger.log.info("Received KeyboardInterupt")
+        except SystemExit:
+            self.logger.log.info("Received SystemExit")
+        except Exception as e:
+            self.logger.log.exception("Received unexpected Exception: {}".format(e))
+
+        for player in self.players:
+            if player.running:
+                player.running = False
+                player.shutdown()
+
+        try:
+            asyncio.get_event_loop().run_until_complete(close_async_session())
+            close_sync_session()
+        except Exception:
+            self.logger.log.exception("Failed to close MyRadio connections.")
+
+        self.logger.log.info("Quiting audio engine.")
+        del self.logger
+        os._exit(0)
+
+    def _run(self):
+        # Wait on the pipes underneath the player queues, so we wake up as soon as any of them has something.
+        self.readers = {queue._reader: channel for channel, queue in enumerate(self.channel_to_q)}
+
+        while self.readers:
+            running = list(self.readers.values())
+            timeout = max(0, min(self.next_tick[channel] for channel in running) - time.monotonic())
+
+            for reader in wait(list(self.readers.keys()), timeout=timeout):
+                self._drain(self.readers[reader])
+
+            now = time.monotonic()
+            for channel in list(self.readers.values()):
+                if now >= self.next_tick[channel]:
+                    self._call(channel, self.players[channel].tick)
+
+    def _drain(self, channel: int):
+        player = self.players[channel]
+        for _ in range(MAX_MESSAGES_PER_WAKE):
+            try:
+                message = self.channel_to_q[channel].get_nowait()
+            except Empty:
+                return
+            self._call(channel, player.handle_message, message)
+            if not player.running:
+                return
+
+    # Runs something on a channel, then works out when it next needs a tick.
+    def _call(self, channel: int, function, *args):
+        player = self.players[channel]
+        try:
+            function(*args)
+        except Exception as e:
+            # On its own, the player would restart, but here that would take every other channel with it.
+            player.logger.log.exception("Received unexpected Exception: {}".format(e))
+        if player.running:
+            self.next_tick[channel] = time.monotonic() + player.next_wakeup_s()
+        elif channel in self.readers.values():
+            # Told to quit (maybe by a message it was holding onto until a download finished), so this channel's done.
+            self.readers = {reader: c for reader, c in self.readers.items() if c != channel}
+            self._call(channel, player.shutdown)
+
+
+if __name__ == "__main__":
+    raise Exception(
+        "This BAPSicle Audio Engine is a subcomponenet, it will not run individually."
+    )
@@ -0,0 +1,307 @@
+from enum import Enum
+import copyreg
+import multiprocessing
+from multiprocessing.queues import Queue
+from typing import Any, Dict, List, Optional, Tuple, Union
+import json
+
+
+class Source(str, Enum):
+    WEBSOCKET = "WEBSOCKET"
+    UI = "UI"
+    CONTROLLER = "CONTROLLER"
+    TEST = "TEST"
+    ALL = "ALL"
+
+
+class Command(str, Enum):
+    # Audio Playout
+    STATUS = "STATUS"
+    PLAY = "PLAY"
+    PAUSE = "PAUSE"
+    PLAYPAUSE = "PLAYPAUSE"
+    UNPAUSE = "UNPAUSE"
+    STOP = "STOP"
+    SEEK = "SEEK"
+    AUTOADVANCE = "AUTOADVANCE"
+    REPEAT = "REPEAT"
+    PLAYONLOAD = "PLAYONLOAD"
+    OUTPUT = "OUTPUT"
+    # Show Plan Items
+    GETPLAN = "GETPLAN"
+    LOAD = "LOAD"
+    LOADED = "LOADED?"
+    UNLOAD = "UNLOAD"
+    ADD = "ADD"
+    REMOVE = "REMOVE"
+    CLEAR = "CLEAR"
+    SETMARKER = "SETMARKER"
+    RESETPLAYED = "RESETPLAYED"
+    SETPLAYED = "SETPLAYED"
+    SETLIVE = "SETLIVE"
+    QUIT = "QUIT"
+    # Only ever sent by the players.
+    STATUSDELTA = "STATUSDELTA"
+    POS = "POS"
+    STOPPED = "STOPPED"
+    # Sent by a player to itself, in the audio engine, when something it was waiting on in the background is done.
+    WAKE = "WAKE"
+    # The reply to anything the player couldn't make sense of.
+    UNKNOWN = "UNKNOWN"
+
+
+# Looking these up directly is a lot quicker than calling the Enum.
+SOURCES: Dict[str, Source] = {source.value: source for source in Source}
+COMMANDS: Dict[str, Command] = {command.value: command for command in Command}
+# Pickled messages carry the source and command as one small int (command index << 3 | source index).
+SOURCE_BITS = 3
+SOURCE_LIST: List[Source] = list(Source)
+COMMAND_LIST: List[Command] = list(Command)
+SOURCE_CODES: Dict[Source, int] = {source: i for i, source in enumerate(SOURCE_LIST)}
+COMMAND_CODES: Dict[Command, int] = {command: i << SOURCE_BITS for i, command in enumerate(COMMAND_LIST)}
+# Each member carries its code too. Looking an Enum member up in a dict goes through Enum's (Python) __hash__,
+# which is a good part of the cost of a small message.
+for _member, _code in list(SOURCE_CODES.items()) + list(COMMAND_CODES.items()):
+    _member.code = _code
+# Pickle's extension code for _restore (240-255 are for private use), so it's pickled as 2 bytes, not its full name.
+RESTORE_EXTENSION_CODE = 240
+
+# How many ":" separated args each command takes in the old string format.
+# Anything not listed takes none.
+LEGACY_ARG_COUNTS: Dict[Command, int] = {
+    Command.SEEK: 1,
+    Command.AUTOADVANCE: 1,
+    Command.REPEAT: 1,
+    Command.PLAYONLOAD: 1,
+    Command.OUTPUT: 1,
+    Command.GETPLAN: 1,
+    Command.LOAD: 1,
+    Command.REMOVE: 1,
+    Command.SETMARKER: 1,
+    Command.RESETPLAYED: 1,
+    Command.SETPLAYED: 1,
+    Command.SETLIVE: 1,
+}
+# Commands where everything after the args is a JSON payload (which may well contain ':').
+LEGACY_PAYLOAD_COMMANDS = [Command.ADD, Command.SETMARKER]
+
+
+class Message:
+    """
+    A message between the BAPSicle processes.
+
+    source: Who sent the request, replies go back with the same source so they reach the right place.
+    command: What to do.
+    args: Simple positional arguments, e.g. the weight to LOAD. Kept as given, it's up to the command to convert them
+        (see command_registry.py), they're strings when they've come from the old format.
+    payload: Already serialised (usually JSON) data, e.g. a plan item to ADD, or a STATUS reply.
+        It's serialised once by the sender, then passed through untouched until someone needs it.
+    ok: None for requests / events, True / False for the OKAY / FAIL of a reply.
+    request_id: Optional, copied onto the reply so the sender can match it up.
+    sent_at: When the sender put it on a queue, by time.monotonic() (the same in every process), if it said.
+        Only used to measure how long it waited there, it's not part of the message itself.
+    """
+
+    __slots__ = ("source", "command", "args", "payload", "ok", "request_id", "sent_at")
+
+    source: Source
+    command: Command
+    args: Tuple[Any, ...]
+    payload: Optional[str]
+    ok: Optional[bool]
+    request_id: Optional[str]
+    sent_at: Optional[float]
+
+    def __init__(
+        self,
+        source: Union[Source, str],
+        command: Union[Command, str],
+        args: Tuple[Any, ...] = (),
+        payload: Optional[str] = None,
+        ok: Optional[bool] = None,
+        request_id: Optional[str] = None,
+    ):
+        try:
+            # The Enums are strs, so the dicts take either, but only look up the ones that aren't already members.
+            self.source = source if source.__class__ is Source else SOURCES[source]
+            self.command = command if command.__class__ is Command else COMMANDS[command]
+        except KeyError as e:
+            raise ValueError("Unknown message source or command {}.".format(e))
+        self.args = args
+        self.payload = payload
+        self.ok = ok
+        self.request_id = request_id
+        self.sent_at = None
+
+    # A plain tuple of (code, args, payload, ok, request_id, sent_at), leaving off any defaults at the end,
+    # to keep the queues' work small. Most requests come out as just (code, args), smaller than the old strings.
+    def _wire(self) -> Tuple:
+        code = self.command.code | self.source.code
+        if self.sent_at is not None:
+            return (code, self.args, self.payload, self.ok, self.request_id, self.sent_at)
+        if self.request_id is not None:
+            return (code, self.args, self.payload, self.ok, self.request_id)
+        if self.ok is not None:
+            return (code, self.args, self.payload, self.ok)
+        if self.payload is not None:
+            return (code, self.args, self.payload)
+        if self.args:
+            return (code, self.args)
+        return (code,)
+
+    # Anything else pickling a message gets the same tuple, see MessageQueue for the queues between processes.
+    def __reduce__(self):
+        return (_restore, self._wire())
+
+    def _values(self) -> Tuple:
+        return (
+            self.source.value, self.command.value, tuple(map(str, self.args)), self.payload, self.ok, self.request_id
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Message):
+            return False
+        return self._values() == other._values()
+
+    def reply(self, ok: bool, payload: Optional[str] = None) -> "Message":
+        return _new(self.source, self.command, self.args, payload, ok, self.request_id)
+
+    @property
+    def data(self) -> Any:
+        return json.loads(self.payload) if self.payload is not None else None
+
+    # The old string format, for logging and anything that still wants it.
+    def __str__(self) -> str:
+        parts = [self.source.value, self.command.value, *map(str, self.args)]
+        if self.ok is not None:
+            parts.append("OKAY" if self.ok else "FAIL")
+        if self.payload is not None:
+            parts.append(self.payload)
+        return ":".join(parts)
+
+    def __repr__(self) -> str:
+        return "Message({})".format(str(self))
+
+    @classmethod
+    def parse(cls, message: Union["Message", str]) -> "Message":
+        """
+        Accepts requests in the old SOURCE:COMMAND:EXTRADATA string format, so anything that hasn't moved over yet still works.
+        Raises ValueError if it's not a valid message.
+        """
+        if isinstance(message, Message):
+            return message
+
+        split = message.split(":", 2)
+        if len(split) < 2:
+            raise ValueError("Message {} is missing a command.".format(message))
+        source = split[0]
+        command = Command(split[1])
+        rest = split[2] if len(split) > 2 else None
+
+        arg_count = LEGACY_ARG_COUNTS.get(command, 0)
+        has_payload = command in LEGACY_PAYLOAD_COMMANDS
+        args: Tuple[str, ...] = ()
+        payload = None
+        if rest is not None:
+            if has_payload:
+                extra = rest.split(":", arg_count)
+                if len(extra) <= arg_count:
+                    raise ValueError("Command {} is missing its payload.".format(command.value))
+                args, payload = tuple(extra[:arg_count]), extra[arg_count]
+            elif arg_count:
+                args = tuple(rest.split(":", arg_count - 1))
+            else:
+                raise ValueError("Command {} doesn't take any args.".format(command.value))
+
+        if len(args) != arg_count:
+            raise ValueError(
+                "Command {} needs {} args, got {}.".format(command.value, arg_count, len(args))
+            )
+
+        return cls(source, command, args, payload)
+
+    @classmethod
+    def parse_failed(cls, message: Union["Message", str]) -> Optional["Message"]:
+        """
+        Stands in for a string parse() couldn't make sense of, so that whoever sent it can be told it FAILed.
+        None if we can't even tell who that was.
+        """
+        if not isinstance(message, str):
+            return None
+        split = message.split(":", 2)
+        source = SOURCES.get(split[0])
+        if not source:
+            return None
+        command = COMMANDS.get(split[1], Command.UNKNOWN) if len(split) > 1 else Command.UNKNOWN
+        return cls(source, command)
+
+
+# Quicker than going through Message.__new__, which is the same thing.
+_object_new = object.__new__
+
+
+# Skips the checks in __init__, for messages made from one that's already valid.
+def _new(
+    source: Source,
+    command: Command,
+    args: Tuple[Any, ...],
+    payload: Optional[str],
+    ok: Optional[bool],
+    request_id: Optional[str],
+) -> Message:
+    message = _object_new(Message)
+    message.source = source
+    message.command = command
+    message.args = args
+    message.payload = payload
+    message.ok = ok
+    message.request_id = request_id
+    message.sent_at = None
+    return message
+
+
+# Unpickling skips the checks in __init__, the sender already made a valid message.
+def _restore(
+    code: int,
+    args: Tuple[Any, ...] = (),
+    payload: Optional[str] = None,
+    ok: Optional[bool] = None,
+    request_id: Optional[str] = None,
+    sent_at: Optional[float] = None,
+) -> Message:
+    message = _object_new(Message)
+    message.source = SOURCE_LIST[code & (1 << SOURCE_BITS) - 1]
+    message.command = COMMAND_LIST[code >> SOURCE_BITS]
+    message.args = args
+    message.payload = payload
+    message.ok = ok
+    message.request_id = request_id
+    message.sent_at = sent_at
+    return message
+
+
+copyreg.add_extension(__name__, _restore.__name__, RESTORE_EXTENSION_CODE)
+
+
+class MessageQueue(Queue):
+    """
+    A multiprocessing Queue for Messages, as used between all of the processes.
+
+    Messages go through it as their plain tuples (see Message._wire). Pickling any object, however small,
+    means pickle looking up the function to rebuild it with, which costs more than the rest of a small message.
+    Anything else (like an old format string) goes through as it is.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize, ctx=multiprocessing.get_context())
+
+    def put(self, obj, block=True, timeout=None):
+        if obj.__class__ is Message:
+            obj = obj._wire()
+        Queue.put(self, obj, block, timeout)
+
+    def get(self, block=True, timeout=None):
+        obj = Queue.get(self, block, timeout)
+        if obj.__class__ is tuple:
+            return _restore(*obj)
+        return obj
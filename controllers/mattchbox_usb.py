@@ -1,5 +1,5 @@
 from helpers.the_terminator import Terminator
-from typing import List, Optional
+from typing import Any, List, Optional
 from multiprocessing import Queue, current_process
 import serial
 import time
@@ -8,6 +8,7 @@ from setproctitle import setproctitle
 from helpers.logging_manager import LoggingManager
 from helpers.state_manager import StateManager
 from controllers.controller import Controller
+from baps_types.message import Command, Message, Source
 
 
 class MattchBox(Controller):
@@ -60,7 +61,7 @@ class MattchBox(Controller):
     def _disconnected(self):
         # If we lose the controller, make sure to set channels live, so we tracklist.
         for i in range(len(self.server_from_q)):
-            self.sendToPlayer(i, "SETLIVE:True")
+            self.sendToPlayer(i, Command.SETLIVE, True)
         self.server_state.update("ser_connected", False)
 
     def connect(self, port: Optional[str]):
@@ -96,14 +97,14 @@ class MattchBox(Controller):
                         self.ser.write(b"\xff")  # Send 255 back, this is a keepalive.
                     elif line in [51, 52, 53]:
                         # We've received a status update about fader live status, fader is down.
-                        self.sendToPlayer(line - 51, "SETLIVE:False")
+                        self.sendToPlayer(line - 51, Command.SETLIVE, False)
                     elif line in [61, 62, 63]:
                         # We've received a status update about fader live status, fader is up.
-                        self.sendToPlayer(line - 61, "SETLIVE:True")
+                        self.sendToPlayer(line - 61, Command.SETLIVE, True)
                     elif line in [1, 3, 5]:
-                        self.sendToPlayer(int(line / 2), "PLAYPAUSE")
+                        self.sendToPlayer(int(line / 2), Command.PLAYPAUSE)
                     elif line in [2, 4, 6]:
-                        self.sendToPlayer(int(line / 2) - 1, "STOP")
+                        self.sendToPlayer(int(line / 2) - 1, Command.STOP)
                 except Exception:
                     time.sleep(5)
                     self.connect(self.port)
@@ -134,8 +135,9 @@ class MattchBox(Controller):
 
         self.connect(None)
 
-    def sendToPlayer(self, channel: int, msg: str):
+    def sendToPlayer(self, channel: int, command: Command, *args: Any):
+        message = Message(Source.CONTROLLER, command, args)
         self.logger.log.info(
-            "Sending message to player channel {}: {}".format(channel, msg)
+            "Sending message to player channel {}: {}".format(channel, message)
         )
-        self.server_to_q[channel].put("CONTROLLER:" + msg)
+        self.server_to_q[channel].put(message)
@@ -0,0 +1,178 @@
+# Compares the old colon delimited string messages with the Message envelope.
+# Run from the repo root: python dev/scripts/benchmark_ipc_envelope.py
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import json
+import pickle
+import timeit
+from multiprocessing import Queue
+
+from baps_types.message import Command, Message, MessageQueue, Source, _restore
+from helpers.command_registry import CommandRegistry, float_arg
+
+ITERATIONS = 2000
+REPEATS = 10
+QUEUE_BATCH = 20
+PLAN_ITEMS = 50
+
+status = {
+    "channel": 0,
+    "playing": True,
+    "pos_true": 12.3,
+    "show_plan": [
+        {
+            "timeslotitemid": str(i),
+            "weight": i,
+            "title": "Song: {}".format(i),
+            "artist": "Someone",
+            "filename": "music-tmp/{}.mp3".format(i),
+            "markers": [],
+        }
+        for i in range(PLAN_ITEMS)
+    ],
+}
+
+
+# What each process did to a STATUS before, from the player through to the websocket clients.
+def string_status_hop():
+    message = pickle.loads(pickle.dumps("ALL:STATUS:OKAY:" + json.dumps(status)))
+    # Player handler routing
+    source = message.split(":")[0]
+    command = message.split(":")[1]
+    if source in ["ALL", "UI"] and message.split(":")[1] != "POS":
+        pass
+    # File manager
+    extra = message.split(":", 3)
+    json.loads(extra[3])
+    # Websocket server
+    command = message.split(":")[1]
+    data = json.loads(message.split("OKAY:")[1])
+    json.dumps({"command": command, "data": data, "channel": 0})
+
+
+def message_status_hop():
+    message = send(Message(Source.ALL, Command.STATUS, payload=json.dumps(status), ok=True))
+    # Player handler routing
+    if message.source in [Source.ALL, Source.UI] and message.command != Command.POS:
+        pass
+    # File manager
+    message.data
+    # Websocket server
+    message.data
+    '{{"command": "{}", "data": {}, "channel": {}}}'.format(message.command.value, message.payload, 0)
+
+
+# The commands the player knew before, its handlers were made again for every message.
+OLD_COMMANDS = [
+    "STATUS", "PLAY", "PAUSE", "PLAYPAUSE", "UNPAUSE", "STOP", "SEEK", "AUTOADVANCE", "REPEAT", "PLAYONLOAD",
+    "GETPLAN", "LOAD", "LOADED?", "UNLOAD", "ADD", "REMOVE", "CLEAR", "SETMARKER", "RESETPLAYED", "SETPLAYED",
+    "SETLIVE",
+]
+
+
+# What happened to a SEEK before, from the websocket server to the player, and the reply back through the handler.
+def string_command_hop():
+    message = pickle.loads(pickle.dumps("WEBSOCKET:SEEK:" + str(12.5)))
+    # Player
+    source = message.split(":")[0]
+    if source not in ["WEBSOCKET", "UI", "CONTROLLER", "TEST", "ALL"]:
+        return
+    last_msg = message.split(":", 1)[1]
+    replies = []
+    message_types = {command: (lambda: replies.append(float(last_msg.split(":")[1]))) for command in OLD_COMMANDS}
+    message_type = last_msg.split(":")[0]
+    if message_type in message_types.keys():
+        message_types[message_type]()
+    reply = pickle.loads(pickle.dumps("{}:{}:OKAY".format(source, last_msg)))
+    # Player handler
+    source = reply.split(":")[0]
+    command = reply.split(":")[1]
+    if command == "GETPLAN" or command == "STATUS":
+        pass
+    if source in ["ALL", "WEBSOCKET"]:
+        reply = pickle.loads(pickle.dumps(reply))
+    # Websocket server
+    reply.split(":")[1]
+
+
+# As MessageQueue sends them.
+def send(message: Message) -> Message:
+    return _restore(*pickle.loads(pickle.dumps(message._wire())))
+
+
+registry = CommandRegistry()
+registry.register(Command.SEEK, lambda time: True, float_arg)
+
+
+def message_command_hop():
+    message = send(Message(Source.WEBSOCKET, Command.SEEK, (12.5,)))
+    # Player
+    registered = registry.get(message.command)
+    if registered:
+        result, okay_str = registry.run(registered, message)
+    reply = send(message.reply(result is True))
+    # Player handler
+    if reply.command is Command.GETPLAN or reply.command is Command.STATUS:
+        pass
+    if reply.source is Source.ALL or reply.source is Source.WEBSOCKET:
+        reply = send(reply)
+    # Websocket server
+    reply.command.value
+
+
+# What the player did with a SEEK as soon as it got it, before the handler itself.
+def string_seek_received(message: str):
+    message.split(":")[0]
+    last_msg = message.split(":", 1)[1]
+    last_msg.split(":")[0]
+    float(last_msg.split(":")[1])
+
+
+def message_seek_received(message: Message):
+    message.source
+    message.command
+    float(message.args[0])
+
+
+# Batches of messages, made and read as each process would, so it's not just timing the queue's thread waking up.
+def queue_round_trip(make, use, q_class=Queue):
+    q = q_class()
+
+    def run():
+        for _ in range(QUEUE_BATCH):
+            q.put(make())
+        for _ in range(QUEUE_BATCH):
+            use(q.get())
+
+    return run
+
+
+# The best of a few runs, taking turns, as anything else running gets in the way.
+def report(name, old, new, per_run=1):
+    old_times, new_times = [], []
+    for _ in range(REPEATS):
+        old_times.append(timeit.timeit(old, number=ITERATIONS))
+        new_times.append(timeit.timeit(new, number=ITERATIONS))
+    old_time = min(old_times) / ITERATIONS / per_run * 1e6
+    new_time = min(new_times) / ITERATIONS / per_run * 1e6
+    print("{:<28} string: {:8.1f}us  message: {:8.1f}us  ({:+.0f}%)".format(
+        name, old_time, new_time, (new_time - old_time) / old_time * 100
+    ))
+
+
+if __name__ == "__main__":
+    print("{} iterations, {} plan items in status.".format(ITERATIONS, PLAN_ITEMS))
+    report("STATUS, player to clients", string_status_hop, message_status_hop)
+    report("SEEK request and reply", string_command_hop, message_command_hop)
+    report(
+        "Queue round trip (SEEK)",
+        queue_round_trip(lambda: "WEBSOCKET:SEEK:" + str(12.5), string_seek_received),
+        queue_round_trip(lambda: Message(Source.WEBSOCKET, Command.SEEK, (12.5,)), message_seek_received, MessageQueue),
+        QUEUE_BATCH,
+    )
+    print("Pickled size (SEEK): string {} bytes, message {} bytes".format(
+        len(pickle.dumps("WEBSOCKET:SEEK:12.5")),
+        len(pickle.dumps(Message(Source.WEBSOCKET, Command.SEEK, (12.5,))._wire())),
+    ))
@@ -0,0 +1,95 @@
+# Compares a new connection per MyRadio request with the shared, pooled sessions, against a local stand-in server.
+# The stand-in can wait before answering each new connection, to stand in for the round trips of a TLS handshake.
+# Run from the repo root: python dev/scripts/benchmark_myradio_sessions.py
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import aiohttp
+import requests
+
+from helpers.logging_manager import LoggingManager
+from helpers.myradio_api import MyRadioAPI, close_async_session, close_sync_session
+
+REQUESTS = 100
+# Simulated time (ms) to set up each new connection, 0 is just what it costs locally.
+HANDSHAKE_MS = [0, 20]
+PAYLOAD = json.dumps({"status": "OK", "payload": [{"title": "Song: {}".format(i)} for i in range(50)]}).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive.
+    # Otherwise the body waits on the ACK of the headers, as real servers know to avoid.
+    disable_nagle_algorithm = True
+    handshake_s = 0.0
+
+    def setup(self):
+        super().setup()
+        time.sleep(self.handshake_s)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def new_session_each_time(url: str):
+    # What MyRadioAPI.async_call did before.
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            return await response.read()
+
+
+async def time_async(call, url: str) -> float:
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await call(url)
+    return (time.perf_counter() - start) / REQUESTS * 1000
+
+
+def time_sync(call, url: str) -> float:
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        call(url)
+    return (time.perf_counter() - start) / REQUESTS * 1000
+
+
+def report(name: str, old_ms: float, new_ms: float):
+    print("  {:<6} new connection: {:7.2f}ms  pooled: {:7.2f}ms  (saves {:.2f}ms per call)".format(
+        name, old_ms, new_ms, old_ms - new_ms
+    ))
+
+
+async def run_async(api: MyRadioAPI, url: str):
+    old = await time_async(new_session_each_time, url)
+    new = await time_async(api.async_call, url)
+    await close_async_session()
+    return old, new
+
+
+if __name__ == "__main__":
+    api = MyRadioAPI(LoggingManager("Benchmark"), None)
+    print("{} sequential GETs per run.".format(REQUESTS))
+    for handshake_ms in HANDSHAKE_MS:
+        StandInHandler.handshake_s = handshake_ms / 1000
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/api/v2/timeslot".format(server.server_port)
+
+        print("Simulated handshake {}ms:".format(handshake_ms))
+        report("async", *asyncio.run(run_async(api, url)))
+        report("sync", time_sync(requests.get, url), time_sync(api.call, url))
+        close_sync_session()
+        server.shutdown()
+        server.server_close()
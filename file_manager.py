@@ -1,35 +1,123 @@
 from helpers.state_manager import StateManager
 from helpers.os_environment import isWindows, resolve_external_file_path
-from typing import List
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 from setproctitle import setproctitle
 from multiprocessing import current_process, Queue
-from time import sleep
+from multiprocessing.connection import wait
+from queue import Empty
+from threading import Thread
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import heapq
 import os
-import json
-from syncer import sync
+import time
+import psutil
 
 from helpers.logging_manager import LoggingManager
 from helpers.the_terminator import Terminator
-from helpers.myradio_api import MyRadioAPI
+from helpers.myradio_api import MyRadioAPI, close_async_session
+from helpers.download_registry import DownloadRegistry
+from helpers.music_cache import MusicCache
 from helpers.normalisation import generate_normalised_file
+from helpers.media_metadata import get_media_info
+from helpers.mp3_seek_index import get_seek_index
+from helpers.waveform_peaks import get_peaks
+from helpers.status_delta import apply_status_delta
 from baps_types.plan import PlanItem
+from baps_types.message import Command
+
+# How many files to download at once.
+MAX_CONCURRENT_DOWNLOADS = 4
+# Download priorities, lowest goes first. Then by weight, then by channel.
+PRIORITY_LOADED = 0  # Loaded in a channel, but we've not got it yet.
+PRIORITY_NEXT = 1  # Up next in a channel.
+PRIORITY_REST = 2
+# How often to check if we've been told to stop, while waiting for messages.
+WAIT_TIMEOUT_S = 1
+# How often to publish how the downloads are getting on.
+DOWNLOAD_PROGRESS_INTERVAL_S = 0.5
+# How many files to normalise at once, leaving a core for the players.
+NORMALISE_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+
+
+# Which file an item will be downloaded to (see MyRadioAPI.get_filename), so items sharing a file share a download.
+def _download_key(item: PlanItem) -> Optional[str]:
+    if item.trackid:
+        return "track-{}".format(item.trackid)
+    if item.managedid:
+        return "managed-{}".format(item.managedid)
+    return None
+
+
+# Normalisation workers shouldn't get in the way of playout, they can wait.
+def _lower_priority():
+    try:
+        psutil.Process().nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if isWindows() else 10)
+    except (psutil.Error, OSError):
+        pass
+
+
+# Runs in a normalisation worker. Returns the normalised filename, and how long it took.
+def _normalise(filename: str) -> Tuple[str, float]:
+    start = time.monotonic()
+    filename = generate_normalised_file(filename)
+    return filename, time.monotonic() - start
 
 
 class FileManager:
     logger: LoggingManager
     api: MyRadioAPI
-
-    def __init__(self, channel_from_q: List[Queue], server_config: StateManager):
+    file_state: Optional[StateManager]
+    # file_state is a proxy to the server's manager process, so every update waits on it.
+    # They're sent from a thread of their own, in order, so the downloads don't wait too.
+    file_state_publisher: Optional[ThreadPoolExecutor] = None
+
+    # Download queue, a heap of (priority, key), lazily updated: anything popped that's no longer wanted is skipped.
+    download_queue: List[Tuple[Tuple, str]]
+    # Files the plans need, to (priority, an item to download it with).
+    wanted: Dict[str, Tuple[Tuple, PlanItem]]
+    downloading: Dict[str, "asyncio.Task[Any]"]
+    # (bytes so far, total bytes or None) of each download in progress.
+    download_progress: Dict[str, Tuple[int, Optional[int]]]
+    next_progress_publish: float = 0
+    # Files we've got, to their (possibly normalised) filename.
+    downloaded: Dict[str, str]
+    failed: Set[str]
+    # Wakes the download workers when there's something new in the queue.
+    download_ready: asyncio.Event
+    # Wakes the main loop when a channel's message changes what the plans need.
+    plans_changed: asyncio.Event
+    cache: MusicCache
+    # Every file in any plan right now, whether we need to download it or not, to (priority, an item using it).
+    in_plans: Dict[str, Tuple[Tuple, PlanItem]]
+    normalise_pool: Optional[ProcessPoolExecutor] = None
+    # Jobs are only handed to the pool when it has a worker free, so until then they can be dropped, or moved up.
+    # Once a job has started, a pool worker can't be stopped, so it's only forgotten about (see _update_normalisation).
+    normalising: Dict[str, "asyncio.Task[Any]"]
+    # Started jobs for files no longer in any plan. Each still takes up a worker until it's done.
+    normalise_abandoned: Dict[str, "asyncio.Task[Any]"]
+    # How long each file took to normalise (0 if it was already done).
+    normalised: Dict[str, float]
+    normalise_failed: Set[str]
+
+    def __init__(
+        self,
+        channel_from_q: List[Queue],
+        server_config: StateManager,
+        file_state: Optional[StateManager] = None,
+        download_registry: Optional[DownloadRegistry] = None,
+    ):
 
         self.logger = LoggingManager("FileManager")
-        self.api = MyRadioAPI(self.logger, server_config)
+        self.api = MyRadioAPI(self.logger, server_config, download_registry)
+        self.file_state = file_state
+        if file_state:
+            self.file_state_publisher = ThreadPoolExecutor(1, thread_name_prefix="FileStatePublisher")
 
         process_title = "File Manager"
         setproctitle(process_title)
         current_process().name = process_title
 
-        terminator = Terminator()
-
         self.normalisation_mode = server_config.get()["normalisation_mode"]
 
         if self.normalisation_mode != "on":
@@ -37,241 +125,425 @@ class FileManager:
         else:
             self.logger.log.info("Normalisation is enabled.")
 
+        self.channel_from_q = channel_from_q
         self.channel_count = len(channel_from_q)
-        self.channel_received = None
         self.last_known_show_plan = [[]] * self.channel_count
-        self.next_channel_preload = 0
-        self.known_channels_preloaded = [False] * self.channel_count
-        self.known_channels_normalised = [False] * self.channel_count
+        self.last_known_loaded = [None] * self.channel_count
+        self.last_known_loaded_keys = [None] * self.channel_count
+        self.last_known_status = [None] * self.channel_count
         self.last_known_item_ids = [[]] * self.channel_count
-        try:
 
-            while not terminator.terminate:
-                # If all channels have received the delete command, reset for the next one.
-                if (
-                    self.channel_received is None
-                    or self.channel_received == [True] * self.channel_count
-                ):
-                    self.channel_received = [False] * self.channel_count
-
-                for channel in range(self.channel_count):
-                    try:
-                        message = channel_from_q[channel].get_nowait()
-                    except Exception:
-                        continue
-
-                    try:
-                        # source = message.split(":")[0]
-                        command = message.split(":", 2)[1]
-
-                        # If we have requested a new show plan, empty the music-tmp directory for the previous show.
-                        if command == "GETPLAN":
-
-                            if (
-                                self.channel_received != [
-                                    False] * self.channel_count
-                                and self.channel_received[channel] is False
-                            ):
-                                # We've already received a delete trigger on a channel,
-                                # let's not delete the folder more than once.
-                                # If the channel was already in the process of being deleted, the user has
-                                # requested it again, so allow it.
-
-                                self.channel_received[channel] = True
-                                continue
-
-                            # Delete the previous show files!
-                            # Note: The players load into RAM. If something is playing over the load,
-                            # the source file can still be deleted.
-                            path: str = resolve_external_file_path(
-                                "/music-tmp/")
-
-                            if not os.path.isdir(path):
-                                self.logger.log.warning(
-                                    "Music-tmp folder is missing, not handling."
-                                )
-                                continue
-
-                            files = [
-                                f
-                                for f in os.listdir(path)
-                                if os.path.isfile(os.path.join(path, f))
-                            ]
-                            for file in files:
-                                if isWindows():
-                                    filepath = path + "\\" + file
-                                else:
-                                    filepath = path + "/" + file
-                                self.logger.log.info(
-                                    "Removing file {} on new show load.".format(
-                                        filepath
-                                    )
-                                )
-                                try:
-                                    os.remove(filepath)
-                                except Exception:
-                                    self.logger.log.warning(
-                                        "Failed to remove, skipping. Likely file is still in use."
-                                    )
-                                    continue
-                            self.channel_received[channel] = True
-                            self.known_channels_preloaded = [
-                                False] * self.channel_count
-                            self.known_channels_normalised = [
-                                False
-                            ] * self.channel_count
-
-                        # If we receive a new status message, let's check for files which have not been pre-loaded.
-                        if command == "STATUS":
-                            extra = message.split(":", 3)
-                            if extra[2] != "OKAY":
-                                continue
-
-                            status = json.loads(extra[3])
-                            show_plan = status["show_plan"]
-                            item_ids = []
-                            for item in show_plan:
-                                item_ids += item["timeslotitemid"]
-
-                            # If the new status update has a different order / list of items,
-                            # let's update the show plan we know about
-                            # This will trigger the chunk below to do the rounds again and preload any new files.
-                            if item_ids != self.last_known_item_ids[channel]:
-                                self.last_known_item_ids[channel] = item_ids
-                                self.last_known_show_plan[channel] = show_plan
-                                self.known_channels_preloaded[channel] = False
-
-                    except Exception:
-                        self.logger.log.exception(
-                            "Failed to handle message {} on channel {}.".format(
-                                message, channel
-                            )
-                        )
-
-                # Let's try preload / normalise some files now we're free of messages.
-                preloaded = self.do_preload()
-                normalised = self.do_normalise()
-
-                if not preloaded and not normalised:
-                    # We didn't do any hard work, let's sleep.
-                    sleep(0.2)
+        self.download_queue = []
+        self.wanted = {}
+        self.downloading = {}
+        self.download_progress = {}
+        self.downloaded = {}
+        self.failed = set()
+        self.in_plans = {}
+        self.normalising = {}
+        self.normalise_abandoned = {}
+        self.normalised = {}
+        self.normalise_failed = set()
+
+        path = resolve_external_file_path("/music-tmp/")
+        os.makedirs(path, exist_ok=True)
+        self.cache = MusicCache(path, server_config.get()["music_cache_budget_mb"] * 1024 * 1024)
 
+        try:
+            asyncio.run(self._run())
         except Exception as e:
             self.logger.log.exception(
                 "Received unexpected exception: {}".format(e))
         del self.logger
 
-    # Attempt to preload a file onto disk.
-    def do_preload(self):
-        channel = self.next_channel_preload
-
-        # All channels have preloaded all files, do nothing.
-        if self.known_channels_preloaded == [True] * self.channel_count:
-            return False  # Didn't preload anything
-
-        # Right, let's have a quick check in the status for shows without filenames, to preload them.
-        # Keep an eye on if we downloaded anything.
-        # If we didn't, we know that all items in this channel have been downloaded.
-        downloaded_something = False
-        for i in range(len(self.last_known_show_plan[channel])):
+    async def _run(self):
+        terminator = Terminator()
+        loop = asyncio.get_event_loop()
+        self.download_ready = asyncio.Event()
+        self.plans_changed = asyncio.Event()
+        self._watch_channel_queues(loop)
+        self._publish_downloads()
+        workers = [asyncio.ensure_future(self._download_worker()) for _ in range(MAX_CONCURRENT_DOWNLOADS)]
+        if self.normalisation_mode == "on":
+            self.normalise_pool = ProcessPoolExecutor(NORMALISE_WORKERS, initializer=_lower_priority)
+            self.logger.log.info("Normalising up to {} files at once.".format(NORMALISE_WORKERS))
 
-            item_obj = PlanItem(self.last_known_show_plan[channel][i])
+        try:
+            while not terminator.terminate:
+                # Downloads and normalisation carry on in the background.
+                try:
+                    await asyncio.wait_for(self.plans_changed.wait(), WAIT_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    continue
+                self.plans_changed.clear()
+
+                self._update_downloads()
+                self._update_normalisation()
+                self._evict()
+        finally:
+            if not isWindows():
+                for queue in self.channel_from_q:
+                    loop.remove_reader(queue._reader.fileno())
+            for task in (
+                workers
+                + list(self.downloading.values())
+                + list(self.normalising.values())
+                + list(self.normalise_abandoned.values())
+            ):
+                task.cancel()
+            if self.normalise_pool:
+                # Anything part way through is written to a temporary file, so there's nothing to tidy up.
+                self.normalise_pool.shutdown(wait=False)
+            if self.file_state_publisher:
+                self.file_state_publisher.shutdown(wait=True)
+            await close_async_session()
+
+    # Wake up as soon as a channel has something for us, rather than polling the queues,
+    # so a newly loaded item jumps the download queue straight away.
+    def _watch_channel_queues(self, loop: asyncio.AbstractEventLoop):
+        if isWindows():
+            # The Windows event loops can't watch pipes, leave the waiting to a thread.
+            Thread(target=self._wait_for_channel_messages, args=(loop,), daemon=True).start()
+            return
+
+        for channel, queue in enumerate(self.channel_from_q):
+            loop.add_reader(queue._reader.fileno(), self._drain_channel_queue, channel)
+
+    def _wait_for_channel_messages(self, loop: asyncio.AbstractEventLoop):
+        readers = {queue._reader: channel for channel, queue in enumerate(self.channel_from_q)}
+        while True:
+            for reader in wait(list(readers.keys())):
+                channel = readers[reader]
+                try:
+                    message = self.channel_from_q[channel].get_nowait()
+                except Empty:
+                    continue
+                loop.call_soon_threadsafe(self._on_message, channel, message)
 
-            # We've not downloaded this file yet, let's do that.
-            if not item_obj.filename:
-                self.logger.log.info(
-                    "Checking pre-load on channel {}, weight {}: {}".format(
-                        channel, item_obj.weight, item_obj.name
-                    )
-                )
+    def _drain_channel_queue(self, channel: int):
+        while True:
+            try:
+                message = self.channel_from_q[channel].get_nowait()
+            except Empty:
+                return
+            self._on_message(channel, message)
+
+    # Every message waiting is handled before the main loop wakes up, so a burst only works out the plans once.
+    def _on_message(self, channel: int, message):
+        if self._handle_message(channel, message):
+            self.plans_changed.set()
+
+    # Returns whether the plans (or what's loaded) changed, and so what we need to download.
+    def _handle_message(self, channel: int, message) -> bool:
+        try:
+            command = message.command
 
-                # Getting the file name will only pull the new file if the file doesn't
-                # already exist, so this is not too inefficient.
-                item_obj.filename, did_download = sync(
-                    self.api.get_filename(item_obj, True)
-                )
-                # Alright, we've done one, now let's give back control to process new statuses etc.
+            # A new show plan is coming, make room for it if we're over budget.
+            # What the last plan needed is kept, until the statuses tell us what the new one needs.
+            if command == Command.GETPLAN:
+                self._evict()
+                return False
 
-                # Save back the resulting item back in regular dict form
-                self.last_known_show_plan[channel][i] = item_obj.__dict__
+            # If we receive a new status message, let's check for files which have not been pre-loaded.
+            if command in [Command.STATUS, Command.STATUSDELTA]:
+                if not message.ok:
+                    return False
 
-                if did_download:
-                    downloaded_something = True
-                    self.logger.log.info(
-                        "File successfully preloaded: {}".format(
-                            item_obj.filename)
+                if command == Command.STATUS:
+                    status = message.data
+                else:
+                    status = apply_status_delta(
+                        self.last_known_status[channel], message.data
                     )
-                    break
+                self.last_known_status[channel] = status
+                if not status:
+                    # We've not got a full status to apply the changes to yet, wait for the next one.
+                    return False
+
+                # Whatever's loaded is playing from its file, even if it's been taken out of the plan since.
+                loaded_item = status["loaded_item"]
+                self.last_known_loaded_keys[channel] = _download_key(PlanItem(loaded_item)) if loaded_item else None
+
+                show_plan = status["show_plan"]
+                item_ids = [item["timeslotitemid"] for item in show_plan]
+                loaded = loaded_item["weight"] if loaded_item else None
+
+                # If the new status update has a different order / list of items, or something else is loaded,
+                # let's update the show plan we know about, which will work out what to download again.
+                if item_ids != self.last_known_item_ids[channel] or loaded != self.last_known_loaded[channel]:
+                    self.last_known_item_ids[channel] = item_ids
+                    self.last_known_show_plan[channel] = show_plan
+                    self.last_known_loaded[channel] = loaded
+                    return True
+
+        except Exception:
+            self.logger.log.exception(
+                "Failed to handle message {} on channel {}.".format(
+                    message, channel
+                )
+            )
+        return False
+
+    # Works out what the plans need, and in which order, cancelling anything they don't need anymore.
+    def _update_downloads(self):
+        wanted: Dict[str, Tuple[Tuple, PlanItem]] = {}
+        in_plans: Dict[str, Tuple[Tuple, PlanItem]] = {}
+        for channel in range(self.channel_count):
+            plan = sorted(
+                (PlanItem(item) for item in self.last_known_show_plan[channel]), key=lambda item: item.weight
+            )
+            loaded = self.last_known_loaded[channel]
+            # The first item is next, if nothing's loaded yet.
+            next_weight = loaded + 1 if loaded is not None else 0
+            for item in plan:
+                key = _download_key(item)
+                if not key:
+                    continue
+                if key not in self.in_plans and key not in in_plans and self.cache.use(key):
+                    # Already got it, from an earlier show.
+                    self.downloaded.setdefault(key, self.cache.audio_filename(key))
+                if item.weight == loaded:
+                    priority = (PRIORITY_LOADED, 0, channel)
+                elif item.weight == next_weight:
+                    priority = (PRIORITY_NEXT, 0, channel)
                 else:
-                    # We didn't download anything this time, file was already loaded.
-                    # Let's try the next one.
+                    priority = (PRIORITY_REST, item.weight, channel)
+                if key not in in_plans or priority < in_plans[key][0]:
+                    in_plans[key] = (priority, item)
+                if item.filename:
+                    # The player's already got it.
                     continue
+                if key not in wanted or priority < wanted[key][0]:
+                    wanted[key] = (priority, item)
+
+        for key, task in list(self.downloading.items()):
+            if key not in wanted:
+                self.logger.log.info("Cancelling download of {}, it's no longer in any plan.".format(key))
+                task.cancel()
+
+        self.wanted = wanted
+        self.in_plans = in_plans
+        self._save_cache()
+        self.download_queue = [
+            (priority, key)
+            for key, (priority, _) in wanted.items()
+            if key not in self.downloaded and key not in self.downloading
+        ]
+        heapq.heapify(self.download_queue)
+        if self.download_queue:
+            self.download_ready.set()
+        self._publish_downloads()
+
+    def _next_download(self) -> Optional[str]:
+        while self.download_queue:
+            _, key = heapq.heappop(self.download_queue)
+            # It may have been removed, or picked up by another worker, since it was queued.
+            if key in self.wanted and key not in self.downloaded and key not in self.downloading:
+                return key
+        return None
+
+    async def _download_worker(self):
+        while True:
+            key = self._next_download()
+            if not key:
+                self.download_ready.clear()
+                await self.download_ready.wait()
+                continue
 
-        # Tell the file manager that this channel is fully downloaded, this is so
-        # it can consider normalising once all channels have files.
-        self.known_channels_preloaded[channel] = not downloaded_something
-
-        self.next_channel_preload += 1
-        if self.next_channel_preload >= self.channel_count:
-            self.next_channel_preload = 0
-
-        return downloaded_something
-
-    # If we've preloaded everything, get to work normalising tracks before playback.
-    def do_normalise(self):
-
-        if self.normalisation_mode != "on":
-            return False
-
-        # Some channels still have files to preload, do nothing.
-        if self.known_channels_preloaded != [True] * self.channel_count:
-            return False  # Didn't normalise
-
-        # Quit early if all channels are normalised already.
-        if self.known_channels_normalised == [True] * self.channel_count:
-            return False
-
-        channel = self.next_channel_preload
-
-        normalised_something = False
-        # Look through all the show plan files
-        for i in range(len(self.last_known_show_plan[channel])):
+            item = self.wanted[key][1]
+            self.logger.log.info("Downloading {}: {}".format(key, item.name))
+            task = asyncio.ensure_future(
+                self.api.get_filename(item, True, progress=lambda done, total: self._download_progress(key, done, total))
+            )
+            self.downloading[key] = task
+            self.failed.discard(key)
+            self._publish_downloads()
+            try:
+                # Awaiting the task itself would cancel it along with us, and then we couldn't tell who was cancelled.
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()  # We're stopping.
+                raise
+            finally:
+                del self.downloading[key]
+                self.download_progress.pop(key, None)
+
+            filename = None
+            if not task.cancelled():
+                try:
+                    filename, did_download = task.result()
+                except Exception:
+                    self.logger.log.exception("Failed to download {}.".format(key))
+
+            if filename:
+                if did_download:
+                    self.logger.log.info("File successfully preloaded: {}".format(filename))
+                    await asyncio.get_event_loop().run_in_executor(None, self._index_file, filename)
+                    self.cache.add(key)
+                self.downloaded[key] = filename
+                self._evict()
+                self._update_normalisation()
+            elif not task.cancelled():
+                self.failed.add(key)
+            self._publish_downloads()
+
+    # Makes room in the cache, if it's over budget, never touching anything in a plan, loaded, or being downloaded.
+    # Until every channel has told us its plan, we can't know what's safe to remove.
+    def _evict(self):
+        if any(status is None for status in self.last_known_status):
+            return
+        try:
+            removed = self.cache.evict(
+                set(self.in_plans.keys())
+                | set(self.downloading.keys())
+                | set(key for key in self.last_known_loaded_keys if key)
+            )
+        except OSError:
+            self.logger.log.exception("Failed to clear space in the music cache.")
+            return
+        for key in removed:
+            self.logger.log.info("Removed {} from the music cache, to stay in budget.".format(key))
+            self.downloaded.pop(key, None)
+            self.failed.discard(key)
+        self._save_cache()
+
+    def _save_cache(self):
+        try:
+            self.cache.save()
+            self._publish("cache", self.cache.stats())
+        except OSError:
+            self.logger.log.exception("Failed to save the music cache index.")
 
-            item_obj = PlanItem(self.last_known_show_plan[channel][i])
+    def _publish(self, key: str, value: Any):
+        if self.file_state_publisher:
+            self.file_state_publisher.submit(self._update_file_state, key, value)
 
-            filename = item_obj.filename
-            if not filename:
-                self.logger.log.exception(
-                    "Somehow got empty filename when all channels are preloaded."
-                )
-                continue  # Try next song.
-            elif not os.path.isfile(filename):
-                self.logger.log.exception(
-                    "Filename for normalisation does not exist. This is bad."
-                )
-                continue
-            elif "normalised" in filename:
-                continue
-            # Sweet, we now need to try generating a normalised version.
-            try:
+    # Runs on the publisher's thread.
+    def _update_file_state(self, key: str, value: Any):
+        try:
+            self.file_state.update(key, value)
+        except Exception:
+            self.logger.log.exception("Failed to publish {}.".format(key))
+
+    def _download_progress(self, key: str, done: int, total: Optional[int]):
+        self.download_progress[key] = (done, total)
+        if time.monotonic() >= self.next_progress_publish:
+            self._publish_downloads()
+
+    # Where each file the plans need is at, for anything that wants to show it.
+    def _publish_downloads(self):
+        if not self.file_state:
+            return
+        downloads = {}
+        for key, (priority, _) in self.wanted.items():
+            if key in self.downloaded:
+                state = "downloaded"
+            elif key in self.downloading:
+                state = "downloading"
+            elif key in self.failed:
+                state = "failed"
+            else:
+                state = "queued"
+            downloads[key] = {"state": state, "priority": priority[0]}
+            if key in self.download_progress:
+                downloads[key]["bytes"], downloads[key]["total_bytes"] = self.download_progress[key]
+        self._publish("downloads", downloads)
+        self.next_progress_publish = time.monotonic() + DOWNLOAD_PROGRESS_INTERVAL_S
+
+    # Normalises the files the plans need, most urgent first, dropping anything they don't need anymore.
+    # Only jobs that haven't started are really cancelled. One that's already running carries on until it's done,
+    # keeping its worker busy (so we never have more jobs than workers), but its result is ignored.
+    def _update_normalisation(self):
+        if not self.normalise_pool:
+            return
+
+        for key, task in list(self.normalising.items()):
+            if key not in self.in_plans:
                 self.logger.log.info(
-                    "Normalising on channel {}: {}".format(channel, filename)
+                    "Abandoning normalisation of {}, it's no longer in any plan. It'll finish in the background.".format(
+                        key
+                    )
                 )
-                # This will return immediately if we already have a normalised file.
-                item_obj.filename = generate_normalised_file(filename)
-                # TODO Hacky
-                self.last_known_show_plan[channel][i] = item_obj.__dict__
-                normalised_something = True
-                break  # Now go let another channel have a go.
-            except Exception as e:
-                self.logger.log.exception(
-                    "Failed to generate normalised file.", str(e))
+                self.normalise_abandoned[key] = self.normalising.pop(key)
+        for key, task in list(self.normalise_abandoned.items()):
+            if key in self.in_plans:
+                # It's back, and the job's still going, so we want the result after all.
+                self.normalising[key] = self.normalise_abandoned.pop(key)
+        self.normalised = {key: elapsed for key, elapsed in self.normalised.items() if key in self.in_plans}
+        self.normalise_failed &= set(self.in_plans.keys())
+
+        queue = []
+        for key, (priority, item) in self.in_plans.items():
+            if key in self.normalised or key in self.normalising or key in self.normalise_failed:
                 continue
+            filename = self.downloaded.get(key, item.filename)
+            if not filename or not os.path.isfile(filename):
+                continue  # Not got it yet.
+            if filename.endswith("-normalised.mp3"):
+                self.normalised[key] = 0
+                continue
+            queue.append((priority, key, filename))
+        heapq.heapify(queue)
+
+        while queue and len(self.normalising) + len(self.normalise_abandoned) < NORMALISE_WORKERS:
+            _, key, filename = heapq.heappop(queue)
+            self.normalising[key] = asyncio.ensure_future(self._normalise(key, filename))
+        self._publish_normalisation(key for _, key, _ in queue)
+
+    async def _normalise(self, key: str, filename: str):
+        self.logger.log.info("Normalising {}: {}".format(key, filename))
+        loop = asyncio.get_event_loop()
+        task = asyncio.current_task()
+        try:
+            normalised_filename, elapsed = await loop.run_in_executor(self.normalise_pool, _normalise, filename)
+            if self.normalising.get(key) is task:
+                await loop.run_in_executor(None, self._index_file, normalised_filename)
+        except asyncio.CancelledError:
+            return  # We're stopping.
+        except Exception:
+            if self.normalising.get(key) is task:
+                self.logger.log.exception("Failed to generate normalised file for {}.".format(key))
+                self.normalise_failed.add(key)
+        else:
+            if self.normalising.get(key) is task:
+                self.logger.log.info("Normalised {} in {:.1f}s.".format(key, elapsed))
+                self.normalised[key] = elapsed
+                if key in self.downloaded:
+                    self.downloaded[key] = normalised_filename
+            else:
+                self.logger.log.info("Finished abandoned normalisation of {}.".format(key))
+        finally:
+            if self.normalising.get(key) is task:
+                del self.normalising[key]
+            if self.normalise_abandoned.get(key) is task:
+                del self.normalise_abandoned[key]
+        # A worker's free.
+        self._update_normalisation()
+
+    # Where each file the plans need is at with normalisation, and how long it took.
+    def _publish_normalisation(self, queued: Iterable[str]):
+        if not self.file_state:
+            return
+        normalisation: Dict[str, Dict[str, Any]] = {key: {"state": "queued"} for key in queued}
+        for key in self.normalising:
+            normalisation[key] = {"state": "normalising"}
+        for key in self.normalise_failed:
+            normalisation[key] = {"state": "failed"}
+        for key, elapsed in self.normalised.items():
+            normalisation[key] = {"state": "normalised", "elapsed_s": round(elapsed, 3)}
+        self._publish("normalisation", normalisation)
+
+    # Index new files now, so the players don't have to measure them when they're loaded, and can seek them quickly.
+    def _index_file(self, filename: str):
+        try:
+            get_media_info(filename)
+            if filename.endswith(".mp3"):
+                get_seek_index(filename)
+        except Exception:
+            self.logger.log.warning("Failed to index {}.".format(filename))
 
-        self.known_channels_normalised[channel] = not normalised_something
-
-        self.next_channel_preload += 1
-        if self.next_channel_preload >= self.channel_count:
-            self.next_channel_preload = 0
-
-        return normalised_something
+        # Decodes the whole file, so may well fail where the above didn't (if there's no ffmpeg, say).
+        try:
+            get_peaks(filename)
+        except Exception:
+            self.logger.log.warning("Failed to work out the waveform of {}.".format(filename))
@@ -0,0 +1,134 @@
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from baps_types.message import Command, Message
+
+# Upper bounds of the execution time histogram buckets, anything slower goes in one last bucket.
+HISTOGRAM_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+# Returned by a handler that will reply later, once something it's waiting on is done.
+DEFERRED = object()
+
+
+# Turns the message into the args for the handler. Anything that raises counts as a failed command.
+ArgParser = Callable[[Message], Tuple[Any, ...]]
+
+
+def no_args(message: Message) -> Tuple[Any, ...]:
+    return ()
+
+
+def int_arg(message: Message) -> Tuple[Any, ...]:
+    return (int(message.args[0]),)
+
+
+def float_arg(message: Message) -> Tuple[Any, ...]:
+    return (float(message.args[0]),)
+
+
+def str_arg(message: Message) -> Tuple[Any, ...]:
+    return (str(message.args[0]),)
+
+
+def bool_arg(message: Message) -> Tuple[Any, ...]:
+    return (str(message.args[0]) == "True",)
+
+
+class CommandStats:
+    count: int
+    failures: int
+    total_s: float
+    max_s: float
+    histogram: List[int]
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_s = 0
+        self.max_s = 0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+
+    def record(self, time_s: float, failed: bool):
+        self.count += 1
+        if failed:
+            self.failures += 1
+        self.total_s += time_s
+        if time_s > self.max_s:
+            self.max_s = time_s
+
+        # The first bucket it fits in, or the last one past them all.
+        self.histogram[bisect_left(HISTOGRAM_BUCKETS_MS, time_s * 1000)] += 1
+
+    def __str__(self) -> str:
+        buckets = ", ".join(
+            "<={}ms: {}".format(bucket, count)
+            for bucket, count in zip(HISTOGRAM_BUCKETS_MS, self.histogram)
+            if count
+        )
+        if self.histogram[-1]:
+            buckets += ", >{}ms: {}".format(HISTOGRAM_BUCKETS_MS[-1], self.histogram[-1])
+        return "{} calls ({} failed), mean {:.1f}ms, max {:.1f}ms [{}]".format(
+            self.count,
+            self.failures,
+            self.total_s / self.count * 1000 if self.count else 0,
+            self.max_s * 1000,
+            buckets,
+        )
+
+
+class RegisteredCommand:
+    handler: Callable[..., Any]
+    parser: ArgParser
+    okay_str: bool
+    stats: CommandStats
+
+    def __init__(self, handler: Callable[..., Any], parser: ArgParser, okay_str: bool):
+        self.handler = handler
+        self.parser = parser
+        self.okay_str = okay_str
+        self.stats = CommandStats()
+
+
+# Built once, then each message just looks up its command and runs it.
+class CommandRegistry:
+    commands: Dict[Command, RegisteredCommand]
+
+    def __init__(self):
+        self.commands = {}
+
+    # okay_str: A string returned by the handler is a successful reply, rather than a failure reason.
+    def register(
+        self,
+        command: Command,
+        handler: Callable[..., Any],
+        parser: ArgParser = no_args,
+        okay_str: bool = False,
+    ):
+        self.commands[command] = RegisteredCommand(handler, parser, okay_str)
+
+    def get(self, command: Command) -> Optional[RegisteredCommand]:
+        return self.commands.get(command)
+
+    # Returns the handler's result, and whether a string result means OKAY, ready to reply with.
+    def run(self, registered: RegisteredCommand, message: Message) -> Tuple[Any, bool]:
+        start = perf_counter()
+        try:
+            result = registered.handler(*registered.parser(message))
+        except Exception:
+            registered.stats.record(perf_counter() - start, failed=True)
+            raise
+        okay = result is True or result is DEFERRED or (registered.okay_str and isinstance(result, str))
+        registered.stats.record(perf_counter() - start, failed=not okay)
+        return result, registered.okay_str
+
+    def stats_summary(self) -> str:
+        return "\n".join(
+            "{}: {}".format(command.value, registered.stats)
+            for command, registered in self.commands.items()
+            if registered.stats.count
+        )
+
+    def reset_stats(self):
+        for registered in self.commands.values():
+            registered.stats = CommandStats()
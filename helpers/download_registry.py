@@ -0,0 +1,91 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Download Registry
+
+    Which files are being downloaded, and by whom, shared between the players and the file manager through the
+    server's proxy manager. So only one of them downloads each file, and everything else waiting on it hears
+    the moment it's done (or why it failed), rather than watching for the file to turn up.
+"""
+from threading import Condition
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+# While waiting, check this often that whoever's downloading hasn't died.
+OWNER_CHECK_S = 1
+# Why a download failed is kept this long, for anything waiting on it to hear. They're woken straight away,
+# so this only has to cover a waiter that was just about to wait when it finished.
+ERROR_KEEP_S = 30
+
+
+class DownloadRegistry:
+    # Downloads in progress, to the pid of the process downloading it.
+    _owners: Dict[str, int]
+    # Why recent downloads failed, and when (monotonic), so the registry doesn't grow for every file ever downloaded.
+    _errors: Dict[str, Tuple[str, float]]
+
+    def __init__(self):
+        self._condition = Condition()
+        self._owners = {}
+        self._errors = {}
+
+    # Returns True if the caller should download it, False if it's already being downloaded.
+    def claim(self, key: str, pid: int) -> bool:
+        with self._condition:
+            if key in self._owners and self._owner_alive(key):
+                return False
+            self._owners[key] = pid
+            self._errors.pop(key, None)
+            return True
+
+    # error is why it failed, None if it worked.
+    def finish(self, key: str, error: Optional[str] = None):
+        with self._condition:
+            self._owners.pop(key, None)
+            self._forget_old_errors()
+            if error:
+                self._errors[key] = (error, monotonic())
+            else:
+                self._errors.pop(key, None)
+            self._condition.notify_all()
+
+    # Blocks until the download of key finishes (if it's being downloaded), or the timeout.
+    # Returns whether it finished, and the error if it failed.
+    def wait(self, key: str, timeout: float) -> Tuple[bool, Optional[str]]:
+        deadline = monotonic() + timeout
+        with self._condition:
+            while key in self._owners:
+                if not self._owner_alive(key):
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False, None
+                self._condition.wait(min(remaining, OWNER_CHECK_S))
+            error = self._errors.get(key)
+            if error and monotonic() - error[1] < ERROR_KEEP_S:
+                return True, error[0]
+            return True, None
+
+    def in_progress(self) -> List[str]:
+        with self._condition:
+            return list(self._owners.keys())
+
+    # Must hold the condition. Gives the download up if its process has gone.
+    def _owner_alive(self, key: str) -> bool:
+        if psutil.pid_exists(self._owners[key]):
+            return True
+        self._owners.pop(key)
+        self._forget_old_errors()
+        self._errors[key] = ("The process downloading it stopped.", monotonic())
+        self._condition.notify_all()
+        return False
+
+    # Must hold the condition.
+    def _forget_old_errors(self):
+        now = monotonic()
+        for key in [key for key, (_, failed_at) in self._errors.items() if now - failed_at >= ERROR_KEEP_S]:
+            del self._errors[key]
@@ -0,0 +1,95 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Media Metadata
+
+    Details about each audio file in the music cache, worked out once and kept next to it in <file>.meta.json
+    (see sidecar.py), so loading a track is just a lookup, rather than opening up and measuring the audio every time.
+"""
+import json
+import wave
+from typing import NamedTuple, Optional
+
+import mutagen
+
+from helpers.sidecar import atomic_write, file_key, get_or_build, in_music_cache
+
+METADATA_SUFFIX = ".meta.json"
+
+
+class MediaInfo(NamedTuple):
+    duration: float  # Seconds
+    codec: Optional[str]
+    sample_rate: Optional[int]
+    channels: Optional[int]
+    # Only known once something has decoded the audio, which normalisation does anyway.
+    loudness_dbfs: Optional[float] = None
+
+
+def metadata_filename(filename: str) -> str:
+    return filename + METADATA_SUFFIX
+
+
+# Returns the indexed details of the file, or None if there aren't any (or they're out of date).
+def read_media_info(filename: str) -> Optional[MediaInfo]:
+    try:
+        with open(metadata_filename(filename), "r") as file:
+            entry = json.load(file)
+        size, mtime_ns = file_key(filename)
+        if entry["size"] != size or entry["mtime_ns"] != mtime_ns:
+            return None
+        return MediaInfo(**entry["info"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_media_info(filename: str, info: MediaInfo):
+    size, mtime_ns = file_key(filename)
+    with atomic_write(metadata_filename(filename), "w") as file:
+        json.dump({"size": size, "mtime_ns": mtime_ns, "info": info._asdict()}, file)
+
+
+# Reads the details from the file's headers, without decoding any audio.
+# Raises ValueError if it isn't a file we can understand.
+def probe_media_info(filename: str) -> MediaInfo:
+    try:
+        audio = mutagen.File(filename)
+    except mutagen.MutagenError:
+        audio = None
+    if audio is not None and audio.info.length:
+        return MediaInfo(
+            duration=audio.info.length,
+            codec=audio.mime[0].split("/")[-1] if audio.mime else None,
+            sample_rate=getattr(audio.info, "sample_rate", None),
+            channels=getattr(audio.info, "channels", None),
+        )
+
+    # Mutagen doesn't know all the WAV variants, the headers are easy enough anyway.
+    if filename.lower().endswith(".wav"):
+        try:
+            with wave.open(filename, "rb") as file:
+                return MediaInfo(
+                    duration=file.getnframes() / file.getframerate(),
+                    codec="wav",
+                    sample_rate=file.getframerate(),
+                    channels=file.getnchannels(),
+                )
+        except (wave.Error, EOFError) as e:
+            raise ValueError("Couldn't read WAV headers of {}: {}".format(filename, e))
+
+    raise ValueError("Unrecognised audio file {}.".format(filename))
+
+
+# Looks up the file's details, probing (and indexing, if it's in the music cache) it if we don't know them yet.
+# Raises ValueError / OSError if the file can't be read.
+def get_media_info(filename: str) -> MediaInfo:
+    return get_or_build(filename, read_media_info, probe_media_info, write_media_info)
+
+
+# Adds the analysed loudness to the file's entry.
+def record_loudness(filename: str, loudness_dbfs: float):
+    info = get_media_info(filename)._replace(loudness_dbfs=loudness_dbfs)
+    if in_music_cache(filename):
+        write_media_info(filename, info)
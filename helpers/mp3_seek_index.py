@@ -0,0 +1,159 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    MP3 Seek Index
+
+    Decoders seek VBR MP3s by guessing from the Xing table of contents (1% steps, so up to 36s out on an hour long
+    pre-record), or by decoding everything up to the position, which gets slower the further into the file you go.
+    Instead, we scan the frame headers once, and keep where each frame starts in <file>.seek next to the cached file
+    (see sidecar.py).
+    A seek is then a lookup of the frame to start decoding from, and exactly what time that frame is at.
+
+    File layout:
+        header: magic, sample rate, samples per frame, size and mtime_ns of the MP3 it describes.
+        offsets (uint32): Byte offset of each audio frame, in order.
+"""
+import mmap
+import os
+from array import array
+from struct import Struct, error as StructError
+from typing import List, Optional, Tuple
+
+from helpers.sidecar import atomic_write, file_key, get_or_build
+
+SEEK_INDEX_SUFFIX = ".seek"
+HEADER = Struct("<4sIIQQ")
+MAGIC = b"BSK1"
+
+# Layer III bitrates (kbps), by bitrate index.
+BITRATES_MPEG1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+BITRATES_MPEG2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+# By version bits (MPEG 2.5, reserved, 2, 1), then sample rate index.
+SAMPLE_RATES = {0: [11025, 12000, 8000], 2: [22050, 24000, 16000], 3: [44100, 48000, 32000]}
+# Tags encoders put in a silent first frame, to describe the file rather than play.
+INFO_FRAME_TAGS = [b"Xing", b"Info", b"VBRI"]
+
+
+def seek_index_filename(filename: str) -> str:
+    return filename + SEEK_INDEX_SUFFIX
+
+
+# Returns (frame length in bytes, sample rate, samples per frame), or None if this isn't a Layer III frame header.
+def _parse_frame_header(data, pos: int) -> Optional[Tuple[int, int, int]]:
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 0x03
+    layer = (data[pos + 1] >> 1) & 0x03
+    bitrate_index = data[pos + 2] >> 4
+    sample_rate_index = (data[pos + 2] >> 2) & 0x03
+    padding = (data[pos + 2] >> 1) & 0x01
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    if version == 3:
+        bitrate = BITRATES_MPEG1[bitrate_index] * 1000
+        return 144 * bitrate // sample_rate + padding, sample_rate, 1152
+    bitrate = BITRATES_MPEG2[bitrate_index] * 1000
+    return 72 * bitrate // sample_rate + padding, sample_rate, 576
+
+
+def _id3v2_size(data) -> int:
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+class SeekIndex:
+    sample_rate: int
+    samples_per_frame: int
+    offsets: array
+
+    def __init__(self, sample_rate: int, samples_per_frame: int, offsets: array):
+        self.sample_rate = sample_rate
+        self.samples_per_frame = samples_per_frame
+        self.offsets = offsets
+
+    @property
+    def frame_s(self) -> float:
+        return self.samples_per_frame / self.sample_rate
+
+    @property
+    def duration(self) -> float:
+        return len(self.offsets) * self.frame_s
+
+    # Returns the byte offset of the frame playing at pos, and the time that frame starts.
+    def lookup(self, pos: float) -> Tuple[int, float]:
+        if not self.offsets:
+            return 0, 0
+        frame = min(max(0, int(pos / self.frame_s)), len(self.offsets) - 1)
+        return self.offsets[frame], frame * self.frame_s
+
+
+# Scans through every frame header in the file. Raises ValueError if there aren't any.
+def build_seek_index(filename: str) -> SeekIndex:
+    with open(filename, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError("{} is empty.".format(filename))
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offsets: List[int] = []
+            sample_rate = samples_per_frame = 0
+            pos = _id3v2_size(data)
+            end = len(data)
+
+            while pos + 4 <= end:
+                header = _parse_frame_header(data, pos)
+                if not header:
+                    if data[pos:pos + 3] == b"TAG":
+                        break  # ID3v1 tag, the audio's over.
+                    # Lost sync (junk, or a corrupt frame), look for the next frame.
+                    next_sync = data.find(b"\xFF", pos + 1)
+                    if next_sync < 0:
+                        break
+                    pos = next_sync
+                    continue
+
+                length, frame_sample_rate, frame_samples = header
+                if not offsets and any(tag in data[pos:pos + length] for tag in INFO_FRAME_TAGS):
+                    # Not audio, decoders skip it, so we shouldn't count it either.
+                    pos += length
+                    continue
+                if not sample_rate:
+                    sample_rate, samples_per_frame = frame_sample_rate, frame_samples
+                offsets.append(pos)
+                pos += length
+
+    if not offsets:
+        raise ValueError("No MP3 frames found in {}.".format(filename))
+    return SeekIndex(sample_rate, samples_per_frame, array("I", offsets))
+
+
+# Returns the stored index of the file, or None if there isn't one (or it's out of date).
+def read_seek_index(filename: str) -> Optional[SeekIndex]:
+    try:
+        with open(seek_index_filename(filename), "rb") as file:
+            magic, sample_rate, samples_per_frame, size, mtime_ns = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or (size, mtime_ns) != file_key(filename):
+                return None
+            offsets = array("I")
+            offsets.frombytes(file.read())
+    except (OSError, ValueError, StructError):
+        return None
+    return SeekIndex(sample_rate, samples_per_frame, offsets)
+
+
+def write_seek_index(filename: str, index: SeekIndex):
+    size, mtime_ns = file_key(filename)
+    with atomic_write(seek_index_filename(filename)) as file:
+        file.write(HEADER.pack(MAGIC, index.sample_rate, index.samples_per_frame, size, mtime_ns))
+        file.write(index.offsets.tobytes())
+
+
+# Looks up the file's index, building (and storing, if it's in the music cache) it if there isn't one yet.
+# Raises ValueError / OSError if the file can't be read.
+def get_seek_index(filename: str) -> SeekIndex:
+    return get_or_build(filename, read_seek_index, build_seek_index, write_seek_index)
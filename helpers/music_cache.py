@@ -0,0 +1,156 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Music Cache
+
+    music-tmp is kept between shows, so jingles, beds and tracks that come up again don't have to be downloaded again.
+    Each file is addressed by its track / managed id (as MyRadioAPI.get_filename names them), with everything made
+    from it (normalised copy, metadata, seek index, waveform) counted alongside. Once it's all over the budget,
+    whatever was least recently in a plan goes first, but never anything that's in a plan now.
+
+    The index (cache-index.json, in music-tmp) keeps when each file was last wanted, how often and how big it is,
+    along with the hit / miss counts.
+"""
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+INDEX_FILENAME = "cache-index.json"
+# A partial download touched this recently may still be going, leave it alone.
+PARTIAL_DOWNLOAD_KEEP_S = 3600
+
+
+# The id a file in music-tmp belongs to (eg. track-123 for track-123-normalised.mp3.peaks), None if it's not audio.
+def cache_key(name: str) -> Optional[str]:
+    if not (name.startswith("track-") or name.startswith("managed-")):
+        return None
+    key = name.split(".", 1)[0]
+    if key.endswith("-normalised"):
+        key = key[:-len("-normalised")]
+    return key
+
+
+class MusicCache:
+    path: str
+    budget_bytes: int
+    # Key to {"last_used": time, "uses": count, "size": bytes} (size of the original audio).
+    entries: Dict[str, Dict[str, Any]]
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def __init__(self, path: str, budget_bytes: int):
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self.entries = {}
+        try:
+            with open(self._index_filename(), "r") as file:
+                index = json.load(file)
+            self.entries = index["entries"]
+            self.hits, self.misses, self.evictions = index["hits"], index["misses"], index["evictions"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # No index yet (or it's broken), we'll just have to start again.
+            pass
+
+    def _index_filename(self) -> str:
+        return os.path.join(self.path, INDEX_FILENAME)
+
+    def audio_filename(self, key: str) -> str:
+        return os.path.join(self.path, key + ".mp3")
+
+    def save(self):
+        index = {"entries": self.entries, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+        temp_filename = "{}.{}.tmp".format(self._index_filename(), os.getpid())
+        with open(temp_filename, "w") as file:
+            json.dump(index, file)
+        os.replace(temp_filename, self._index_filename())
+
+    # Something's in a plan again. Returns whether we've already got it.
+    def use(self, key: str) -> bool:
+        entry = self.entries.setdefault(key, {"uses": 0})
+        entry["last_used"] = time.time()
+        entry["uses"] += 1
+
+        hit = os.path.isfile(self.audio_filename(key))
+        if hit and "size" in entry and os.path.getsize(self.audio_filename(key)) != entry["size"]:
+            # Not what we downloaded, so don't trust it.
+            self.remove(key)
+            hit = False
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    # Just downloaded.
+    def add(self, key: str):
+        entry = self.entries.setdefault(key, {"uses": 0, "last_used": time.time()})
+        entry["size"] = os.path.getsize(self.audio_filename(key))
+
+    # Every file in the cache, by key.
+    def _files(self) -> Dict[str, List[os.DirEntry]]:
+        files: Dict[str, List[os.DirEntry]] = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                key = cache_key(entry.name)
+                if key and entry.is_file():
+                    files.setdefault(key, []).append(entry)
+        return files
+
+    def size_bytes(self) -> int:
+        return sum(file.stat().st_size for group in self._files().values() for file in group)
+
+    def remove(self, key: str):
+        for file in self._files().get(key, []):
+            try:
+                os.remove(file.path)
+            except OSError:
+                pass  # Probably still open, we'll get it next time.
+        self.entries.pop(key, None)
+
+    # Removes the least recently used files until we're in budget, apart from the keep ones. Returns the keys removed.
+    def evict(self, keep: Iterable[str]) -> List[str]:
+        keep = set(keep)
+        files = self._files()
+        sizes = {key: sum(file.stat().st_size for file in group) for key, group in files.items()}
+        total = sum(sizes.values())
+
+        # Forget about anything that's gone (and isn't on its way).
+        for key in list(self.entries.keys()):
+            if key not in files and key not in keep:
+                del self.entries[key]
+
+        now = time.time()
+        candidates = []
+        for key, group in files.items():
+            if key in keep:
+                continue
+            if any(f.name.endswith(".downloading") and now - f.stat().st_mtime < PARTIAL_DOWNLOAD_KEEP_S for f in group):
+                continue
+            entry = self.entries.get(key, {})
+            # Least recently used first, then least used.
+            candidates.append((entry.get("last_used", 0), entry.get("uses", 0), key))
+        candidates.sort()
+
+        removed = []
+        for _, _, key in candidates:
+            if total <= self.budget_bytes:
+                break
+            self.remove(key)
+            total -= sizes[key]
+            removed.append(key)
+        self.evictions += len(removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "files": len(self._files()),
+            "size_bytes": self.size_bytes(),
+            "budget_bytes": self.budget_bytes,
+        }
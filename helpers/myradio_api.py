@@ -16,62 +16,179 @@
     Date:
         November 2020
 """
-from typing import Optional
+from typing import Callable, Optional
 import aiohttp
+import asyncio
 import json
 from logging import INFO, ERROR, WARNING, DEBUG
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from threading import Lock
 import time
+from weakref import WeakKeyDictionary
 
 from baps_types.plan import PlanItem
+from helpers.download_registry import DownloadRegistry
 from helpers.os_environment import resolve_external_file_path
 from helpers.logging_manager import LoggingManager
 from helpers.state_manager import StateManager
 
+# Connections to MyRadio are kept open and reused, rather than paying for a new connection (and TLS handshake)
+# on every request. These are shared by everything in the process.
+CONNECTIONS_PER_HOST = 8
+# Seconds.
+DNS_CACHE_S = 300
+KEEPALIVE_S = 30
+
+# Downloads are written to disk as they arrive, this much at a time, rather than held in memory.
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Give up on a download after this many tries, each carrying on from where the last got to.
+DOWNLOAD_ATTEMPTS = 3
+# A .downloading file that hasn't grown for this long has been given up on, so we can carry it on.
+# Longer than a request's read timeout, so a download that's still waiting on its first bytes isn't taken over.
+DOWNLOAD_STALLED_S = 15
+# How long to block a thread for at a time, waiting on another process's download.
+DOWNLOAD_WAIT_S = 5
+# Kept next to a partial download, holding the ETag (or Last-Modified) of the file it's part of.
+# We only carry a download on if the server agrees it's still the same file (If-Range), otherwise it starts again.
+VALIDATOR_SUFFIX = ".validator"
+
+# aiohttp sessions belong to the event loop they were made on, so there's one per loop.
+_async_sessions: "WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = WeakKeyDictionary()
+_sync_session: Optional[requests.Session] = None
+_sync_session_lock = Lock()
+
+
+def _get_async_session() -> aiohttp.ClientSession:
+    loop = asyncio.get_event_loop()
+    session = _async_sessions.get(loop)
+    if not session or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=CONNECTIONS_PER_HOST, ttl_dns_cache=DNS_CACHE_S, keepalive_timeout=KEEPALIVE_S
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _async_sessions[loop] = session
+    return session
+
+
+# Requests sessions can be shared between threads (the tracklisting timers etc.), as long as we only make one.
+def _get_sync_session() -> requests.Session:
+    global _sync_session
+    with _sync_session_lock:
+        if not _sync_session:
+            _sync_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=CONNECTIONS_PER_HOST, pool_maxsize=CONNECTIONS_PER_HOST)
+            _sync_session.mount("http://", adapter)
+            _sync_session.mount("https://", adapter)
+        return _sync_session
+
+
+# Closes the current event loop's session, before the loop goes away.
+async def close_async_session():
+    session = _async_sessions.pop(asyncio.get_event_loop(), None)
+    if session:
+        await session.close()
+
+
+def close_sync_session():
+    global _sync_session
+    with _sync_session_lock:
+        if _sync_session:
+            _sync_session.close()
+            _sync_session = None
+
+
+class DownloadError(Exception):
+    pass
+
+
+# The total size from a "bytes start-end/total" Content-Range header, None if the server doesn't know.
+def _content_range_total(content_range: Optional[str]) -> Optional[int]:
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1]
+    return int(total) if total.isdigit() else None
+
+
+# What to send as If-Range, to only carry on if the file hasn't changed. Weak ETags can't be used for that.
+def _range_validator(headers) -> Optional[str]:
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+def _read_validator(filename: str) -> Optional[str]:
+    try:
+        with open(filename + VALIDATOR_SUFFIX, "r") as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_validator(filename: str, validator: Optional[str]):
+    if validator:
+        with open(filename + VALIDATOR_SUFFIX, "w") as file:
+            file.write(validator)
+    else:
+        _remove_validator(filename)
+
+
+def _remove_validator(filename: str):
+    try:
+        os.remove(filename + VALIDATOR_SUFFIX)
+    except OSError:
+        pass
+
 
 class MyRadioAPI:
     logger: LoggingManager
     config: StateManager
+    # Shared with the other processes, if we've been given it, so we don't download the same file at once.
+    downloads: Optional[DownloadRegistry]
 
-    def __init__(self, logger: LoggingManager, config: StateManager):
+    def __init__(self, logger: LoggingManager, config: StateManager, downloads: Optional[DownloadRegistry] = None):
         self.logger = logger
         self.config = config
+        self.downloads = downloads
 
     async def async_call(self, url, method="GET", data=None, timeout=10):
 
-        async with aiohttp.ClientSession(read_timeout=timeout) as session:
-            if method == "GET":
-                func = session.get(url)
-                status_code = 200
-            elif method == "POST":
-                func = session.post(url, data=data)
-                status_code = 201
-            elif method == "PUT":
-                func = session.put(url)
-                status_code = 201
-            else:
-                return
-
-            async with func as response:
-                if response.status != status_code:
-                    self._logException(
-                        "Failed to get API request. Status code: "
-                        + str(response.status)
-                    )
-                    self._logException(str(await response.text()))
-                    return None  # Given the output was bad, don't forward it.
-                return await response.read()
+        session = _get_async_session()
+        client_timeout = aiohttp.ClientTimeout(sock_read=timeout)
+        if method == "GET":
+            func = session.get(url, timeout=client_timeout)
+            status_code = 200
+        elif method == "POST":
+            func = session.post(url, data=data, timeout=client_timeout)
+            status_code = 201
+        elif method == "PUT":
+            func = session.put(url, timeout=client_timeout)
+            status_code = 201
+        else:
+            return
+
+        async with func as response:
+            if response.status != status_code:
+                self._logException(
+                    "Failed to get API request. Status code: "
+                    + str(response.status)
+                )
+                self._logException(str(await response.text()))
+                return None  # Given the output was bad, don't forward it.
+            return await response.read()
 
     def call(self, url, method="GET", data=None, timeout=10, json_payload=True):
+        session = _get_sync_session()
         if method == "GET":
-            r = requests.get(url, timeout=timeout)
+            r = session.get(url, timeout=timeout)
             status_code = 200
         elif method == "POST":
-            r = requests.post(url, data, timeout=timeout)
+            r = session.post(url, data, timeout=timeout)
             status_code = 201
         elif method == "PUT":
-            r = requests.put(url, data, timeout=timeout)
+            r = session.put(url, data, timeout=timeout)
             status_code = 200
         else:
             return
@@ -83,22 +200,73 @@ class MyRadioAPI:
             self._logException(str(r.text))
         return json.loads(r.text) if json_payload else r.text
 
+    # Streams url into filename, carrying on from whatever's already in it if the server says it's still the same file.
+    # Raises DownloadError if it can't finish.
+    # progress (if given) is called with the bytes downloaded so far, and the total (or None if unknown).
+    async def async_download(
+        self, url, filename, progress: Optional[Callable[[int, Optional[int]], None]] = None, timeout=10
+    ):
+        error = "Gave up."
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            have = os.path.getsize(filename) if os.path.isfile(filename) else 0
+            validator = _read_validator(filename)
+            if have and not validator:
+                # No way to tell if what we've got is still part of the same file, so it can't be carried on.
+                self._log("Can't tell if partial download {} is current, restarting.".format(filename), WARNING)
+                os.remove(filename)
+                have = 0
+            headers = {"Range": "bytes={}-".format(have), "If-Range": validator} if have else {}
+            try:
+                async with _get_async_session().get(
+                    url, headers=headers, timeout=aiohttp.ClientTimeout(sock_read=timeout)
+                ) as response:
+                    if response.status == 206:
+                        mode = "ab"
+                        total = _content_range_total(response.headers.get("Content-Range"))
+                    elif response.status == 200:
+                        # Either it's new, the file's changed since we started,
+                        # or the server ignored the range and is sending the whole thing again.
+                        mode = "wb"
+                        have = 0
+                        total = response.content_length
+                        _write_validator(filename, _range_validator(response.headers))
+                    elif response.status == 416 and have:
+                        # What we've got doesn't fit the file anymore, start again.
+                        self._log("Can't carry on download of {}, restarting.".format(filename), WARNING)
+                        os.remove(filename)
+                        _remove_validator(filename)
+                        continue
+                    else:
+                        raise DownloadError("Status code: {}".format(response.status))
+
+                    if have:
+                        self._log("Carrying on download of {} from {} bytes.".format(filename, have))
+                    with open(filename, mode) as file:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                            file.write(chunk)
+                            have += len(chunk)
+                            if progress:
+                                progress(have, total)
+
+                if total is None or have >= total:
+                    _remove_validator(filename)
+                    return
+                error = "Cut short at {} of {} bytes.".format(have, total)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = "Interrupted: {}".format(repr(e))
+            self._log(
+                "Download of {} failed (attempt {} of {}): {}".format(filename, attempt, DOWNLOAD_ATTEMPTS, error),
+                WARNING,
+            )
+        raise DownloadError(error)
+
     async def async_api_call(
         self, url, api_version="v2", method="GET", data=None, timeout=10
     ):
-        if api_version == "v2":
-            url = "{}/v2{}".format(self.config.get()["myradio_api_url"], url)
-        elif api_version == "non":
-            url = "{}{}".format(self.config.get()["myradio_base_url"], url)
-        else:
-            self._logException("Invalid API version. Request not sent.")
+        url = self._api_url(url, api_version)
+        if not url:
             return None
 
-        if "?" in url:
-            url += "&api_key={}".format(self.config.get()["myradio_api_key"])
-        else:
-            url += "?api_key={}".format(self.config.get()["myradio_api_key"])
-
         self._log("Requesting API V2 URL with method {}: {}".format(method, url))
 
         request = None
@@ -123,19 +291,10 @@ class MyRadioAPI:
 
     def api_call(self, url, api_version="v2", method="GET", data=None, timeout=10):
 
-        if api_version == "v2":
-            url = "{}/v2{}".format(self.config.get()["myradio_api_url"], url)
-        elif api_version == "non":
-            url = "{}{}".format(self.config.get()["myradio_base_url"], url)
-        else:
-            self._logException("Invalid API version. Request not sent.")
+        url = self._api_url(url, api_version)
+        if not url:
             return None
 
-        if "?" in url:
-            url += "&api_key={}".format(self.config.get()["myradio_api_key"])
-        else:
-            url += "?api_key={}".format(self.config.get()["myradio_api_key"])
-
         self._log("Requesting API V2 URL with method {}: {}".format(method, url))
 
         request = None
@@ -209,7 +368,14 @@ class MyRadioAPI:
 
     # Audio Library
 
-    async def get_filename(self, item: PlanItem, did_download: bool = False, redownload=False):
+    # progress is as for async_download.
+    async def get_filename(
+        self,
+        item: PlanItem,
+        did_download: bool = False,
+        redownload=False,
+        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+    ):
         format = "mp3"  # TODO: Maybe we want this customisable?
         if item.trackid:
             itemType = "track"
@@ -241,55 +407,98 @@ class MyRadioAPI:
             "/music-tmp/{}-{}.{}".format(itemType, id, format)
         )
 
-        if not redownload:
+        if not redownload and os.path.isfile(filename):
             # Check if we already downloaded the file. If we did, give that, unless we're forcing a redownload.
+            self._log("Already got file: " + filename, DEBUG)
+            return (filename, False) if did_download else filename
+
+        # If something else (another channel, the preloader etc) is downloading the track, wait for it.
+        key = "{}-{}".format(itemType, id)
+        if self.downloads:
+            while not self.downloads.claim(key, os.getpid()):
+                self._log("Waiting for download to complete from another worker. " + filename, DEBUG)
+                # The registry blocks until it's done, so it has a thread of its own.
+                finished, error = await asyncio.get_event_loop().run_in_executor(
+                    None, self.downloads.wait, key, DOWNLOAD_WAIT_S
+                )
+                if not finished:
+                    continue
+                if error:
+                    self._log("Download by another worker failed: {}".format(error), ERROR)
+                    return (None, False) if did_download else None
+                if os.path.isfile(filename):
+                    return (filename, False) if did_download else filename
+                # Somehow it's gone again already, have a go ourselves.
+        elif not redownload:
+            # No one to tell us, so watch the file, however long it is, as long as it's still coming in.
+            while self._download_in_progress(filename + dl_suffix):
+                self._log("Still waiting", DEBUG)
+                await asyncio.sleep(1)
             if os.path.isfile(filename):
-                self._log("Already got file: " + filename, DEBUG)
                 return (filename, False) if did_download else filename
-
-            # If something else (another channel, the preloader etc) is downloading the track, wait for it.
-            if os.path.isfile(filename + dl_suffix):
-                time_waiting_s = 0
-                self._log(
-                    "Waiting for download to complete from another worker. " + filename,
-                    DEBUG,
-                )
-                while time_waiting_s < 20:
-                    # TODO: Make something better here.
-                    # If the connectivity is super poor or we're loading reeaaaalllly long files,
-                    # this may be annoying, but this is just in case somehow the other api download gives up.
-                    if os.path.isfile(filename):
-                        # Now the file is downloaded successfully
-                        return (filename, False) if did_download else filename
-                    time_waiting_s += 1
-                    self._log("Still waiting", DEBUG)
-                    time.sleep(1)
+            # Otherwise, they've given up, so we'll carry on from wherever they got to.
 
         # File doesn't exist, download it.
+        error: Optional[str] = "Cancelled."
         try:
-            # Just create the file to stop other sources from trying to download too.
-            open(filename + dl_suffix, "a").close()
-        except Exception:
-            self.logger.log.exception("Couldn't create new temp file.")
+            error = await self._download(url, filename, dl_suffix, redownload, progress)
+        finally:
+            if self.downloads:
+                self.downloads.finish(key, error)
+
+        if error:
+            self._log("Failed to download {}: {}".format(filename, error), ERROR)
             return (None, False) if did_download else None
 
-        request = await self.async_api_call(url, api_version="non")
+        self._log("Successfully re/downloaded file.", DEBUG)
+        return (filename, True) if did_download else filename
+
+    # Returns why it failed, None if it worked.
+    async def _download(
+        self,
+        url: str,
+        filename: str,
+        dl_suffix: str,
+        redownload: bool,
+        progress: Optional[Callable[[int, Optional[int]], None]],
+    ) -> Optional[str]:
+        try:
+            # Just create the file to stop other sources from trying to download too.
+            # Anything already in it is from a download that didn't finish, which we'll carry on from.
+            open(filename + dl_suffix, "w" if redownload else "a").close()
+            if redownload:
+                _remove_validator(filename + dl_suffix)
+        except Exception as e:
+            self.logger.log.exception("Couldn't create new temp file.")
+            return "Couldn't create temp file: {}".format(e)
 
-        if not request or not isinstance(request, (bytes, bytearray)):
-            # Remove the .downloading temp file given we gave up trying to download.
-            os.remove(filename + dl_suffix)
-            return (None, False) if did_download else None
+        url = self._api_url(url, "non")
+        self._log("Downloading: {}".format(url))
+        finished = False
+        try:
+            await self.async_download(url, filename + dl_suffix, progress)
+            finished = True
+        except DownloadError as e:
+            return str(e)
+        finally:
+            # Even if we've been cancelled, whatever we've got so far can be carried on from next time.
+            if not finished and os.path.isfile(filename + dl_suffix) and not os.path.getsize(filename + dl_suffix):
+                os.remove(filename + dl_suffix)
+                _remove_validator(filename + dl_suffix)
 
         try:
-            with open(filename + dl_suffix, "wb") as file:
-                file.write(request)
-            os.rename(filename + dl_suffix, filename)
+            os.replace(filename + dl_suffix, filename)
         except Exception as e:
             self._logException("Failed to write music file: {}".format(e))
-            return (None, False) if did_download else None
+            return "Failed to write music file: {}".format(e)
+        return None
 
-        self._log("Successfully re/downloaded file.", DEBUG)
-        return (filename, True) if did_download else filename
+    # Whether a .downloading file is still growing.
+    def _download_in_progress(self, dl_filename: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(dl_filename) < DOWNLOAD_STALLED_S
+        except OSError:
+            return False  # Finished (or given up on).
 
     # Gets the list of managed music playlists.
     async def get_playlist_music(self):
@@ -365,7 +574,7 @@ class MyRadioAPI:
 
         self._log("Tracklisting item: '{}'".format(item.name))
 
-        source: str = self.config.get()["myradio_api_tracklist_source"]
+        source: str = self.config.get_value("myradio_api_tracklist_source")
         data = {
             "trackid": item.trackid,
             "sourceid": int(source) if source.isnumeric() else source,
@@ -398,6 +607,22 @@ class MyRadioAPI:
 
         self.api_call("/tracklistItem/{}/endtime".format(tracklistitemid), method="PUT")
 
+    # The full URL of an API endpoint, with our key. None if the version isn't one we know.
+    def _api_url(self, url: str, api_version: str) -> Optional[str]:
+        if api_version == "v2":
+            url = "{}/v2{}".format(self.config.get_value("myradio_api_url"), url)
+        elif api_version == "non":
+            url = "{}{}".format(self.config.get_value("myradio_base_url"), url)
+        else:
+            self._logException("Invalid API version. Request not sent.")
+            return None
+
+        if "?" in url:
+            url += "&api_key={}".format(self.config.get_value("myradio_api_key"))
+        else:
+            url += "?api_key={}".format(self.config.get_value("myradio_api_key"))
+        return url
+
     def _log(self, text: str, level: int = INFO):
         self.logger.log.log(level, "MyRadio API: " + text)
 
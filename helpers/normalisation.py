@@ -1,6 +1,8 @@
 import os
 from pydub import AudioSegment, effects  # Audio leveling!
 
+from helpers.media_metadata import record_loudness
+
 # Stuff to help make BAPSicle play out leveled audio.
 
 # Takes filename in, normalialises it and returns a normalised file path.
@@ -23,7 +25,18 @@ def generate_normalised_file(filename: str):
     sound = AudioSegment.from_file(filename, "mp3")
     normalised_sound = effects.normalize(sound)
 
-    normalised_sound.export(normalised_filename, bitrate="320k", format="mp3")
+    # Only swap it in once it's finished, so one stopped part way through never looks like it's done.
+    temp_filename = "{}.{}.tmp".format(normalised_filename, os.getpid())
+    normalised_sound.export(temp_filename, bitrate="320k", format="mp3")
+    os.replace(temp_filename, normalised_filename)
+
+    # We've decoded both anyway, so note down how loud they are while we're here.
+    try:
+        record_loudness(filename, sound.dBFS)
+        record_loudness(normalised_filename, normalised_sound.dBFS)
+    except (OSError, ValueError):
+        pass
+
     return normalised_filename
 
 
@@ -0,0 +1,75 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Playback Position
+
+    Works out where playback has got to from the monotonic clock, rather than trusting the audio backend's
+    position directly. Backends (pygame's get_pos() especially) only move on once per buffer they hand over,
+    drift from real time, and know nothing about the audio still sitting in the output buffer.
+
+    The clock runs freely from when playback started, and each time the backend reports a position, it's nudged back
+    in line with it. What's actually audible lags behind what's been handed to the output by its buffer latency.
+"""
+import time
+from typing import Optional
+
+# If we're this far out from the backend, something jumped (a seek, the next track), just start again from it.
+RESYNC_S = 0.1
+# How much of the remaining error to correct each time the backend tells us we're running fast.
+CORRECTION_GAIN = 0.2
+
+
+class PlaybackClock:
+    # The backend's position (seconds) at _anchor_time, whilst running.
+    _anchor_pos: float = 0
+    _anchor_time: float = 0
+    # Where playback was asked to start from, we never report anything earlier.
+    _start_pos: float = 0
+    _running: bool = False
+
+    # output_latency_s: How long audio sits in the output buffer before it's heard.
+    # granularity_s: How far behind the backend's position may be, just because of how often it updates.
+    def __init__(self, output_latency_s: float = 0, granularity_s: float = 0):
+        self.output_latency_s = output_latency_s
+        self.granularity_s = granularity_s
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self, pos: float, now: Optional[float] = None):
+        self._anchor_pos = pos
+        self._anchor_time = now if now is not None else time.monotonic()
+        self._start_pos = pos
+        self._running = True
+
+    # Freezes the position where it got to.
+    def stop(self, now: Optional[float] = None):
+        if self._running:
+            self._anchor_pos = self._start_pos = self.position(now)
+            self._running = False
+
+    def correct(self, backend_pos: float, now: Optional[float] = None):
+        if not self._running:
+            return
+        now = now if now is not None else time.monotonic()
+        error = backend_pos - (self._anchor_pos + now - self._anchor_time)
+
+        if abs(error) > RESYNC_S:
+            self._anchor_pos = backend_pos
+            self._anchor_time = now
+        elif error > 0:
+            # The backend is only ever behind the truth, so it's never wrong to catch up with it.
+            self._anchor_pos += error
+        elif error < -self.granularity_s:
+            # We're running fast by more than the backend's own resolution, ease back rather than jumping.
+            self._anchor_pos += (error + self.granularity_s) * CORRECTION_GAIN
+
+    # Seconds into the track that's audible right now.
+    def position(self, now: Optional[float] = None) -> float:
+        if not self._running:
+            return self._anchor_pos
+        now = now if now is not None else time.monotonic()
+        return max(self._start_pos, self._anchor_pos + now - self._anchor_time - self.output_latency_s)
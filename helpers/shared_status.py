@@ -0,0 +1,147 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Shared Status
+
+    Each player publishes its latest status, and its playback position, into blocks of shared memory,
+    so anything else (web server, websockets) can read them instantly, without asking the player over a queue.
+
+    StatusSlot layout:
+        seq (uint64): Odd whilst the player is part way through writing, bumped to even once done.
+        length (uint64): Bytes of status JSON that follow, 0 if nothing published yet, or it didn't fit.
+        status JSON (utf-8)
+
+    PositionClock layout:
+        seq (uint64): As above.
+        pos_true, remaining, length (double): Seconds, as in the player's status.
+        updated (double): time.time() when the player last wrote it.
+        playing (bool)
+
+    There's only ever one writer per block, readers just retry if the seq changed under them (a seqlock).
+    The writer bumps the seq to odd, writes everything else, and only then bumps it to even on its own.
+"""
+from multiprocessing import shared_memory
+from struct import Struct
+from time import sleep, time
+from typing import NamedTuple, Optional
+
+SEQ = Struct("Q")
+HEADER = Struct("QQ")
+LENGTH = Struct("Q")
+POSITION = Struct("Qdddd?")
+# Everything in POSITION after the seq.
+POSITION_VALUES = Struct("dddd?")
+# Plenty for a few hundred plan items, anything bigger falls back to asking the player.
+DEFAULT_SIZE = 1024 * 1024
+READ_RETRIES = 50
+READ_RETRY_WAIT_S = 0.0005
+
+
+class SharedBlock:
+    size: int
+    _memory: shared_memory.SharedMemory
+    _owner: bool
+    _seq: int = 0
+
+    # With no name, creates a new (zeroed) block as the owner, otherwise attaches to an existing one.
+    def __init__(self, name: Optional[str] = None, size: int = DEFAULT_SIZE):
+        self._owner = name is None
+        if self._owner:
+            self._memory = shared_memory.SharedMemory(create=True, size=size)
+            self._memory.buf[:size] = bytes(size)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self.size = size
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    # Other processes get a handle to the same block, not a copy.
+    def __reduce__(self):
+        return (self.__class__, (self.name, self.size))
+
+    def close(self):
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+
+class StatusSlot(SharedBlock):
+
+    def publish(self, status: str):
+        data = status.encode("utf-8")
+        buf = self._memory.buf
+        length = len(data)
+        if HEADER.size + length > self.size:
+            # Too big, make sure nobody reads an out of date status, they'll have to ask the player.
+            length = 0
+
+        self._seq = SEQ.unpack_from(buf, 0)[0] + 1
+        SEQ.pack_into(buf, 0, self._seq)
+        if length:
+            buf[HEADER.size:HEADER.size + length] = data
+        LENGTH.pack_into(buf, SEQ.size, length)
+        self._seq += 1
+        SEQ.pack_into(buf, 0, self._seq)
+
+    # Returns the latest status JSON, or None if there isn't one to read.
+    def read(self) -> Optional[str]:
+        buf = self._memory.buf
+        for _ in range(READ_RETRIES):
+            seq, length = HEADER.unpack_from(buf, 0)
+            if seq % 2:
+                # Mid write, it'll be done in a moment.
+                sleep(READ_RETRY_WAIT_S)
+                continue
+            if not length:
+                return None
+            data = bytes(buf[HEADER.size:HEADER.size + length])
+            if HEADER.unpack_from(buf, 0)[0] == seq:
+                return data.decode("utf-8")
+        return None
+
+
+class Position(NamedTuple):
+    pos_true: float
+    remaining: float
+    length: float
+    updated: float
+    playing: bool
+
+    # Where playback should have got to by now, assuming it's carried on since the player last updated.
+    def pos_now(self, now: Optional[float] = None) -> float:
+        if not self.playing:
+            return self.pos_true
+        elapsed = max(0, (now if now is not None else time()) - self.updated)
+        return min(self.length, self.pos_true + elapsed)
+
+
+class PositionClock(SharedBlock):
+    def __init__(self, name: Optional[str] = None, size: int = POSITION.size):
+        super().__init__(name, size)
+
+    def update(self, pos_true: float, remaining: float, length: float, playing: bool):
+        buf = self._memory.buf
+        self._seq = SEQ.unpack_from(buf, 0)[0] + 1
+        SEQ.pack_into(buf, 0, self._seq)
+        POSITION_VALUES.pack_into(buf, SEQ.size, pos_true, remaining, length, time(), playing)
+        self._seq += 1
+        SEQ.pack_into(buf, 0, self._seq)
+
+    # Returns the latest position, or None if the player hasn't written one yet.
+    def read(self) -> Optional[Position]:
+        buf = self._memory.buf
+        for _ in range(READ_RETRIES):
+            values = POSITION.unpack_from(buf, 0)
+            seq = values[0]
+            if seq % 2 or SEQ.unpack_from(buf, 0)[0] != seq:
+                # Mid write, it'll be done in a moment.
+                sleep(READ_RETRY_WAIT_S)
+                continue
+            if not seq:
+                return None
+            return Position(*values[1:])
+        return None
@@ -0,0 +1,70 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Sidecar Files
+
+    What we work out about each audio file in the music cache (metadata, MP3 seek index, waveform peaks) is kept
+    next to it, as <file><suffix>, so it's only ever worked out once.
+
+    Each sidecar records the size and modification time of the file it describes,
+    so a re-downloaded or replaced file gets worked out again.
+    Files outside of the music cache are just worked out each time, we don't want to litter people's folders.
+"""
+import os
+from contextlib import contextmanager
+from typing import IO, Callable, Iterator, Optional, Tuple, TypeVar
+
+from helpers.os_environment import resolve_external_file_path
+
+T = TypeVar("T")
+
+
+def in_music_cache(filename: str) -> bool:
+    cache_path = os.path.realpath(resolve_external_file_path("/music-tmp/"))
+    return os.path.dirname(os.path.realpath(filename)) == cache_path
+
+
+# What a sidecar has to match, to still describe its file. Raises OSError if the file isn't there.
+def file_key(filename: str) -> Tuple[int, int]:
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Several processes may work out the same file at once, so write a private copy and swap it in once it's done.
+@contextmanager
+def atomic_write(filename: str, mode: str = "wb") -> Iterator[IO]:
+    temp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        with open(temp_filename, mode) as file:
+            yield file
+        os.replace(temp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+
+
+# Reads the stored value, or if there isn't one (read returns None), builds it, storing it if it's in the music cache.
+# Anything build raises is passed on.
+def get_or_build(
+    filename: str,
+    read: Callable[[str], Optional[T]],
+    build: Callable[[str], T],
+    write: Callable[[str, T], None],
+) -> T:
+    value = read(filename)
+    if value is not None:
+        return value
+
+    value = build(filename)
+    if in_music_cache(filename):
+        try:
+            write(filename, value)
+        except OSError:
+            # We'll just have to work it out again next time.
+            pass
+    return value
@@ -1,24 +1,60 @@
 import json
 import os
 from logging import DEBUG, INFO
+from threading import Condition, Lock, Thread
 import time
 from datetime import datetime
 from copy import copy
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Set
 
 from baps_types.plan import PlanItem
 from helpers.logging_manager import LoggingManager
 from helpers.os_environment import resolve_external_file_path
 
 
+# How long to let updates pile up before writing them to disk in one go.
+DEFAULT_WRITE_INTERVAL_S = 0.5
+
+
+class StateSnapshot(Mapping):
+    # A read-only view of the state, as it was at a given version.
+    # The state manager never modifies a state dict in place once it's been stored,
+    # so this can safely share it rather than making a copy.
+    version: int
+
+    def __init__(self, state: Dict[str, Any], version: int):
+        self._state = state
+        self.version = version
+
+    def __getitem__(self, key: str) -> Any:
+        return self._state[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._state)
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+
 class StateManager:
     filepath: str
     logger: LoggingManager
-    callbacks: List[Any] = []
+    # These are all set per instance, in __init__, several state managers can share a process (see audio_engine.py).
+    callbacks: List[Any]
     __state = {}
+    # Bumped on every change to the state, so readers can cheaply tell if anything has changed.
+    __version = 0
+    # The version each key was last changed at.
+    __key_versions: Dict[str, int]
     # Dict of times that params can be updated after, if the time is before current time, it can be written immediately.
-    __rate_limit_params_until = {}
+    __rate_limit_params_until: Dict[str, float]
     __rate_limit_period_s = 0
+    # Keys only kept in memory, never written to (or read back from) disk, for things that are stale after a restart.
+    __transient_params: Set[str]
+    # Writes to disk happen in the background, at most once per interval, and always of the latest state.
+    __write_interval_s = DEFAULT_WRITE_INTERVAL_S
+    __write_pending = False
+    __last_write_time = 0.0
 
     def __init__(
         self,
@@ -27,8 +63,16 @@ class StateManager:
         default_state: Dict[str, Any] = None,
         rate_limit_params=[],
         rate_limit_period_s=5,
+        write_interval_s=DEFAULT_WRITE_INTERVAL_S,
+        transient_params=[],
     ):
         self.logger = logger
+        self.callbacks = []
+        self.__key_versions = {}
+        self.__rate_limit_params_until = {}
+        self.__transient_params = set(transient_params)
+        self.__write_interval_s = write_interval_s
+        self._start_writer()
 
         path_dir: str = resolve_external_file_path("/state")
         if not os.path.isdir(path_dir):
@@ -61,6 +105,8 @@ class StateManager:
         else:
             try:
                 file_state: Dict[str, Any] = json.loads(file_raw)
+                for key in self.__transient_params:
+                    file_state.pop(key, None)
 
                 # Turn from JSON -> PlanItem
                 if "channel" in file_state:
@@ -106,12 +152,98 @@ class StateManager:
 
     @state.setter
     def state(self, state):
-        self.__state = copy(state)
+        self._set_state(copy(state))
+
+    # Cheap reads, these don't copy the whole state.
+    def get_value(self, key: str, default: Any = None) -> Any:
+        return self.__state.get(key, default)
+
+    def snapshot(self) -> StateSnapshot:
+        return StateSnapshot(self.__state, self.__version)
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+    # Useful for pipeproxy, since it can't read attributes direct.
+    def get_version(self) -> int:
+        return self.__version
+
+    def changed_since(self, version: Optional[int]) -> bool:
+        return version is None or self.__version != version
+
+    def changed_keys_since(self, version: Optional[int]) -> List[str]:
+        if version is None:
+            return list(self.__state.keys())
+        return [key for key, key_version in self.__key_versions.items() if key_version > version]
+
+    # The given dict must not be modified after this, snapshots may be holding onto it.
+    def _set_state(self, state: Dict[str, Any], changed_key: Optional[str] = None):
+        self.__state = state
+        self.__version += 1
+        if changed_key:
+            self.__key_versions[changed_key] = self.__version
+        else:
+            self.__key_versions = {key: self.__version for key in (state or {}).keys()}
+
+    # The writer thread and its locks can't be sent to other processes, make new ones when we get there.
+    # Callbacks are for this process only too.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attr in ["_StateManager__writer", "_StateManager__write_condition", "_StateManager__file_lock", "callbacks"]:
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.callbacks = []
+        self._start_writer()
+
+    def _start_writer(self):
+        self.__write_condition = Condition()
+        self.__file_lock = Lock()
+        self.__writer = Thread(target=self._writer, name="StateManagerWriter", daemon=True)
+        self.__writer.start()
+
+    def _schedule_write(self):
+        with self.__write_condition:
+            self.__write_pending = True
+            self.__write_condition.notify()
+
+    def _writer(self):
+        while True:
+            with self.__write_condition:
+                while not self.__write_pending:
+                    self.__write_condition.wait()
+
+            # Give any burst of updates a chance to land, so they all go out in the one write.
+            wait_s = self.__last_write_time + self.__write_interval_s - time.monotonic()
+            if wait_s > 0:
+                time.sleep(wait_s)
+
+            self.flush()
+
+    # Write any pending changes to disk now. Call this before quitting, else the last changes may be lost.
+    def flush(self):
+        with self.__file_lock:
+            with self.__write_condition:
+                if not self.__write_pending:
+                    return
+                self.__write_pending = False
+                state = self.__state
+
+            try:
+                self.write_to_file(state)
+            except Exception:
+                self._logException("Failed to write state to file.")
+            self.__last_write_time = time.monotonic()
 
     def write_to_file(self, state):
 
         # Make sure we're not manipulating state
         state_to_json = copy(state)
+        for key in self.__transient_params:
+            state_to_json.pop(key, None)
 
         now = datetime.now()
 
@@ -133,8 +265,11 @@ class StateManager:
         except Exception:
             self._logException("Failed to dump JSON state.")
         else:
-            with open(self.filepath, "w") as file:
+            # Write to a temp file and swap it in, so anything reading the state file never sees half of it.
+            temp_filepath = self.filepath + ".tmp"
+            with open(temp_filepath, "w") as file:
                 file.write(state_json)
+            os.replace(temp_filepath, self.filepath)
 
     def update(self, key: str, value: Any, index: int = -1):
         update_file = True
@@ -148,9 +283,9 @@ class StateManager:
                     self._currentTimeS + self.__rate_limit_period_s
                 )
 
-        state_to_update = self.state
+        current_state = self.__state
 
-        if key in state_to_update and index == -1 and state_to_update[key] == value:
+        if key in current_state and index == -1 and current_state[key] == value:
             allow = False
 
             # It's hard to compare lists, especially of complex objects like show plans, just write it.
@@ -160,9 +295,9 @@ class StateManager:
             # If the two objects have dict representations, and they don't match, allow writing.
             # TODO: This should be easier.
             if getattr(value, "__dict__", None) and getattr(
-                state_to_update[key], "__dict__", None
+                current_state[key], "__dict__", None
             ):
-                if value.__dict__ != state_to_update[key].__dict__:
+                if value.__dict__ != current_state[key].__dict__:
                     allow = True
 
             if not allow:
@@ -184,6 +319,9 @@ class StateManager:
                 # This happens to reduce spam on file writes / callbacks fired when update_file is true.
                 return
 
+        # Don't touch the current state dict, snapshots may be using it. We'll swap in a copy.
+        state_to_update = copy(current_state)
+
         if index > -1 and key in state_to_update:
             if not isinstance(state_to_update[key], list):
                 self._log(
@@ -194,7 +332,7 @@ class StateManager:
                     DEBUG,
                 )
                 return
-            list_items = state_to_update[key]
+            list_items = copy(state_to_update[key])
             if index >= len(list_items):
                 self._log(
                     "Not updating state for key '{}' with value '{}' of type '{}' because index '{}' is too large..".format(
@@ -208,18 +346,19 @@ class StateManager:
         else:
             state_to_update[key] = value
 
-        self.state = state_to_update
+        self._set_state(state_to_update, key)
 
         if update_file:
-            self._log(
-                "Writing change to key '{}' with value '{}' of type '{}' to disk.".format(
-                    key, value, type(value)
-                ),
-                DEBUG,
-            )
-            # Either a routine write, or state has changed.
-            # Update the file
-            self.write_to_file(state_to_update)
+            if key not in self.__transient_params:
+                self._log(
+                    "Queueing write of change to key '{}' with value '{}' of type '{}' to disk.".format(
+                        key, value, type(value)
+                    ),
+                    DEBUG,
+                )
+                # Either a routine write, or state has changed.
+                # Let the writer update the file, along with anything else that's changed in the meantime.
+                self._schedule_write()
             # Now tell any callback functions.
             for callback in self.callbacks:
                 try:
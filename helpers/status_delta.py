@@ -0,0 +1,120 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Player Status Deltas
+
+    Rather than sending the whole channel status (show plan and all) on every change,
+    players send a full status once, then small patches of what's changed since.
+
+    A delta looks like:
+        {
+            "seq": 12,  # Increments by 1 each delta, a gap means one was missed.
+            "changed": {"playing": true, ...},  # Any top level status keys that changed.
+            "plan_items": {"<timeslotitemid>": {...}},  # Any plan items that are new or changed.
+            "plan_order": ["<timeslotitemid>", ...],  # Only present if items were added/removed/moved.
+        }
+
+    Full statuses carry "status_seq", the seq of the last delta they include.
+"""
+from typing import Any, Dict, List, Mapping, Optional
+
+from helpers.state_manager import StateManager
+
+PLAN_KEYS = ["show_plan"]
+
+
+def serialise_status(state: Mapping[str, Any]) -> Dict[str, Any]:
+    status = dict(state)
+
+    # Not the biggest fan of this, but maybe I'll get a better solution for this later
+    status["loaded_item"] = (
+        status["loaded_item"].__dict__ if status["loaded_item"] else None
+    )
+    status["show_plan"] = [repr.__dict__ for repr in status["show_plan"]]
+    return status
+
+
+# Keeps track of what the clients have been sent, so the player can work out what to send next.
+class StatusDeltaTracker:
+    seq: int = 0
+    _sent_version: Optional[int]
+    _sent_items: Dict[str, Dict[str, Any]]
+    _sent_order: List[str]
+
+    def __init__(self):
+        self._sent_version = None
+        self._sent_items = {}
+        self._sent_order = []
+
+    def delta(self, state: StateManager) -> Optional[Dict[str, Any]]:
+        snapshot = state.snapshot()
+        changed_keys = state.changed_keys_since(self._sent_version)
+        self._sent_version = snapshot.version
+
+        changed: Dict[str, Any] = {}
+        for key in changed_keys:
+            if key in PLAN_KEYS or key not in snapshot:
+                continue
+            value = snapshot[key]
+            if key == "loaded_item":
+                value = value.__dict__ if value else None
+            changed[key] = value
+
+        # Plan items are often modified in place, so we can't rely on the state telling us they changed.
+        # Comparing the dicts is cheap compared to serialising the whole plan, so just check them all.
+        plan_items: Dict[str, Dict[str, Any]] = {}
+        order: List[str] = []
+        for item in snapshot.get("show_plan", []):
+            item_dict = item.__dict__
+            item_id = item_dict["timeslotitemid"]
+            order.append(item_id)
+            if self._sent_items.get(item_id) != item_dict:
+                plan_items[item_id] = item_dict
+
+        order_changed = order != self._sent_order
+        if not (changed or plan_items or order_changed):
+            return None
+
+        for item_id in plan_items:
+            self._sent_items[item_id] = plan_items[item_id]
+        if order_changed:
+            self._sent_items = {item_id: self._sent_items[item_id] for item_id in order}
+            self._sent_order = order
+
+        self.seq += 1
+        delta: Dict[str, Any] = {"seq": self.seq, "changed": changed, "plan_items": plan_items}
+        if order_changed:
+            delta["plan_order"] = order
+        return delta
+
+
+# Returns the new status, or None if a delta was missed and a full status is needed to catch up.
+def apply_status_delta(
+    status: Optional[Dict[str, Any]], delta: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    if not status or "status_seq" not in status:
+        return None
+
+    if delta["seq"] <= status["status_seq"]:
+        # We already have this change, the full status we got was newer than it.
+        return status
+    if delta["seq"] != status["status_seq"] + 1:
+        return None
+
+    new_status = dict(status)
+    new_status.update(delta["changed"])
+
+    plan_items = delta.get("plan_items", {})
+    if plan_items or "plan_order" in delta:
+        items = {item["timeslotitemid"]: item for item in status["show_plan"]}
+        items.update(plan_items)
+        order = delta.get("plan_order", [item["timeslotitemid"] for item in status["show_plan"]])
+        if any(item_id not in items for item_id in order):
+            # We've somehow not seen this item before, we're out of sync.
+            return None
+        new_status["show_plan"] = [items[item_id] for item_id in order]
+
+    new_status["status_seq"] = delta["seq"]
+    return new_status
@@ -0,0 +1,209 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Waveform Peaks
+
+    Rather than every client downloading and decoding a whole file just to draw its waveform, we decode it once,
+    and keep the min / max of each block of samples in <file>.peaks next to the cached file (see sidecar.py).
+    There's a level for each zoom, each with half the peaks of the one before, so any zoom is only a few kilobytes.
+
+    File layout:
+        header: magic, sample rate, samples per peak (zoom 0), number of levels, number of peaks (zoom 0),
+                size and mtime_ns of the audio file it describes.
+        levels: For each zoom, from 0 (most detailed), a (min, max) pair of int8s per peak.
+"""
+from struct import Struct, error as StructError
+from subprocess import DEVNULL, PIPE, Popen
+from typing import IO, Any, Dict, List, Optional
+
+import numpy as np
+from pydub import AudioSegment
+
+from helpers.media_metadata import get_media_info
+from helpers.sidecar import atomic_write, file_key, get_or_build
+
+PEAKS_SUFFIX = ".peaks"
+HEADER = Struct("<4sIIIIQQ")
+MAGIC = b"BPK1"
+
+# About 170 peaks a second at 44.1kHz, plenty for zooming right in on a cue point.
+SAMPLES_PER_PEAK = 256
+# Stop halving once a level is this small, it'll fit across any screen.
+MIN_LEVEL_PEAKS = 512
+MAX_LEVELS = 16
+# The audio is decoded and reduced to peaks this many at a time (about 6s at 44.1kHz, 1.5MB of stereo),
+# so working out the peaks takes the same memory however long the file is.
+DECODE_CHUNK_PEAKS = 1024
+SAMPLE_WIDTH = 2  # 16 bit
+# If we can't tell from the file's headers.
+DEFAULT_SAMPLE_RATE = 44100
+DEFAULT_CHANNELS = 2
+
+
+def peaks_filename(filename: str) -> str:
+    return filename + PEAKS_SUFFIX
+
+
+# Min / max of each block of samples_per_peak samples, across all the channels.
+# samples is int16, shape (frames, channels), or just (frames,) if mono. Returns int8, shape (peaks, 2).
+def compute_peaks(samples: np.ndarray, samples_per_peak: int = SAMPLES_PER_PEAK) -> np.ndarray:
+    if not len(samples):
+        raise ValueError("No samples to find the peaks of.")
+    samples = samples.reshape(len(samples), -1)
+
+    count = -(-len(samples) // samples_per_peak)
+    # Pad the last block with its last frame, so the padding can't change its peaks.
+    samples = np.pad(samples, ((0, count * samples_per_peak - len(samples)), (0, 0)), mode="edge")
+    # Each row is every channel of every sample in the block.
+    blocks = samples.reshape(count, -1)
+    lows, highs = blocks.min(axis=1), blocks.max(axis=1)
+    # 16 bit down to 8, it's only for drawing.
+    return np.stack([lows >> 8, highs >> 8], axis=1).astype(np.int8)
+
+
+# The next zoom level out, combining each pair of peaks.
+def halve_peaks(peaks: np.ndarray) -> np.ndarray:
+    if len(peaks) % 2:
+        peaks = np.concatenate([peaks, peaks[-1:]])
+    pairs = peaks.reshape(-1, 2, 2)
+    return np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)], axis=1)
+
+
+class WaveformPeaks:
+    sample_rate: int
+    samples_per_peak: int
+    levels: List[np.ndarray]
+
+    def __init__(self, sample_rate: int, samples_per_peak: int, levels: List[np.ndarray]):
+        self.sample_rate = sample_rate
+        self.samples_per_peak = samples_per_peak
+        self.levels = levels
+
+    @classmethod
+    def from_samples(cls, samples: np.ndarray, sample_rate: int, samples_per_peak: int = SAMPLES_PER_PEAK):
+        return cls.from_peaks(compute_peaks(samples, samples_per_peak), sample_rate, samples_per_peak)
+
+    # Works out the other zoom levels from the most detailed one.
+    @classmethod
+    def from_peaks(cls, peaks: np.ndarray, sample_rate: int, samples_per_peak: int = SAMPLES_PER_PEAK):
+        levels = [peaks]
+        while len(levels) < MAX_LEVELS and len(levels[-1]) > MIN_LEVEL_PEAKS:
+            levels.append(halve_peaks(levels[-1]))
+        return cls(sample_rate, samples_per_peak, levels)
+
+    # In the audiowaveform JSON format (as used by peaks.js etc), with which zoom it is, and how many there are.
+    # Raises ValueError if there's no such zoom.
+    def as_json(self, zoom: int) -> Dict[str, Any]:
+        if not 0 <= zoom < len(self.levels):
+            raise ValueError("Zoom must be between 0 and {}.".format(len(self.levels) - 1))
+        level = self.levels[zoom]
+        return {
+            "version": 2,
+            "channels": 1,
+            "sample_rate": self.sample_rate,
+            "samples_per_pixel": self.samples_per_peak << zoom,
+            "bits": 8,
+            "length": len(level),
+            "zoom": zoom,
+            "zoom_levels": len(self.levels),
+            "data": level.flatten().tolist(),
+        }
+
+
+# The peaks of int16 PCM read from stream, a chunk at a time, the same as compute_peaks would give for all of it.
+# Each chunk is a whole number of peaks, so only the very last one can be short.
+def read_pcm_peaks(
+    stream: IO[bytes],
+    channels: int,
+    samples_per_peak: int = SAMPLES_PER_PEAK,
+    chunk_peaks: int = DECODE_CHUNK_PEAKS,
+) -> np.ndarray:
+    frame_bytes = channels * SAMPLE_WIDTH
+    chunk_bytes = chunk_peaks * samples_per_peak * frame_bytes
+    peaks = []
+    while True:
+        chunk = stream.read(chunk_bytes)
+        # Anything short of a whole frame can only be cut off at the end.
+        chunk = chunk[:len(chunk) - len(chunk) % frame_bytes]
+        if not chunk:
+            break
+        peaks.append(compute_peaks(np.frombuffer(chunk, dtype=np.int16).reshape(-1, channels), samples_per_peak))
+    if not peaks:
+        raise ValueError("No samples to find the peaks of.")
+    return np.concatenate(peaks)
+
+
+# Decodes the whole file with ffmpeg (or avconv, whichever pydub found), as it goes, rather than all into memory.
+# Raises OSError if there's no ffmpeg, ValueError if it can't decode the file.
+def build_peaks(filename: str) -> WaveformPeaks:
+    info = get_media_info(filename)
+    sample_rate = info.sample_rate or DEFAULT_SAMPLE_RATE
+    channels = info.channels or DEFAULT_CHANNELS
+    process = Popen(
+        [
+            AudioSegment.converter, "-nostdin", "-loglevel", "error", "-i", filename,
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(channels), "-ar", str(sample_rate), "-",
+        ],
+        stdin=DEVNULL,
+        stdout=PIPE,
+        stderr=DEVNULL,
+    )
+    try:
+        peaks = read_pcm_peaks(process.stdout, channels)
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise ValueError("Couldn't decode {}, {} exited with {}.".format(
+                filename, AudioSegment.converter, process.returncode
+            ))
+    return WaveformPeaks.from_peaks(peaks, sample_rate)
+
+
+# Returns the stored peaks of the file, or None if there aren't any (or they're out of date).
+def read_peaks(filename: str) -> Optional[WaveformPeaks]:
+    try:
+        with open(peaks_filename(filename), "rb") as file:
+            magic, sample_rate, samples_per_peak, level_count, count, size, mtime_ns = HEADER.unpack(
+                file.read(HEADER.size)
+            )
+            if magic != MAGIC or (size, mtime_ns) != file_key(filename):
+                return None
+            data = np.frombuffer(file.read(), dtype=np.int8)
+    except (OSError, ValueError, StructError):
+        return None
+
+    levels = []
+    offset = 0
+    for _ in range(level_count):
+        if offset + count * 2 > len(data):
+            return None  # Cut short.
+        levels.append(data[offset:offset + count * 2].reshape(count, 2))
+        offset += count * 2
+        count = -(-count // 2)
+    return WaveformPeaks(sample_rate, samples_per_peak, levels)
+
+
+def write_peaks(filename: str, peaks: WaveformPeaks):
+    size, mtime_ns = file_key(filename)
+    with atomic_write(peaks_filename(filename)) as file:
+        file.write(
+            HEADER.pack(
+                MAGIC,
+                peaks.sample_rate,
+                peaks.samples_per_peak,
+                len(peaks.levels),
+                len(peaks.levels[0]),
+                size,
+                mtime_ns,
+            )
+        )
+        for level in peaks.levels:
+            file.write(level.astype(np.int8).tobytes())
+
+
+# Looks up the file's peaks, working them out (and storing them, if it's in the music cache) if there aren't any yet.
+# Raises if the file can't be decoded.
+def get_peaks(filename: str) -> WaveformPeaks:
+    return get_or_build(filename, read_peaks, build_peaks, write_peaks)
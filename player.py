@@ -19,57 +19,135 @@
 # It is key that whenever the parent server tells us to do something
 # that we respond with something, FAIL or OKAY. The server doesn't like to be kept waiting.
 
-# Stop the Pygame Hello message.
 import os
-os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
-from helpers.os_environment import isLinux
-# It's the only one we could get to work.
-if isLinux():
-    os.putenv('SDL_AUDIODRIVER', 'pulseaudio')
-
 from queue import Empty
+import asyncio
 import multiprocessing
 import setproctitle
 import copy
 import json
 import time
-from typing import Any, Callable, Dict, List, Optional
-from pygame import mixer
-from mutagen.mp3 import MP3
+from typing import Any, Callable, Coroutine, Dict, List, Mapping, NamedTuple, Optional, Union
 from syncer import sync
-from threading import Timer
+from threading import Thread, Timer
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 
 from helpers.normalisation import get_normalised_filename_if_available, get_original_filename_from_normalised
-from helpers.myradio_api import MyRadioAPI
+from helpers.media_metadata import get_media_info
+from helpers.mp3_seek_index import get_seek_index
+from helpers.myradio_api import MyRadioAPI, close_async_session, close_sync_session
+from helpers.download_registry import DownloadRegistry
 from helpers.state_manager import StateManager
+from helpers.status_delta import StatusDeltaTracker, serialise_status
+from helpers.shared_status import PositionClock, StatusSlot
+from helpers.playback_position import PlaybackClock
+from helpers.command_registry import DEFERRED, CommandRegistry, bool_arg, float_arg, int_arg, str_arg
 from helpers.logging_manager import LoggingManager
+from audio_backends import DEFAULT_AUDIO_BACKEND, AudioBackend, get_backend
 from baps_types.plan import PlanItem
 from baps_types.marker import Marker
+from baps_types.message import Command, Message, Source
 import package
 
-# TODO ENUM
-VALID_MESSAGE_SOURCES = ["WEBSOCKET", "UI", "CONTROLLER", "TEST", "ALL"]
 TRACKLISTING_DELAYED_S = 20
 
+# How often to refresh the shared position clock whilst playing.
+POS_UPDATE_FREQ_S = 0.2
+# When nothing is playing, there's no scheduled work, so only wake up this often to keep state fresh.
+IDLE_WAKEUP_S = 1
+# Never spin faster than this, even if we're right on top of the end of a track.
+MIN_WAKEUP_S = 0.01
+# How long to wait for a fetch in the background to finish, when quitting.
+FETCH_SHUTDOWN_TIMEOUT_S = 5
+# These move with playback, and anything that wants them live reads the position clock instead.
+# So them changing on their own doesn't need the whole status republishing to the status slot.
+POSITION_STATE_KEYS = {"pos", "pos_offset", "pos_true", "remaining"}
+# Status changes go out as deltas, but every so often send everything, for anything that's lost track.
+STATUS_KEYFRAME_EVERY = 50
+# How often to log how long each command has been taking.
+COMMAND_STATS_INTERVAL_S = 300
+# Hand the prepared next item to the mixer this close to the end, so late plan changes rarely need undoing.
+GAPLESS_QUEUE_BEFORE_END_S = 3
+# The mixer's position jumping back by more than this, whilst something is queued, means the next item started.
+GAPLESS_SWITCH_THRESHOLD_S = 0.25
+# Playing, but the mixer's position hasn't moved for this long, means the output has stalled.
+OUTPUT_STALL_S = 2
+# How often to check the chosen output device is still there.
+OUTPUT_DEVICE_CHECK_S = 5
+# Don't try re-initialising the output more often than this, in case it just keeps failing.
+OUTPUT_RECOVERY_BACKOFF_S = 10
+
+
+# The next plan item, ready to go as soon as the current one ends.
+class PreparedItem(NamedTuple):
+    timeslotitemid: Any
+    filename: str
+    length: float
+
 
 class Player:
+    in_q: multiprocessing.Queue
     out_q: multiprocessing.Queue
-    last_msg: str
-    last_msg_source: str
-    last_time_update = None
+    last_msg: Optional[Message] = None
+    next_pos_update: float = 0
+    next_command_stats: float = 0
+    next_device_check: float = 0
+    next_output_recovery: float = 0
+    last_pos_progress: float = 0
+    # Set when the mixer errors on us, so the watchdog knows to recover the output.
+    output_fault: Optional[str] = None
 
     state: StateManager
+    status_tracker: StatusDeltaTracker
+    # Something in the state changed since the clients were last sent a delta.
+    status_changed: bool = False
+    status_slot: Optional[StatusSlot]
+    # The state version last published to the status slot.
+    published_version: Optional[int] = None
+    position_clock: Optional[PositionClock]
+    playback_clock: PlaybackClock
+    audio: AudioBackend
+    commands: CommandRegistry
     logger: LoggingManager
     api: MyRadioAPI
+    # For the background threads' MyRadio requests, so they can keep reusing the same connections.
+    api_loop: asyncio.AbstractEventLoop
+
+    shared_process: bool = False
+    # In the audio engine, requests to MyRadio (downloads, show plans) run on a thread of our own (see _fetch),
+    # so they don't hold up every other channel. The command waiting on it replies once it's done,
+    # and anything else sent to us in the meantime waits its turn, as it would in a process of our own.
+    fetcher: Optional[ThreadPoolExecutor] = None
+    fetch_loop: Optional[asyncio.AbstractEventLoop] = None
+    fetching: Optional[Future] = None
+    fetch_then: Callable[[Any], Any]
+    fetch_message: Optional[Message] = None
+    fetch_okay_str: bool = False
+    held_messages: List[Message]
 
     running: bool = False
 
+    # What the mixer is doing, as far as we know. Our own commands keep these up to date as they go,
+    # and the mixer is asked once per tick (_probe_engine) to catch anything it does by itself.
+    engine_initialised: bool = False
+    engine_loaded: bool = False
+    engine_busy: bool = False
+
     stopped_manually: bool = False
 
     tracklist_start_timer: Optional[Timer] = None
     tracklist_end_timer: Optional[Timer] = None
 
+    # Gapless auto advance.
+    next_prepare_thread: Optional[Thread] = None
+    next_prepare_id: Any = None
+    next_prepared: Optional[PreparedItem] = None
+    next_queued: Optional[PlanItem] = None
+    # The plan / settings changed since it was queued, so it's not what should come next any more.
+    next_queued_stale: bool = False
+    last_mixer_pos: float = 0
+
     __default_state = {
         "initialised": False,
         "loaded_item": None,
@@ -90,83 +168,58 @@ class Player:
         "live": True,
         "tracklist_mode": "off",
         "tracklist_id": None,
+        "next_ready": False,
+        "output_recoveries": 0,
+        # The configured backend, and why, if it couldn't be started (so we're on a fallback, see audio_backend).
+        "audio_backend": None,
+        "audio_backend_failed": None,
     }
 
     __rate_limited_params = ["pos", "pos_offset", "pos_true", "remaining"]
 
     @property
     def isInit(self):
-        try:
-            mixer.music.get_busy()
-        except Exception:
-            return False
-
-        return True
+        return self.engine_initialised
 
     @property
     def isPlaying(self) -> bool:
         if self.isInit:
-            return (not self.isPaused) and bool(mixer.music.get_busy())
+            return (not self.isPaused) and self.engine_busy
         return False
 
     @property
     def isPaused(self) -> bool:
-        return self.state.get()["paused"]
+        return self.state.get_value("paused")
 
     @property
     def isLoaded(self):
-        return self._isLoaded()
-
-    def _isLoaded(self, short_test: bool = False):
-        if not self.state.get()["loaded_item"]:
+        if not self.state.get_value("loaded_item"):
             return False
-        if self.isPlaying:
-            return True
-
-        # If we don't want to do any testing if it's really loaded, fine.
-        if short_test:
-            return True
+        return self.isInit and self.engine_loaded
 
-        # Because Pygame/SDL is annoying
-        # We're not playing now, so we can quickly test run
-        # If that works, we're loaded.
+    # The only cheap thing the mixer can tell us, so ask it once a tick, rather than every time we need to know.
+    def _probe_engine(self):
         try:
-            mixer.music.set_volume(0)
-            mixer.music.play(0)
+            self.engine_busy = self.audio.get_busy()
+            self.engine_initialised = True
         except Exception:
-            try:
-                mixer.music.set_volume(1)
-            except Exception:
-                self.logger.log.exception(
-                    "Failed to reset volume after attempting loaded test."
-                )
-                pass
-            return False
-        finally:
-            mixer.music.stop()
-
-        mixer.music.set_volume(1)
-        return True
+            self.engine_initialised = False
+            self.engine_busy = False
 
     @property
     def isCued(self):
-        # Don't mess with playback, we only care about if it's supposed to be loaded.
-        if not self._isLoaded(short_test=True):
+        if not self.isLoaded:
             return False
         return (
-            self.state.get()["pos_true"] == self.state.get()["loaded_item"].cue
+            self.state.get_value("pos_true") == self.state.get_value("loaded_item").cue
             and not self.isPlaying
         )
 
     @property
     def status(self):
-        state = copy.copy(self.state.state)
-
-        # Not the biggest fan of this, but maybe I'll get a better solution for this later
-        state["loaded_item"] = (
-            state["loaded_item"].__dict__ if state["loaded_item"] else None
-        )
-        state["show_plan"] = [repr.__dict__ for repr in state["show_plan"]]
+        state = serialise_status(self.state.snapshot())
+        # Lets clients know which status delta to carry on from.
+        state["status_seq"] = self.status_tracker.seq
 
         res = json.dumps(state)
         return res
@@ -179,10 +232,16 @@ class Player:
             self.logger.log.warning("Player is not loaded.")
             return False
         try:
-            mixer.music.play(0, pos)
+            self.audio.play(pos)
+            self.playback_clock.output_latency_s = self.audio.output_latency_s
+            self.playback_clock.start(pos)
+            self.engine_busy = True
+            self.last_mixer_pos = 0
+            self.last_pos_progress = time.monotonic()
             self.state.update("pos_offset", pos)
-        except Exception:
+        except Exception as e:
             self.logger.log.exception("Failed to play at pos: " + str(pos))
+            self.output_fault = "failed to play: {}".format(e)
             return False
         self.state.update("paused", False)
         self._potentially_tracklist()
@@ -191,10 +250,14 @@ class Player:
 
     def pause(self):
         try:
-            mixer.music.stop()
+            self.audio.stop()
         except Exception:
             self.logger.log.exception("Failed to pause.")
             return False
+        self.engine_busy = False
+        self.playback_clock.stop()
+        # Stopping the mixer drops anything queued.
+        self.next_queued = None
 
         self.stopped_manually = True
         self.state.update("paused", True)
@@ -202,7 +265,7 @@ class Player:
 
     def unpause(self):
         if not self.isPlaying:
-            state = self.state.get()
+            state = self.state.snapshot()
             position: float = state["pos_true"]
             if not self.play(position):
                 self.logger.log.exception(
@@ -223,10 +286,13 @@ class Player:
 
     def stop(self, user_initiated: bool = False):
         try:
-            mixer.music.stop()
+            self.audio.stop()
         except Exception:
             self.logger.log.exception("Failed to stop playing.")
             return False
+        self.engine_busy = False
+        self.playback_clock.stop()
+        self.next_queued = None
         self.state.update("paused", False)
 
         if user_initiated:
@@ -234,14 +300,14 @@ class Player:
 
         self.stopped_manually = True
 
-        if not self.state.get()["loaded_item"]:
+        if not self.state.get_value("loaded_item"):
             self.logger.log.warning("Tried to stop without a loaded item.")
             return True
 
         # This lets users toggle (using the stop button) between cue point and 0.
         if user_initiated and not self.isCued:
             # if there's a cue point ant we're not at it, go there.
-            self.seek(self.state.get()["loaded_item"].cue)
+            self.seek(self.state.get_value("loaded_item").cue)
         else:
             # Otherwise, let's go to 0.
             self.seek(0)
@@ -284,9 +350,11 @@ class Player:
 
     # Show Plan Related Methods
     def get_plan(self, message: int):
-        plan = sync(self.api.get_showplan(message))
+        return self._fetch(self.api.get_showplan(message), self._load_plan)
+
+    def _load_plan(self, plan):
         self.clear_channel_plan()
-        channel = self.state.get()["channel"]
+        channel = self.state.get_value("channel")
         self.logger.log.debug(plan)
         if not isinstance(plan, dict):
             return False
@@ -310,7 +378,7 @@ class Player:
             # (to stop items somehow simultaneously added to different channels from having the same id)
             # And chuck in the unix epoch in ns for good measure.
             item.timeslotitemid = "GHOST-{}-{}".format(
-                self.state.get()["channel"], time.time_ns()
+                self.state.get_value("channel"), time.time_ns()
             )
         return item
 
@@ -318,7 +386,7 @@ class Player:
     def add_to_plan(self, new_item: Dict[str, Any]) -> bool:
         new_item_obj = PlanItem(new_item)
         new_item_obj = self._check_ghosts(new_item_obj)
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
+        plan_copy: List[PlanItem] = copy.copy(self.state.get_value("show_plan"))
         # Shift any plan items after the new position down one to make space.
         for item in plan_copy:
             if item.weight >= new_item_obj.weight:
@@ -328,7 +396,7 @@ class Player:
 
         self._fix_and_update_weights(plan_copy)
 
-        loaded_item = self.state.get()["loaded_item"]
+        loaded_item = self.state.get_value("loaded_item")
         if loaded_item:
 
             # Right. So this may be confusing.
@@ -360,7 +428,7 @@ class Player:
         return True
 
     def remove_from_plan(self, weight: int) -> bool:
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
+        plan_copy: List[PlanItem] = copy.copy(self.state.get_value("show_plan"))
         found: Optional[PlanItem] = None
 
         before = []
@@ -381,7 +449,7 @@ class Player:
 
             # If we removed the loaded item from this channel, update it's weight
             # So we know how/not to autoadvance.
-            loaded_item = self.state.get()["loaded_item"]
+            loaded_item = self.state.get_value("loaded_item")
             if loaded_item == found:
                 # Loaded_item is actually the same PlanItem instance as in the show_plan.
                 # So if it's still in the show plan, we'll have corrected it's weight already.
@@ -410,156 +478,173 @@ class Player:
         return True
 
     def load(self, weight: int):
-        if not self.isPlaying:
-            # If we have something loaded already, unload it first.
-            self.unload()
-
-            loaded_state = self.state.get()
-
-            # Sometimes (at least on windows), the pygame player will lose output to the sound output after a while.
-            # It's odd, but essentially, to stop / recover from this, we de-init the pygame mixer and init it again.
-            self.logger.log.info(
-                "Resetting output (in case of sound output gone silent somehow) to "
-                + str(loaded_state["output"])
-            )
-            self.output(loaded_state["output"])
+        if self.isPlaying:
+            return False
 
-            showplan = loaded_state["show_plan"]
+        # If we have something loaded already, unload it first.
+        self.unload()
 
-            loaded_item: Optional[PlanItem] = None
+        loaded_state = self.state.snapshot()
 
-            # Go find the show plan item of the weight we've been asked to load.
-            for i in range(len(showplan)):
-                if showplan[i].weight == weight:
-                    loaded_item = showplan[i]
-                    break
+        # This used to re-init the output on every load, in case it had gone silent.
+        # The output watchdog (_check_output) now only does that when the output actually looks unhealthy.
 
-            # If we didn't find it, exit.
-            if loaded_item is None:
-                self.logger.log.error(
-                    "Failed to find weight: {}".format(weight))
-                return False
+        showplan = loaded_state["show_plan"]
 
-            # This item exists, so we're comitting to load this item.
-            self.state.update("loaded_item", loaded_item)
+        loaded_item: Optional[PlanItem] = None
 
-            # The file_manager helper may have pre-downloaded the file already, or we've played it before.
-            reload = False
-            if loaded_item.filename == "" or loaded_item.filename is None:
-                self.logger.log.info(
-                    "Filename is not specified, loading from API.")
-                reload = True
-            elif not os.path.exists(loaded_item.filename):
-                self.logger.log.warn(
-                    "Filename given doesn't exist. Re-loading from API."
-                )
-                reload = True
+        # Go find the show plan item of the weight we've been asked to load.
+        for i in range(len(showplan)):
+            if showplan[i].weight == weight:
+                loaded_item = showplan[i]
+                break
 
-            # Ask the API for the file if we need it.
-            if reload:
-                file = sync(self.api.get_filename(item=loaded_item))
-                loaded_item.filename = str(file) if file else None
+        # If we didn't find it, exit.
+        if loaded_item is None:
+            self.logger.log.error(
+                "Failed to find weight: {}".format(weight))
+            return False
 
-            # If the API still couldn't get the file, RIP.
-            if not loaded_item.filename:
-                return False
+        # This item exists, so we're comitting to load this item.
+        self.state.update("loaded_item", loaded_item)
 
-            # Swap with a normalised version if it's ready, else returns original.
-            loaded_item.filename = get_normalised_filename_if_available(
-                loaded_item.filename
+        # The file_manager helper may have pre-downloaded the file already, or we've played it before.
+        reload = False
+        if loaded_item.filename == "" or loaded_item.filename is None:
+            self.logger.log.info(
+                "Filename is not specified, loading from API.")
+            reload = True
+        elif not os.path.exists(loaded_item.filename):
+            self.logger.log.warn(
+                "Filename given doesn't exist. Re-loading from API."
             )
+            reload = True
 
-            # Given we've just messed around with filenames etc, update the item again.
-            self.state.update("loaded_item", loaded_item)
-            for i in range(len(showplan)):
-                if showplan[i].weight == weight:
-                    self.state.update("show_plan", index=i, value=loaded_item)
-                break
+        # Ask the API for the file if we need it.
+        if reload:
+            return self._fetch(
+                self.api.get_filename(item=loaded_item),
+                lambda file: self._load_fetched(weight, loaded_item, loaded_state, str(file) if file else None),
+            )
+        return self._load_fetched(weight, loaded_item, loaded_state, loaded_item.filename)
 
-            load_attempt = 0
+    def _load_fetched(self, weight: int, loaded_item: PlanItem, loaded_state: Mapping, filename: Optional[str]):
+        loaded_item.filename = filename
 
-            # Let's have 5 attempts at loading the item audio
-            while load_attempt < 5:
-                load_attempt += 1
+        # If the API still couldn't get the file, RIP.
+        if not loaded_item.filename:
+            return False
 
-                original_file = None
-                if load_attempt == 3:
-                    # Ok, we tried twice already to load the file.
-                    # Let's see if we can recover from this.
-                    # Try swapping the normalised version out for the original.
-                    original_file = get_original_filename_from_normalised(
-                        loaded_item.filename
-                    )
-                    self.logger.log.warning("3rd attempt. Trying the non-normalised file: {}".format(original_file))
+        # Swap with a normalised version if it's ready, else returns original.
+        loaded_item.filename = get_normalised_filename_if_available(
+            loaded_item.filename
+        )
 
-                if load_attempt == 4:
-                    # well, we've got so far that the normalised and original files didn't load.
-                    # Take a last ditch effort to download the original file again.
-                    file = sync(self.api.get_filename(item=loaded_item, redownload=True))
-                    if file:
-                        original_file = str(file)
-                    self.logger.log.warning("4rd attempt. Trying to redownload the file, got: {}".format(original_file))
+        # Given we've just messed around with filenames etc, update the item again.
+        self.state.update("loaded_item", loaded_item)
+        showplan = loaded_state["show_plan"]
+        for i in range(len(showplan)):
+            if showplan[i].weight == weight:
+                self.state.update("show_plan", index=i, value=loaded_item)
+            break
 
-                if original_file:
-                    loaded_item.filename = original_file
+        return self._load_attempts(weight, loaded_item, loaded_state)
 
-                try:
-                    self.logger.log.info(
-                        "Attempt {} Loading file: {}".format(load_attempt, loaded_item.filename))
-                    mixer.music.load(loaded_item.filename)
-                except Exception:
-                    # We couldn't load that file.
-                    self.logger.log.exception(
-                        "Couldn't load file: " + str(loaded_item.filename)
+    # redownloaded: The file we downloaded again on the 4th attempt, "" if that didn't work, None if we've not yet.
+    def _load_attempts(
+        self,
+        weight: int,
+        loaded_item: PlanItem,
+        loaded_state: Mapping,
+        first_attempt: int = 1,
+        redownloaded: Optional[str] = None,
+    ):
+        load_attempt = first_attempt - 1
+
+        # Let's have 5 attempts at loading the item audio
+        while load_attempt < 5:
+            load_attempt += 1
+
+            original_file = None
+            if load_attempt == 3:
+                # Ok, we tried twice already to load the file.
+                # Let's see if we can recover from this.
+                # Try swapping the normalised version out for the original.
+                original_file = get_original_filename_from_normalised(
+                    loaded_item.filename
+                )
+                self.logger.log.warning("3rd attempt. Trying the non-normalised file: {}".format(original_file))
+
+            if load_attempt == 4:
+                # well, we've got so far that the normalised and original files didn't load.
+                # Take a last ditch effort to download the original file again.
+                if redownloaded is None:
+                    return self._fetch(
+                        self.api.get_filename(item=loaded_item, redownload=True),
+                        lambda file: self._load_attempts(weight, loaded_item, loaded_state, 4, str(file) if file else ""),
                     )
-                    continue  # Try loading again.
+                original_file = redownloaded or None
+                self.logger.log.warning("4rd attempt. Trying to redownload the file, got: {}".format(original_file))
 
-                if not self.isLoaded:
-                    self.logger.log.error(
-                        "Pygame loaded file without error, but never actually loaded."
-                    )
-                    continue  # Try loading again.
+            if original_file:
+                loaded_item.filename = original_file
 
-                try:
-                    if loaded_item.filename.endswith(".mp3"):
-                        song = MP3(loaded_item.filename)
-                        self.state.update("length", song.info.length)
-                    else:
-                        # WARNING! Pygame / SDL can't seek .wav files :/
-                        self.state.update(
-                            "length",
-                            mixer.Sound(
-                                loaded_item.filename).get_length() / 1000,
-                        )
-                except Exception:
-                    self.logger.log.exception(
-                        "Failed to update the length of item.")
-                    continue  # Try loading again.
+            try:
+                self.logger.log.info(
+                    "Attempt {} Loading file: {}".format(load_attempt, loaded_item.filename))
+                self.engine_loaded = False
+                self.audio.load(loaded_item.filename)
+                # Only ever check this straight after loading, it's audible on some backends.
+                self.engine_loaded = self.audio.verify_loaded()
+            except Exception:
+                # We couldn't load that file.
+                self.logger.log.exception(
+                    "Couldn't load file: " + str(loaded_item.filename)
+                )
+                continue  # Try loading again.
 
-                # Everything worked, we made it!
-                # Write the loaded item again once more, to confirm the filename if we've reattempted.
-                self.state.update("loaded_item", loaded_item)
+            if not self.isLoaded:
+                self.logger.log.error(
+                    "Pygame loaded file without error, but never actually loaded."
+                )
+                continue  # Try loading again.
 
-                if loaded_item.cue > 0:
-                    self.seek(loaded_item.cue)
-                else:
-                    self.seek(0)
+            try:
+                # The file manager usually indexed this when it downloaded it, so this is just a lookup.
+                self.state.update("length", get_media_info(loaded_item.filename).duration)
+            except Exception:
+                self.logger.log.exception(
+                    "Failed to update the length of item.")
+                continue  # Try loading again.
 
-                if loaded_state["play_on_load"]:
-                    self.unpause()
+            # Everything worked, we made it!
+            # Write the loaded item again once more, to confirm the filename if we've reattempted.
+            self.state.update("loaded_item", loaded_item)
 
-                return True
+            if loaded_item.cue > 0:
+                self.seek(loaded_item.cue)
+            else:
+                self.seek(0)
 
-            # Even though we failed, make sure state is up to date with latest failure.
-            # We're comitting to load this item.
-            self.state.update("loaded_item", loaded_item)
+            if loaded_state["play_on_load"]:
+                self.unpause()
+
+            return True
+
+        # Even though we failed, make sure state is up to date with latest failure.
+        # We're comitting to load this item.
+        self.state.update("loaded_item", loaded_item)
 
         return False
 
     def unload(self):
         if not self.isPlaying:
             try:
-                mixer.music.unload()
+                self.audio.unload()
+                self.engine_loaded = False
+                self.engine_busy = False
+                self.playback_clock.stop()
+                self.next_queued = None
                 self.state.update("paused", False)
                 self.state.update("loaded_item", None)
             except Exception:
@@ -575,16 +660,21 @@ class Player:
 
     def quit(self):
         try:
-            mixer.quit()
+            self.audio.quit()
+            self.engine_initialised = False
+            self.engine_loaded = False
+            self.engine_busy = False
+            self.playback_clock.stop()
+            self.next_queued = None
             self.state.update("paused", False)
-            self.logger.log.info("Quit mixer.")
+            self.logger.log.info("Quit audio output.")
         except Exception:
-            self.logger.log.exception("Failed to quit mixer.")
+            self.logger.log.exception("Failed to quit audio output.")
 
     def output(self, name: Optional[str] = None):
         wasPlaying = self.isPlaying
 
-        state = self.state.get()
+        state = self.state.snapshot()
         oldPos = state["pos_true"]
 
         name = None if (not name or name.lower() == "none") else name
@@ -592,25 +682,27 @@ class Player:
         self.quit()
         self.state.update("output", name)
         try:
-            if name:
-                mixer.init(44100, -16, 2, 1024, devicename=name)
-            else:
-                mixer.init(44100, -16, 2, 1024)
+            self.audio.refresh_output_devices()
+            self.audio.init(name)
+            self.engine_initialised = True
         except Exception:
             self.logger.log.exception(
-                "Failed to init mixer with device name: " + str(name)
+                "Failed to init {} audio output with device name: {}".format(self.audio.name, name)
             )
             return False
 
+        def resume(loaded: Any):
+            if wasPlaying:
+                self.logger.log.info("Resuming playback after output change.")
+                self.play(oldPos)
+            return True
+
         loadedItem = state["loaded_item"]
         if loadedItem:
             self.logger.log.info("Reloading after output change.")
-            self.load(loadedItem.weight)
-        if wasPlaying:
-            self.logger.log.info("Resuming playback after output change.")
-            self.play(oldPos)
-
-        return True
+            # In the audio engine, the load may be waiting on a download, only resume once it's done.
+            return self._after(self.load(loadedItem.weight), resume)
+        return resume(None)
 
     # Timeslotitemid can be a ghost (un-submitted item), so may be "IXXX"
     def set_marker(self, timeslotitemid: str, marker_str: str):
@@ -630,15 +722,15 @@ class Player:
             set_loaded = True
             if not self.isLoaded:
                 return False
-            timeslotitemid = self.state.get()["loaded_item"].timeslotitemid
+            timeslotitemid = self.state.get_value("loaded_item").timeslotitemid
         elif (
             self.isLoaded
-            and self.state.get()["loaded_item"].timeslotitemid == timeslotitemid
+            and self.state.get_value("loaded_item").timeslotitemid == timeslotitemid
         ):
             set_loaded = True
 
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
-        for i in range(len(self.state.get()["show_plan"])):
+        plan_copy: List[PlanItem] = copy.copy(self.state.get_value("show_plan"))
+        for i in range(len(self.state.get_value("show_plan"))):
 
             item = plan_copy[i]
 
@@ -672,7 +764,7 @@ class Player:
         return success
 
     def set_played(self, weight: int, played: bool):
-        plan: List[PlanItem] = self.state.get()["show_plan"]
+        plan: List[PlanItem] = self.state.get_value("show_plan")
         if weight == -1:
             for item in plan:
                 item.play_count_increment() if played else item.play_count_reset()
@@ -700,7 +792,7 @@ class Player:
 
     # This essentially allows the tracklist end API call to happen in a separate thread, to avoid hanging playout/loading.
     def _potentially_tracklist(self):
-        mode = self.state.get()["tracklist_mode"]
+        mode = self.state.get_value("tracklist_mode")
 
         time: int = -1
         if mode in ["on", "fader-live"]:
@@ -732,14 +824,14 @@ class Player:
             self.tracklist_start_timer = None
 
             # Decrement Played count on track we didn't play much of.
-            state = self.state.get()
+            state = self.state.snapshot()
             loaded_item = state["loaded_item"]
             if loaded_item and loaded_item.type == "central":
                 loaded_item.play_count_decrement()
                 self.state.update("loaded_item", loaded_item)
 
         # Make a copy of the tracklist_id, it will get reset as we load the next item.
-        tracklist_id = self.state.get()["tracklist_id"]
+        tracklist_id = self.state.get_value("tracklist_id")
         if not tracklist_id:
             self.logger.log.info("No tracklist to end.")
             return
@@ -767,7 +859,7 @@ class Player:
             )
 
     def _tracklist_start(self):
-        state = self.state.get()
+        state = self.state.snapshot()
         loaded_item = state["loaded_item"]
         if not loaded_item:
             self.logger.log.error(
@@ -824,7 +916,7 @@ class Player:
     def _ended(self):
         self._potentially_end_tracklist()
 
-        state = self.state.get()
+        state = self.state.snapshot()
 
         loaded_item = state["loaded_item"]
 
@@ -876,10 +968,11 @@ class Player:
 
         # No automations, just stop playing.
         self.stop()
-        self._retAll("STOPPED")  # Tell clients that we've stopped playing.
+        self._retAll(Command.STOPPED)  # Tell clients that we've stopped playing.
 
     def _updateState(self, pos: Optional[float] = None):
 
+        self._probe_engine()
         self.state.update("initialised", self.isInit)
         if self.isInit:
             if pos is not None:
@@ -889,11 +982,24 @@ class Player:
             elif self.isPlaying:
                 # This is the bit that makes the time actually progress during playback.
                 # Get one last update in, incase we're about to pause/stop it.
-                self.state.update("pos", max(0, mixer.music.get_pos() / 1000))
+                mixer_pos = self.audio.get_pos()
+                if self.next_queued and mixer_pos + GAPLESS_SWITCH_THRESHOLD_S < self.last_mixer_pos:
+                    # The mixer has moved straight onto the queued item.
+                    if self.next_queued_stale:
+                        self._stop_stale_queued()
+                    else:
+                        self._advanced_to_next()
+                # Unless that was the wrong item, and it's just been stopped.
+                if self.isPlaying:
+                    if mixer_pos != self.last_mixer_pos:
+                        self.last_pos_progress = time.monotonic()
+                    self.last_mixer_pos = mixer_pos
+                    self.state.update("pos", mixer_pos)
+                    self.playback_clock.correct(mixer_pos + self.state.get_value("pos_offset"))
 
             # If the state is changing from playing to not playing, and the user didn't stop it, the item must have ended.
             if (
-                self.state.get()["playing"]
+                self.state.get_value("playing")
                 and not self.isPlaying
                 and not self.stopped_manually
             ):
@@ -902,66 +1008,287 @@ class Player:
             self.state.update("playing", self.isPlaying)
             self.state.update("loaded", self.isLoaded)
 
-            self.state.update(
-                "pos_true",
-                min(
-                    self.state.get()["length"],
-                    self.state.get()["pos"] + self.state.get()["pos_offset"],
-                ),
-            )
+            if self.isPlaying:
+                # Much finer than the mixer's position, and allows for what's still in the output buffer.
+                pos_true = self.playback_clock.position()
+            else:
+                pos_true = self.state.get_value("pos") + self.state.get_value("pos_offset")
+            self.state.update("pos_true", min(self.state.get_value("length"), pos_true))
 
             self.state.update(
                 "remaining",
-                max(0, (self.state.get()["length"] -
-                    self.state.get()["pos_true"])),
+                max(0, (self.state.get_value("length") -
+                    self.state.get_value("pos_true"))),
             )
 
-    def _ping_times(self):
+    # Sometimes (at least on windows), the pygame player will lose output to the sound output after a while.
+    # Keep an eye out for that, or the device going away, and re-init the mixer to recover, but only when needed.
+    def _check_output(self):
+        now = time.monotonic()
+        output = self.state.get_value("output")
+
+        fault = self.output_fault
+        if not fault and not self.isInit:
+            fault = "mixer is not initialised"
+        if not fault and self.isPlaying and now - self.last_pos_progress > OUTPUT_STALL_S:
+            fault = "playback has stalled at {:.2f}s".format(self.last_mixer_pos)
+        if not fault and output and now >= self.next_device_check:
+            self.next_device_check = now + OUTPUT_DEVICE_CHECK_S
+            try:
+                if output not in self.audio.output_devices():
+                    fault = "output device '{}' has gone".format(output)
+            except Exception as e:
+                fault = "couldn't list output devices: {}".format(e)
+
+        if not fault or now < self.next_output_recovery:
+            return
+
+        self.next_output_recovery = now + OUTPUT_RECOVERY_BACKOFF_S
+        self.output_fault = None
+        self.logger.log.warning("Output looks unhealthy ({}), re-initialising {}.".format(fault, output))
+        if self.output(output):
+            self.state.update("output_recoveries", self.state.get_value("output_recoveries") + 1)
+        else:
+            self.logger.log.error("Failed to recover output, will try again.")
+
+    # The item auto advance would load when the current one ends, if any.
+    def _next_item(self) -> Optional[PlanItem]:
+        state = self.state.snapshot()
+        loaded_item = state["loaded_item"]
+        if not loaded_item or loaded_item.weight < 0:
+            return None
+        if not state["auto_advance"] or state["repeat"] == "one":
+            return None
+
+        showplan = state["show_plan"]
+        if len(showplan) > loaded_item.weight + 1:
+            return showplan[loaded_item.weight + 1]
+        if state["repeat"] == "all" and showplan:
+            return showplan[0]
+        return None
+
+    # Keeps the next item prepared in the background, and queued with the mixer near the end, so we advance without a gap.
+    def _update_next_item(self):
+        next_item = self._next_item()
+        next_id = next_item.timeslotitemid if next_item else None
+
+        if self.next_queued:
+            # The mixer can't drop what's queued without restarting what's on air, so leave it be,
+            # and if it's still not right once it starts, stop it there instead (see _stop_stale_queued).
+            stale = not self._can_queue(next_item)
+            if stale != self.next_queued_stale:
+                self.logger.log.info("Next item {}, {} is {}.".format(
+                    "changed" if stale else "changed back",
+                    self.next_queued.name,
+                    "no longer next" if stale else "next again",
+                ))
+                self.next_queued_stale = stale
+
+        if next_id != self.next_prepare_id:
+            self.next_prepare_id = next_id
+            self.next_prepared = None
+            if next_item and not (self.next_prepare_thread and self.next_prepare_thread.is_alive()):
+                # It'll pick the new item up on a later tick, if the old one's still going.
+                self.next_prepare_thread = Thread(
+                    target=self._prepare_next, args=(next_item,), daemon=True
+                )
+                self.next_prepare_thread.start()
+            elif next_item:
+                self.next_prepare_id = None
+
+        prepared = self.next_prepared
+        ready = bool(prepared and prepared.timeslotitemid == next_id)
+        self.state.update("next_ready", ready)
 
-        UPDATES_FREQ_SECS = 0.2
         if (
-            self.last_time_update is None
-            or self.last_time_update + UPDATES_FREQ_SECS < time.time()
+            ready
+            and not self.next_queued
+            and self._can_queue(next_item)
+            and self.isPlaying
+            and self.state.get_value("remaining") <= GAPLESS_QUEUE_BEFORE_END_S
         ):
-            self.last_time_update = time.time()
-            self._retAll("POS:" + str(self.state.get()["pos_true"]))
+            try:
+                self.audio.queue(prepared.filename)
+            except Exception:
+                self.logger.log.exception("Failed to queue next item: {}".format(prepared.filename))
+                return
+            self.logger.log.info("Queued next item for gapless playback: {}".format(next_item.name))
+            self.next_queued = next_item
+            self.next_queued_stale = False
 
-    def _retAll(self, msg):
-        if self.out_q:
-            self.out_q.put("ALL:" + msg)
+    # Only the same as auto advance's load, if it would start playing the next item straight from the top.
+    def _can_queue(self, next_item: Optional[PlanItem]) -> bool:
+        if not self.audio.supports_queue:
+            return False
+        if not next_item or not self.state.get_value("play_on_load") or next_item.cue > 0:
+            return False
+        prepared = self.next_prepared
+        return bool(
+            prepared
+            and prepared.timeslotitemid == next_item.timeslotitemid
+            and prepared.length
+            and (not self.next_queued or self.next_queued.timeslotitemid == next_item.timeslotitemid)
+        )
 
-    def _retMsg(
-        self, msg: Any, okay_str: bool = False, custom_prefix: Optional[str] = None
-    ):
-        # Make sure to add the message source back, so that it can be sent to the correct destination in the main server.
-        if custom_prefix:
-            response = custom_prefix
-        else:
-            response = "{}:{}:".format(self.last_msg_source, self.last_msg)
+    # Runs in its own thread, so downloading / reading the next item doesn't hold up playout.
+    # Only reads the item, the player applies the result once it actually advances.
+    def _prepare_next(self, item: PlanItem):
+        try:
+            filename = item.filename
+            if not filename or not os.path.exists(filename):
+                file = self.api_loop.run_until_complete(self.api.get_filename(item=item))
+                filename = str(file) if file else None
+            if not filename:
+                self.logger.log.warning("Couldn't get a file to prepare next item {}.".format(item.name))
+                return
+
+            filename = get_normalised_filename_if_available(filename)
+            length = get_media_info(filename).duration
+            if filename.endswith(".mp3"):
+                # So it's quick to seek, if it ends up being loaded normally.
+                get_seek_index(filename)
+            self.next_prepared = PreparedItem(item.timeslotitemid, filename, length)
+            self.logger.log.info("Prepared next item {}: {}".format(item.name, filename))
+        except Exception:
+            self.logger.log.exception("Failed to prepare next item {}.".format(item.name))
+
+    # The mixer carried on into a queued item that isn't next any more. Stop it, and the loaded item ends as usual,
+    # auto advancing to whatever is next now.
+    def _stop_stale_queued(self):
+        self.logger.log.info("Stopping {}, it was queued but isn't next any more.".format(self.next_queued.name))
+        self.next_queued = None
+        try:
+            self.audio.stop()
+        except Exception:
+            self.logger.log.exception("Failed to stop the queued item.")
+        self.engine_busy = False
+        self.playback_clock.stop()
+
+    # The mixer finished the loaded item and carried on into the queued one, catch everything else up with it.
+    def _advanced_to_next(self):
+        queued = self.next_queued
+        prepared = self.next_prepared
+        self.next_queued = None
+        if not queued or not prepared:
+            return
+
+        # Anything that stopped it being next would have made it stale, but the plan item may have been re-added since.
+        next_item = self._next_item()
+        if not next_item or next_item.timeslotitemid != queued.timeslotitemid:
+            next_item = queued
+
+        self.logger.log.info("Gaplessly advanced to {}, weight {}.".format(next_item.name, next_item.weight))
+        self._potentially_end_tracklist()
+
+        next_item.filename = prepared.filename
+        next_item.play_count_increment()
+        self.state.update("loaded_item", next_item)
+        showplan = self.state.get_value("show_plan")
+        for i in range(len(showplan)):
+            if showplan[i].weight == next_item.weight:
+                self.state.update("show_plan", index=i, value=next_item)
+                break
+
+        self.state.update("length", prepared.length)
+        self.state.update("pos_offset", 0)
+        self.playback_clock.start(0)
+        self._potentially_tracklist()
+
+    def _update_position_clock(self):
+        now = time.monotonic()
+        if now >= self.next_pos_update:
+            self.next_pos_update = now + POS_UPDATE_FREQ_S
+
+        if self.position_clock:
+            self.position_clock.update(
+                self.state.get_value("pos_true"),
+                self.state.get_value("remaining"),
+                self.state.get_value("length"),
+                self.state.get_value("playing"),
+            )
+
+    # Keep the shared copy up to date, for anything that wants the status without asking.
+    # Once a tick at most, it's the full status, so it's skipped if only the position has moved (see POSITION_STATE_KEYS).
+    def _publish_status(self):
+        if not self.status_slot:
+            return
+        changed = self.state.changed_keys_since(self.published_version)
+        if not changed:
+            return
+        self.published_version = self.state.version
+        if all(key in POSITION_STATE_KEYS for key in changed):
+            return
+        self.status_slot.publish(self.status)
+
+    def tick(self):
+        self._finish_fetch()
+        self._updateState()
+        self._check_output()
+        self._update_next_item()
+        self._update_position_clock()
+        self._publish_status()
+        self._send_status()
+        self._log_command_stats()
+
+    # Work out how long we can block waiting for a message before there's scheduled work to do.
+    def next_wakeup_s(self) -> float:
+        # A fetch finishing wakes us itself (see _fetch).
+        if not self.isPlaying:
+            # Nothing is moving, the next message will tell us what to do.
+            return IDLE_WAKEUP_S
+
+        # Wake for whichever comes first, the next position update or the end of the track.
+        until_pos_update = self.next_pos_update - time.monotonic()
+        until_end = self.state.get_value("remaining")
+        return min(IDLE_WAKEUP_S, max(MIN_WAKEUP_S, min(until_pos_update, until_end)))
+
+    def _retAll(self, command: Command, payload: Optional[str] = None, ok: Optional[bool] = None):
+        self._send(Message(Source.ALL, command, payload=payload, ok=ok))
+
+    def _retMsg(self, msg: Any, okay_str: bool = False):
+        if not self.last_msg:
+            return
+
+        # The reply keeps the message source, so that it can be sent to the correct destination in the main server.
         if msg is True:
-            response += "OKAY"
+            response = self.last_msg.reply(True)
         elif isinstance(msg, str):
-            if okay_str:
-                response += "OKAY:" + msg
-            else:
-                response += "FAIL:" + msg
+            response = self.last_msg.reply(okay_str, msg)
         else:
-            response += "FAIL"
+            response = self.last_msg.reply(False)
 
+        self._send(response)
+
+    def _send(self, response: Message):
         if self.out_q:
-            if "STATUS:" not in response:
+            if response.command not in [Command.STATUS, Command.STATUSDELTA]:
                 # Don't fill logs with status pushes, it's a mess.
                 self.logger.log.debug(("Sending: {}".format(response)))
+            # So the player handler can tell how long it waited in the queue.
+            response.sent_at = time.monotonic()
             self.out_q.put(response)
         else:
             self.logger.log.exception(
                 "Message return Queue is missing!!!! Can't send message."
             )
 
+    def _status_changed(self):
+        self.status_changed = True
+
+    # Once a tick at most, so a command that changes lots of the state only sends one delta, once it's done.
     def _send_status(self):
-        # TODO This is hacky
-        self._retMsg(str(self.status), okay_str=True,
-                     custom_prefix="ALL:STATUS:")
+        if not self.status_changed:
+            return
+        self.status_changed = False
+        delta = self.status_tracker.delta(self.state)
+        if not delta:
+            return
+
+        self._retAll(Command.STATUSDELTA, json.dumps(delta), ok=True)
+
+        if delta["seq"] % STATUS_KEYFRAME_EVERY == 1:
+            # Every so often, send everything, so anything that's just started, or missed a delta, can catch up.
+            self._retAll(Command.STATUS, self.status, ok=True)
 
     def _fix_and_update_weights(self, plan):
         def _sort_weight(e: PlanItem):
@@ -991,25 +1318,248 @@ class Player:
         self.logger.log.debug("Weights after sorting:\n{}".format(fixed))
         self.state.update("show_plan", plan)
 
+    def _process_message(self, message: Union[Message, str]):
+        try:
+            # Anything still sending the old string format gets converted here.
+            self.last_msg = Message.parse(message)
+        except ValueError as e:
+            self.logger.log.warn(
+                "Received invalid message {}: {}".format(message, e)
+            )
+            # Still let the sender know, if we can tell who that was, rather than leave them waiting.
+            self.last_msg = Message.parse_failed(message)
+            self._retMsg("Unknown Command" if self.last_msg and self.last_msg.command == Command.UNKNOWN else str(e))
+            return
+
+        self.logger.log.debug(
+            "Recieved message from source {}: {}".format(
+                self.last_msg.source.value, self.last_msg
+            )
+        )
+
+        command = self.last_msg.command
+
+        if command == Command.WAKE:
+            # Just here to get us to tick, which has picked up the finished fetch already.
+            return
+
+        if self.fetching and command != Command.STATUS:
+            # Still busy with the last command, this one will have to wait.
+            self.held_messages.append(self.last_msg)
+            return
+
+        # Output re-inits the mixer, so we can do this any time.
+        if command == Command.OUTPUT or self.isInit:
+            registered = self.commands.get(command)
+            if registered:
+                try:
+                    result, okay_str = self.commands.run(registered, self.last_msg)
+                    if result is DEFERRED:
+                        self.fetch_message, self.fetch_okay_str = self.last_msg, okay_str
+                    else:
+                        self._retMsg(result, okay_str)
+                except Exception:
+                    # Bad args, or the handler fell over. Either way, it's counted as a failure, and the channel carries on.
+                    self.logger.log.exception("Failed to run {}.".format(self.last_msg))
+                    self._retMsg(False)
+            else:
+                self._retMsg("Unknown Command")
+        else:
+
+            if command == Command.STATUS:
+                self._retMsg(self.status)
+            else:
+                self._retMsg(False)
+
+    # Runs the request, then passes what it returns to then, whose result is the command's reply.
+    # Returns DEFERRED if that'll happen later, in the audio engine, where it runs in the background.
+    def _fetch(self, request: Coroutine, then: Callable[[Any], Any]) -> Any:
+        if not self.shared_process:
+            return then(sync(request))
+        if self.fetching:
+            # Something else (auto advance, say) got in whilst a command was waiting, it'll have to go without.
+            self.logger.log.warning("Already waiting on MyRadio, giving up on another request.")
+            request.close()
+            return then(None)
+
+        if not self.fetcher:
+            self.fetcher = ThreadPoolExecutor(1, thread_name_prefix="PlayerFetch")
+            self.fetch_loop = asyncio.new_event_loop()
+        self.fetching = self.fetcher.submit(self.fetch_loop.run_until_complete, request)
+        # Rather than polling for it, have it wake us (and tick, see handle_message) once it's done.
+        self.fetching.add_done_callback(lambda _: self.in_q.put(Message(Source.ALL, Command.WAKE)))
+        self.fetch_then = then
+        # Only a command (see _process_message) has anyone waiting on a reply.
+        self.fetch_message = None
+        return DEFERRED
+
+    # Passes result to then, or if result is DEFERRED, does so once whatever it's waiting on (see _fetch) is done.
+    def _after(self, result: Any, then: Callable[[Any], Any]) -> Any:
+        if result is not DEFERRED:
+            return then(result)
+        waiting = self.fetch_then
+        # Its continuation may well need to fetch again, in which case keep waiting.
+        self.fetch_then = lambda fetched: self._after(waiting(fetched), then)
+        return DEFERRED
+
+    # Once the fetch is done, carries on with the command that was waiting on it, then anything sent since.
+    def _finish_fetch(self):
+        if not self.fetching or not self.fetching.done():
+            return
+        try:
+            result = self.fetching.result()
+        except Exception:
+            self.logger.log.exception("Failed to fetch from MyRadio.")
+            result = None
+        self.fetching = None
+
+        message = self.last_msg = self.fetch_message
+        try:
+            reply = self.fetch_then(result)
+        except Exception:
+            self.logger.log.exception("Failed to run {}.".format(message))
+            reply = False
+        if reply is DEFERRED:
+            # Another fetch, for the same command.
+            self.fetch_message = message
+            return
+        self._retMsg(reply, self.fetch_okay_str)
+        self.fetch_message = None
+
+        while self.held_messages and not self.fetching:
+            self._process_message(self.held_messages.pop(0))
+
+    # Handle a message from the server, making sure we act on (and respond with) the latest position etc.
+    def handle_message(self, message: Union[Message, str]):
+        self.tick()
+        self._process_message(message)
+        # Don't make clients wait for the next wakeup to hear about what we just did.
+        self.tick()
+
+    def shutdown(self):
+        self.logger.log.info("Quiting player " + str(self.state.get_value("channel")))
+        self.quit()
+        self._retAll(Command.QUIT)
+        # We're about to stop for good, make sure the latest state made it to disk.
+        self.state.flush()
+
+        if self.next_prepare_thread:
+            self.next_prepare_thread.join(timeout=1)
+        try:
+            self.api_loop.run_until_complete(close_async_session())
+            self.api_loop.close()
+            if self.fetcher:
+                # After anything still fetching, which may take a while, so don't wait forever.
+                self.fetcher.submit(self.fetch_loop.run_until_complete, close_async_session()).result(
+                    timeout=FETCH_SHUTDOWN_TIMEOUT_S
+                )
+                self.fetch_loop.close()
+        except Exception:
+            self.logger.log.exception("Failed to close MyRadio connections.")
+        if self.fetcher:
+            self.fetcher.shutdown(wait=False)
+
+    def _quit_requested(self) -> bool:
+        self.running = False
+        return True
+
+    def _register_commands(self):
+        self.commands = CommandRegistry()
+        register = self.commands.register
+
+        register(Command.STATUS, lambda: self.status, okay_str=True)
+        register(Command.OUTPUT, self.output, str_arg)
+        register(Command.QUIT, self._quit_requested)
+
+        # Audio Playout
+        # Unpause, so we don't jump to 0, we play from the current pos.
+        register(Command.PLAY, self.unpause)
+        register(Command.PAUSE, self.pause)
+        # For the hardware controller.
+        register(Command.PLAYPAUSE, lambda: self.unpause() if not self.isPlaying else self.pause())
+        register(Command.UNPAUSE, self.unpause)
+        register(Command.STOP, lambda: self.stop(user_initiated=True))
+        register(Command.SEEK, self.seek, float_arg)
+        register(Command.AUTOADVANCE, self.set_auto_advance, bool_arg)
+        register(Command.REPEAT, self.set_repeat, str_arg)
+        register(Command.PLAYONLOAD, self.set_play_on_load, bool_arg)
+
+        # Show Plan Items
+        register(Command.GETPLAN, self.get_plan, int_arg)
+        register(Command.LOAD, self.load, int_arg)
+        register(Command.LOADED, lambda: self.isLoaded)
+        register(Command.UNLOAD, self.unload)
+        register(Command.ADD, self.add_to_plan, lambda message: (message.data,))
+        register(Command.REMOVE, self.remove_from_plan, int_arg)
+        register(Command.CLEAR, self.clear_channel_plan)
+        register(Command.SETMARKER, self.set_marker, lambda message: (str(message.args[0]), message.payload))
+        register(Command.RESETPLAYED, lambda weight: self.set_played(weight=weight, played=False), int_arg)
+        register(Command.SETPLAYED, lambda weight: self.set_played(weight=weight, played=True), int_arg)
+        register(Command.SETLIVE, self.set_live, bool_arg)
+
+    def _log_command_stats(self):
+        now = time.monotonic()
+        if now >= self.next_command_stats:
+            self.next_command_stats = now + COMMAND_STATS_INTERVAL_S
+            summary = self.commands.stats_summary()
+            if summary:
+                self.logger.log.info("Command stats:\n" + summary)
+                self.commands.reset_stats()
+
     def __init__(
         self,
         channel: int,
         in_q: multiprocessing.Queue,
         out_q: multiprocessing.Queue,
         server_state: StateManager,
+        status_slot: Optional[StatusSlot] = None,
+        position_clock: Optional[PositionClock] = None,
+        shared_process: bool = False,
+        download_registry: Optional[DownloadRegistry] = None,
     ):
 
-        process_title = "Player: Channel " + str(channel)
-        setproctitle.setproctitle(process_title)
-        multiprocessing.current_process().name = process_title
+        # When shared_process is set, we're one of several channels in the audio engine (see audio_engine.py),
+        # which runs us with handle_message() and tick(), rather than us having the process to ourselves.
+        if not shared_process:
+            process_title = "Player: Channel " + str(channel)
+            setproctitle.setproctitle(process_title)
+            multiprocessing.current_process().name = process_title
 
         self.running = True
+        self.shared_process = shared_process
+        self.held_messages = []
+        self.in_q = in_q
         self.out_q = out_q
+        self.status_slot = status_slot
+        self.position_clock = position_clock
 
         self.logger = LoggingManager(
             "Player" + str(channel), debug=package.BETA)
 
-        self.api = MyRadioAPI(self.logger, server_state)
+        self.api = MyRadioAPI(self.logger, server_state, download_registry)
+        self.api_loop = asyncio.new_event_loop()
+
+        audio_backend = server_state.get_value("audio_backend")
+        audio_backend_failed = None
+        try:
+            self.audio = get_backend(audio_backend, server_state.get_value("audio_buffer_frames"))
+        except Exception as e:
+            # Pygame can only play one channel per process, so the audio engine can't fall back to it.
+            # Better to keep the channel going silently than take every other channel down,
+            # but it's in the status, and raises an alert (see alerts/player.py), so someone will notice.
+            fallback = "dummy" if shared_process else DEFAULT_AUDIO_BACKEND
+            self.logger.log.exception(
+                "Failed to start audio backend {}, using {}.".format(audio_backend, fallback)
+            )
+            audio_backend_failed = "{}: {}".format(audio_backend, e)
+            self.audio = get_backend(fallback, server_state.get_value("audio_buffer_frames"))
+        self.playback_clock = PlaybackClock(
+            output_latency_s=self.audio.output_latency_s, granularity_s=self.audio.buffer_s
+        )
+        self.logger.log.info("Using {} audio backend.".format(self.audio.name))
+
+        self._register_commands()
+        self.next_command_stats = time.monotonic() + COMMAND_STATS_INTERVAL_S
 
         self.state = StateManager(
             "Player" + str(channel),
@@ -1020,20 +1570,24 @@ class Player:
 
         self.state.update("start_time", datetime.now().timestamp())
 
-        self.state.add_callback(self._send_status)
+        self.status_tracker = StatusDeltaTracker()
+        self.state.add_callback(self._status_changed)
 
         self.state.update("channel", channel)
-        self.state.update("tracklist_mode", server_state.get()[
-                          "tracklist_mode"])
+        self.state.update("tracklist_mode", server_state.get_value("tracklist_mode"))
         self.state.update(
             "live", True
         )  # Channel is live until controller says it isn't.
+        self.state.update("next_ready", False)  # Nothing's prepared yet.
+        self.state.update("output_recoveries", 0)  # Counts since this player started.
+        self.state.update("audio_backend", self.audio.name)
+        self.state.update("audio_backend_failed", audio_backend_failed)
 
         # Just in case there's any weights somehow messed up, let's fix them.
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
+        plan_copy: List[PlanItem] = copy.copy(self.state.get_value("show_plan"))
         self._fix_and_update_weights(plan_copy)
 
-        loaded_state = copy.copy(self.state.state)
+        loaded_state = self.state.snapshot()
 
         if loaded_state["output"]:
             self.logger.log.info("Setting output to: " +
@@ -1063,137 +1617,19 @@ class Player:
         else:
             self.logger.log.info("No file was previously loaded to resume.")
 
+        if shared_process:
+            return
+
         try:
             while self.running:
-                time.sleep(0.02)
-                self._updateState()
-                self._ping_times()
                 try:
-                    message = in_q.get_nowait()
-                    source = message.split(":")[0]
-                    if source not in VALID_MESSAGE_SOURCES:
-                        self.last_msg_source = ""
-                        self.last_msg = ""
-                        self.logger.log.warn(
-                            "Message from unknown sender source: {}".format(
-                                source)
-                        )
-                        continue
-
-                    self.last_msg_source = source
-                    self.last_msg = message.split(":", 1)[1]
-
-                    self.logger.log.debug(
-                        "Recieved message from source {}: {}".format(
-                            self.last_msg_source, self.last_msg
-                        )
-                    )
+                    message = in_q.get(timeout=self.next_wakeup_s())
                 except Empty:
-                    # The incomming message queue was empty,
-                    # skip message processing
-                    pass
-                else:
-
-                    # We got a message.
-
-                    # Output re-inits the mixer, so we can do this any time.
-                    if self.last_msg.startswith("OUTPUT"):
-                        split = self.last_msg.split(":")
-                        self._retMsg(self.output(split[1]))
-
-                    elif self.isInit:
-                        message_types: Dict[
-                            str, Callable[..., Any]
-                        ] = {  # TODO Check Types
-                            "STATUS": lambda: self._retMsg(self.status, True),
-                            # Audio Playout
-                            # Unpause, so we don't jump to 0, we play from the current pos.
-                            "PLAY": lambda: self._retMsg(self.unpause()),
-                            "PAUSE": lambda: self._retMsg(self.pause()),
-                            "PLAYPAUSE": lambda: self._retMsg(
-                                self.unpause() if not self.isPlaying else self.pause()
-                            ),  # For the hardware controller.
-                            "UNPAUSE": lambda: self._retMsg(self.unpause()),
-                            "STOP": lambda: self._retMsg(
-                                self.stop(user_initiated=True)
-                            ),
-                            "SEEK": lambda: self._retMsg(
-                                self.seek(float(self.last_msg.split(":")[1]))
-                            ),
-                            "AUTOADVANCE": lambda: self._retMsg(
-                                self.set_auto_advance(
-                                    (self.last_msg.split(":")[1] == "True")
-                                )
-                            ),
-                            "REPEAT": lambda: self._retMsg(
-                                self.set_repeat(self.last_msg.split(":")[1])
-                            ),
-                            "PLAYONLOAD": lambda: self._retMsg(
-                                self.set_play_on_load(
-                                    (self.last_msg.split(":")[1] == "True")
-                                )
-                            ),
-                            # Show Plan Items
-                            "GETPLAN": lambda: self._retMsg(
-                                self.get_plan(int(self.last_msg.split(":")[1]))
-                            ),
-                            "LOAD": lambda: self._retMsg(
-                                self.load(int(self.last_msg.split(":")[1]))
-                            ),
-                            "LOADED?": lambda: self._retMsg(self.isLoaded),
-                            "UNLOAD": lambda: self._retMsg(self.unload()),
-                            "ADD": lambda: self._retMsg(
-                                self.add_to_plan(
-                                    json.loads(
-                                        ":".join(self.last_msg.split(":")[1:]))
-                                )
-                            ),
-                            "REMOVE": lambda: self._retMsg(
-                                self.remove_from_plan(
-                                    int(self.last_msg.split(":")[1]))
-                            ),
-                            "CLEAR": lambda: self._retMsg(self.clear_channel_plan()),
-                            "SETMARKER": lambda: self._retMsg(
-                                self.set_marker(
-                                    self.last_msg.split(":")[1],
-                                    self.last_msg.split(":", 2)[2],
-                                )
-                            ),
-                            "RESETPLAYED": lambda: self._retMsg(
-                                self.set_played(
-                                    weight=int(self.last_msg.split(":")[1]),
-                                    played=False,
-                                )
-                            ),
-                            "SETPLAYED": lambda: self._retMsg(
-                                self.set_played(
-                                    weight=int(self.last_msg.split(":")[1]), played=True
-                                )
-                            ),
-                            "SETLIVE": lambda: self._retMsg(
-                                self.set_live(
-                                    self.last_msg.split(":")[1] == "True")
-                            ),
-                        }
-
-                        message_type: str = self.last_msg.split(":")[0]
-
-                        if message_type in message_types.keys():
-                            message_types[message_type]()
-
-                        elif self.last_msg == "QUIT":
-                            self._retMsg(True)
-                            self.running = False
-                            continue
-
-                        else:
-                            self._retMsg("Unknown Command")
-                    else:
+                    # Nothing came in before the next bit of scheduled work, go do it.
+                    self.tick()
+                    continue
 
-                        if self.last_msg == "STATUS":
-                            self._retMsg(self.status)
-                        else:
-                            self._retMsg(False)
+                self.handle_message(message)
 
         # Catch the player being killed externally.
         except KeyboardInterrupt:
@@ -1204,9 +1640,13 @@ class Player:
             self.logger.log.exception(
                 "Received unexpected Exception: {}".format(e))
 
-        self.logger.log.info("Quiting player " + str(channel))
-        self.quit()
-        self._retAll("QUIT")
+        self.shutdown()
+        # The audio engine shares these between its channels, so closes them itself.
+        try:
+            sync(close_async_session())
+            close_sync_session()
+        except Exception:
+            self.logger.log.exception("Failed to close MyRadio connections.")
         del self.logger
         os._exit(0)
 
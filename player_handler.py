@@ -1,14 +1,83 @@
 from setproctitle import setproctitle
 from multiprocessing import current_process
-from time import sleep
+from multiprocessing.connection import wait
+from queue import Empty
+from time import monotonic, perf_counter
 from os import _exit
+from typing import Dict, List, Optional
 
 from helpers.logging_manager import LoggingManager
 from helpers.the_terminator import Terminator
+from baps_types.message import Command, Message, Source
+
+# How long to wait for any player to say something, before checking if we've been told to quit.
+WAIT_TIMEOUT_S = 1
+# Don't let one very chatty player hog the router, move on to the others after this many messages.
+MAX_MESSAGES_PER_WAKE = 50
+# How often to log the routing stats.
+STATS_INTERVAL_S = 60
+
+
+class RouterStats:
+    # Counters to keep an eye on how well the router is keeping up.
+    messages: List[int]
+    max_queue_depth: List[int]
+    routing_time_total_s: float
+    routing_time_max_s: float
+    # How long messages waited in the players' queues before we got to them, for those the player stamped.
+    # Along with the routing time, this is how long the message took to fan out.
+    waited: int
+    wait_time_total_s: float
+    wait_time_max_s: float
+
+    def __init__(self, channel_count: int):
+        self.channel_count = channel_count
+        self.reset()
+
+    def reset(self):
+        self.messages = [0] * self.channel_count
+        self.max_queue_depth = [0] * self.channel_count
+        self.routing_time_total_s = 0
+        self.routing_time_max_s = 0
+        self.waited = 0
+        self.wait_time_total_s = 0
+        self.wait_time_max_s = 0
+        self.started = perf_counter()
+
+    def routed(self, channel: int, time_s: float, wait_s: Optional[float] = None):
+        self.messages[channel] += 1
+        self.routing_time_total_s += time_s
+        self.routing_time_max_s = max(self.routing_time_max_s, time_s)
+        if wait_s is not None:
+            self.waited += 1
+            self.wait_time_total_s += wait_s
+            self.wait_time_max_s = max(self.wait_time_max_s, wait_s)
+
+    def queue_depth(self, channel: int, depth: int):
+        self.max_queue_depth[channel] = max(self.max_queue_depth[channel], depth)
+
+    def __str__(self) -> str:
+        total = sum(self.messages)
+        mean_ms = (self.routing_time_total_s / total * 1000) if total else 0
+        wait_mean_ms = (self.wait_time_total_s / self.waited * 1000) if self.waited else 0
+        return (
+            "Routed {} messages in {:.0f}s (per channel: {}). Max queue depths: {}. "
+            + "Queue wait mean {:.3f}ms, max {:.3f}ms. Routing time mean {:.3f}ms, max {:.3f}ms."
+        ).format(
+            total,
+            perf_counter() - self.started,
+            self.messages,
+            self.max_queue_depth,
+            wait_mean_ms,
+            self.wait_time_max_s * 1000,
+            mean_ms,
+            self.routing_time_max_s * 1000,
+        )
 
 
 class PlayerHandler:
     logger: LoggingManager
+    stats: RouterStats
 
     def __init__(
         self, channel_from_q, websocket_to_q, ui_to_q, controller_to_q, file_to_q
@@ -19,35 +88,74 @@ class PlayerHandler:
         setproctitle(process_title)
         current_process().name = process_title
 
+        self.channel_from_q = channel_from_q
+        self.websocket_to_q = websocket_to_q
+        self.ui_to_q = ui_to_q
+        self.controller_to_q = controller_to_q
+        self.file_to_q = file_to_q
+
+        self.stats = RouterStats(len(channel_from_q))
+
+        # Wait on the pipes underneath the player queues, so we wake up as soon as any of them has something.
+        readers: Dict = {
+            queue._reader: channel for channel, queue in enumerate(channel_from_q)
+        }
+
         terminator = Terminator()
+        next_stats = perf_counter() + STATS_INTERVAL_S
         try:
             while not terminator.terminate:
 
-                for channel in range(len(channel_from_q)):
-                    try:
-                        message = channel_from_q[channel].get_nowait()
-                        source = message.split(":")[0]
-                        command = message.split(":")[1]
-
-                        # Let the file manager manage the files based on status and loading new show plan triggers.
-                        if command == "GETPLAN" or command == "STATUS":
-                            file_to_q[channel].put(message)
-
-                        # TODO ENUM
-                        if source in ["ALL", "WEBSOCKET"]:
-                            websocket_to_q[channel].put(message)
-                        if source in ["ALL", "UI"]:
-                            if not message.split(":")[1] == "POS":
-                                # We don't care about position update spam
-                                ui_to_q[channel].put(message)
-                        if source in ["ALL", "CONTROLLER"]:
-                            controller_to_q[channel].put(message)
-                    except Exception:
-                        pass
-
-                sleep(0.02)
+                for reader in wait(list(readers.keys()), timeout=WAIT_TIMEOUT_S):
+                    self._drain(readers[reader])
+
+                if perf_counter() > next_stats:
+                    self.logger.log.info(str(self.stats))
+                    self.stats.reset()
+                    next_stats = perf_counter() + STATS_INTERVAL_S
+
         except Exception as e:
             self.logger.log.exception(
                 "Received unexpected exception: {}".format(e))
         del self.logger
         _exit(0)
+
+    def _drain(self, channel: int):
+        queue = self.channel_from_q[channel]
+        try:
+            self.stats.queue_depth(channel, queue.qsize())
+        except NotImplementedError:
+            # MacOS can't tell us.
+            pass
+
+        for _ in range(MAX_MESSAGES_PER_WAKE):
+            try:
+                message = queue.get_nowait()
+            except Empty:
+                return
+            wait_s = monotonic() - message.sent_at if message.sent_at is not None else None
+
+            start = perf_counter()
+            try:
+                self._route(channel, message)
+            except Exception:
+                self.logger.log.exception(
+                    "Failed to route message from channel {}: {}".format(channel, message)
+                )
+            self.stats.routed(channel, perf_counter() - start, wait_s)
+
+    def _route(self, channel: int, message: Message):
+        source, command = message.source, message.command
+
+        # Let the file manager manage the files based on status and loading new show plan triggers.
+        if command in [Command.GETPLAN, Command.STATUS, Command.STATUSDELTA]:
+            self.file_to_q[channel].put(message)
+
+        if source in [Source.ALL, Source.WEBSOCKET]:
+            self.websocket_to_q[channel].put(message)
+        # The web server reads statuses from shared memory, it only waits on the replies it asked for.
+        # Nothing else would take them off the queue.
+        if source == Source.UI and message.request_id:
+            self.ui_to_q[channel].put(message)
+        if source in [Source.ALL, Source.CONTROLLER]:
+            self.controller_to_q[channel].put(message)
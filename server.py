@@ -32,13 +32,18 @@ if not isMacOS():
 import package
 from typing import Dict, List
 from helpers.state_manager import StateManager
+from helpers.download_registry import DownloadRegistry
 from helpers.logging_manager import LoggingManager
+from helpers.shared_status import PositionClock, StatusSlot
 from websocket_server import WebsocketServer
 from web_server import WebServer
 from player_handler import PlayerHandler
 from controllers.mattchbox_usb import MattchBox
+from baps_types.message import Command, Message, MessageQueue, Source
 from helpers.the_terminator import Terminator
 import player
+from audio_engine import AudioEngine
+from audio_backends import SHARED_PROCESS_AUDIO_BACKENDS
 
 PROCESS_KILL_TIMEOUT_S = 5
 
@@ -62,6 +67,7 @@ class BAPSicleServer:
         "host": "localhost",
         "port": 13500,
         "ws_port": 13501,
+        "ws_pos_update_hz": 5,
         "num_channels": 3,
         "serial_port": None,
         "ser_connected": False,
@@ -72,6 +78,10 @@ class BAPSicleServer:
         "running_state": "running",
         "tracklist_mode": "off",
         "normalisation_mode": "off",
+        "audio_backend": "pygame",
+        "audio_buffer_frames": 1024,
+        "audio_engine_mode": "per-channel",  # per-channel or single-process
+        "music_cache_budget_mb": 2048,
     }
 
     player_to_q: List[Queue] = []
@@ -80,10 +90,15 @@ class BAPSicleServer:
     websocket_to_q: List[Queue] = []
     controller_to_q: List[Queue] = []
     file_to_q: List[Queue] = []
+    status_slots: List[StatusSlot] = []
+    position_clocks: List[PositionClock] = []
     api_from_q: Queue
     api_to_q: Queue
 
     player: List[multiprocessing.Process] = []
+    # Plays every channel instead, if we're in single-process mode.
+    audio_engine: Optional[multiprocessing.Process] = None
+    use_audio_engine: bool = False
     websockets_server: Optional[multiprocessing.Process] = None
     controller_handler: Optional[multiprocessing.Process] = None
     player_handler: Optional[multiprocessing.Process] = None
@@ -114,7 +129,29 @@ class BAPSicleServer:
                 "running_state"] == "running"
         ):
 
+            if self.use_audio_engine:
+                if (
+                    not self.audio_engine
+                    or not self.audio_engine.is_alive()
+                    or not psutil.pid_exists(self.audio_engine.pid)
+                ):
+                    log_function("Audio Engine not running, (re)starting.")
+                    self.audio_engine = multiprocessing.Process(
+                        target=AudioEngine,
+                        args=(
+                            self.player_to_q,
+                            self.player_from_q,
+                            self.state,
+                            self.status_slots,
+                            self.position_clocks,
+                            self.download_registry,
+                        ),
+                    )
+                    self.audio_engine.start()
+
             for channel in range(self.state.get()["num_channels"]):
+                if self.use_audio_engine:
+                    break
                 # Use pid_exists to confirm process is actually still running.
                 # Python may not report is_alive() correctly (especially over system sleeps etc.)
                 # https://medium.com/pipedrive-engineering/encountering-some-python-trickery-683bd5f66750
@@ -132,7 +169,10 @@ class BAPSicleServer:
                             self.player_to_q[channel],
                             self.player_from_q[channel],
                             self.state,
+                            self.status_slots[channel],
+                            self.position_clocks[channel],
                         ),
+                        kwargs={"download_registry": self.download_registry},
                     )
                     self.player[channel].start()
 
@@ -162,7 +202,7 @@ class BAPSicleServer:
                 log_function("File Manager not running, (re)starting.")
                 self.file_manager = multiprocessing.Process(
                     target=FileManager,
-                    args=(self.file_to_q, self.state),
+                    args=(self.file_to_q, self.state, self.file_state, self.download_registry),
                 )
                 self.file_manager.start()
 
@@ -174,7 +214,7 @@ class BAPSicleServer:
                 log_function("Websocket Server not running, (re)starting.")
                 self.websockets_server = multiprocessing.Process(
                     target=WebsocketServer,
-                    args=(self.player_to_q, self.websocket_to_q, self.state),
+                    args=(self.player_to_q, self.websocket_to_q, self.state, self.position_clocks),
                 )
                 self.websockets_server.start()
 
@@ -186,7 +226,13 @@ class BAPSicleServer:
                 log_function("Webserver not running, (re)starting.")
                 self.webserver = multiprocessing.Process(
                     target=WebServer, args=(
-                        self.player_to_q, self.ui_to_q, self.state)
+                        self.player_to_q,
+                        self.ui_to_q,
+                        self.state,
+                        self.status_slots,
+                        self.file_state,
+                        self.position_clocks,
+                    )
                 )
                 self.webserver.start()
 
@@ -221,12 +267,25 @@ class BAPSicleServer:
         # Since we're passing the StateManager across processes, it must be made a manager.
         # PLEASE NOTE: You can't read attributes directly, use state.get()["var"] and state.update("var", "val")
         ProxyManager.register("StateManager", StateManager)
+        ProxyManager.register("DownloadRegistry", DownloadRegistry)
         manager = ProxyManager()
         manager.start()
         self.state: StateManager = manager.StateManager(
             "BAPSicleServer", self.logger, self.default_state
         )
 
+        # What the file manager is up to, for the web server to show.
+        # Where the downloads and normalisation are at is only true of this run, so it's not kept on disk.
+        self.file_state: StateManager = manager.StateManager(
+            "FileManager",
+            self.logger,
+            {"downloads": {}, "normalisation": {}},
+            transient_params=["downloads", "normalisation"],
+        )
+
+        # So the players and file manager never download the same file at once, and hear when each other's are done.
+        self.download_registry: DownloadRegistry = manager.DownloadRegistry()
+
         self.state.update("running_state", "running")
         self.state.update("start_time", datetime.now().timestamp())
 
@@ -240,15 +299,20 @@ class BAPSicleServer:
 
         channel_count = self.state.get()["num_channels"]
         self.player = [None] * channel_count
+        self.use_audio_engine = self._should_use_audio_engine()
 
         for channel in range(self.state.get()["num_channels"]):
 
-            self.player_to_q.append(multiprocessing.Queue())
-            self.player_from_q.append(multiprocessing.Queue())
-            self.ui_to_q.append(multiprocessing.Queue())
-            self.websocket_to_q.append(multiprocessing.Queue())
-            self.controller_to_q.append(multiprocessing.Queue())
-            self.file_to_q.append(multiprocessing.Queue())
+            self.player_to_q.append(MessageQueue())
+            self.player_from_q.append(MessageQueue())
+            self.ui_to_q.append(MessageQueue())
+            self.websocket_to_q.append(MessageQueue())
+            self.controller_to_q.append(MessageQueue())
+            self.file_to_q.append(MessageQueue())
+
+        # Somewhere for each player to publish its status, for the web server to read whenever it likes.
+        self.status_slots = [StatusSlot() for _ in range(channel_count)]
+        self.position_clocks = [PositionClock() for _ in range(channel_count)]
 
         print(
             "Welcome to BAPSicle Server version: {}, build: {}.".format(
@@ -288,15 +352,29 @@ class BAPSicleServer:
                     "artist": "University Radio York",
                 }
 
-                self.player_to_q[0].put("ADD:" + json.dumps(new_item))
-                self.player_to_q[0].put("LOAD:0")
-                self.player_to_q[0].put("PLAY")
+                self.player_to_q[0].put(Message(Source.UI, Command.ADD, payload=json.dumps(new_item)))
+                self.player_to_q[0].put(Message(Source.UI, Command.LOAD, (0,)))
+                self.player_to_q[0].put(Message(Source.UI, Command.PLAY))
+
+    def _should_use_audio_engine(self) -> bool:
+        if self.state.get()["audio_engine_mode"] != "single-process":
+            return False
+
+        audio_backend = self.state.get()["audio_backend"]
+        if audio_backend not in SHARED_PROCESS_AUDIO_BACKENDS:
+            self.logger.log.warning(
+                "The {} audio backend can't play several channels from one process, using a process per channel.".format(
+                    audio_backend
+                )
+            )
+            return False
+        return True
 
     def stopServer(self):
         print("Stopping BASPicle Server.")
 
         print("Stopping Websocket Server")
-        self.websocket_to_q[0].put("WEBSOCKET:QUIT")
+        self.websocket_to_q[0].put(Message(Source.WEBSOCKET, Command.QUIT))
         if self.websockets_server:
             self.websockets_server.join(timeout=PROCESS_KILL_TIMEOUT_S)
         del self.websockets_server
@@ -330,13 +408,26 @@ class BAPSicleServer:
         # This is to keep playing for as long as possible during a restart.
         print("Stopping Players")
         for q in self.player_to_q:
-            q.put("ALL:QUIT")
+            q.put(Message(Source.ALL, Command.QUIT))
 
         for player in self.player:
-            player.join(timeout=PROCESS_KILL_TIMEOUT_S)
+            if player:
+                player.join(timeout=PROCESS_KILL_TIMEOUT_S)
 
         del self.player
 
+        if self.audio_engine:
+            self.audio_engine.join(timeout=PROCESS_KILL_TIMEOUT_S)
+            del self.audio_engine
+
+        for block in self.status_slots + self.position_clocks:
+            block.close()
+        self.status_slots = []
+        self.position_clocks = []
+
+        # Make sure the server state made it to disk before the state manager goes away.
+        self.state.flush()
+
         print("Stopped all processes.")
 
 
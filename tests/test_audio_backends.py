@@ -0,0 +1,266 @@
+import os
+import shutil
+import time
+import unittest
+from threading import Thread
+from typing import Optional
+from unittest import mock
+
+from pydub import AudioSegment
+
+from audio_backends import get_backend
+from audio_backends.backend import AudioBackend
+from audio_backends.dummy_backend import DummyBackend
+
+resource_dir = os.path.dirname(os.path.realpath(__file__)) + "/resources/"
+
+
+# Sounddevice needs PortAudio, an output to play to, and ffmpeg to decode with. Returns what's missing, if anything.
+def sounddevice_missing() -> Optional[str]:
+    try:
+        import sounddevice
+        sounddevice.query_devices(kind="output")
+    except Exception as e:
+        return "no PortAudio output ({})".format(e)
+    if not shutil.which(AudioSegment.converter):
+        return "no ffmpeg"
+    return None
+
+
+SOUNDDEVICE_MISSING = sounddevice_missing()
+
+
+# Without an output, it can still decode and run its callback, as long as the library itself is there.
+def sounddevice_decoding_missing() -> Optional[str]:
+    try:
+        import sounddevice  # noqa: F401
+    except Exception as e:
+        return "no PortAudio ({})".format(e)
+    if not shutil.which(AudioSegment.converter):
+        return "no ffmpeg"
+    return None
+
+
+SOUNDDEVICE_DECODING_MISSING = sounddevice_decoding_missing()
+
+
+class FakeCallbackFlags:
+    output_underflow = False
+
+
+# Stands in for sounddevice's RawOutputStream, calling back for a block at a time, as fast as it would play them.
+class FakeStream:
+    def __init__(self, samplerate, blocksize, device, channels, dtype, latency, callback):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.frame_bytes = channels * 2
+        self.latency = latency
+        self.callback = callback
+        self.active = False
+        self.aborted = False
+        self.played = bytearray()
+
+    def start(self):
+        self.active = True
+        Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        import sounddevice
+        while self.active and not self.aborted:
+            outdata = bytearray(self.blocksize * self.frame_bytes)
+            try:
+                self.callback(outdata, self.blocksize, None, FakeCallbackFlags())
+            except sounddevice.CallbackStop:
+                self.active = False
+            self.played += outdata
+            time.sleep(self.blocksize / self.samplerate)
+
+    def abort(self):
+        self.aborted = True
+        self.active = False
+
+    def close(self):
+        pass
+
+
+class TestDummyBackend(unittest.TestCase):
+
+    backend: DummyBackend
+
+    def setUp(self):
+        self.backend = get_backend("dummy")
+        self.backend.init()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_backend("gramophone")
+
+    def test_not_initialised(self):
+        self.backend.quit()
+        with self.assertRaises(RuntimeError):
+            self.backend.get_busy()
+
+    def test_play(self):
+        self.backend.load(resource_dir + "1sec.mp3")
+        self.assertFalse(self.backend.get_busy())
+
+        self.backend.play(0.5)
+        self.assertTrue(self.backend.get_busy())
+        time.sleep(0.2)
+        self.assertAlmostEqual(self.backend.get_pos(), 0.2, delta=0.1)
+
+        time.sleep(0.5)
+        self.assertFalse(self.backend.get_busy())
+
+    def test_queue(self):
+        self.backend.load(resource_dir + "1sec.mp3")
+        self.backend.play(0.8)
+        self.backend.queue(resource_dir + "2sec.mp3")
+
+        # Carries straight on into the queued file, starting the position again.
+        time.sleep(0.4)
+        self.assertTrue(self.backend.get_busy())
+        self.assertAlmostEqual(self.backend.get_pos(), 0.2, delta=0.1)
+
+        # Stopping drops the queue.
+        self.backend.play(1.9)
+        self.backend.queue(resource_dir + "1sec.mp3")
+        self.backend.stop()
+        self.assertFalse(self.backend.get_busy())
+
+
+# Plays for real, so only where there's somewhere to play to.
+@unittest.skipIf(SOUNDDEVICE_MISSING, "Sounddevice can't play here: {}".format(SOUNDDEVICE_MISSING))
+class TestSoundDeviceBackend(unittest.TestCase):
+
+    backend: AudioBackend
+
+    def setUp(self):
+        self.backend = get_backend("sounddevice")
+        self.backend.refresh_output_devices()
+        self.backend.init()
+
+    def tearDown(self):
+        self.backend.quit()
+
+    def test_output_devices(self):
+        self.assertTrue(self.backend.output_devices())
+
+    def test_play(self):
+        self.backend.load(resource_dir + "1sec.mp3")
+        self.assertFalse(self.backend.get_busy())
+
+        # Doesn't wait for the decoder to start.
+        start = time.monotonic()
+        self.backend.play()
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertTrue(self.backend.get_busy())
+
+        time.sleep(0.5)
+        self.assertGreater(self.backend.get_pos(), 0.1)
+        self.assertLess(self.backend.get_pos(), 0.6)
+
+        time.sleep(1)
+        self.assertFalse(self.backend.get_busy())
+        self.assertAlmostEqual(self.backend.get_pos(), 1, delta=0.1)
+        self.assertEqual(self.backend.underflows, 0)
+
+    def test_seek(self):
+        self.backend.load(resource_dir + "2sec.mp3")
+        self.backend.play(1.5)
+        time.sleep(0.2)
+        self.assertTrue(self.backend.get_busy())
+        self.assertLess(self.backend.get_pos(), 0.3)
+
+        # Seeking restarts it from the new position.
+        self.backend.play(0.5)
+        self.assertTrue(self.backend.get_busy())
+        time.sleep(1.2)
+        self.assertFalse(self.backend.get_busy())
+
+        self.backend.play(0)
+        self.backend.stop()
+        self.assertFalse(self.backend.get_busy())
+
+
+# Decodes for real, with the stream faked, so it runs anywhere ffmpeg and PortAudio are installed.
+@unittest.skipIf(SOUNDDEVICE_DECODING_MISSING, "Sounddevice can't decode here: {}".format(SOUNDDEVICE_DECODING_MISSING))
+class TestSoundDeviceDecoding(unittest.TestCase):
+
+    backend: AudioBackend
+
+    def setUp(self):
+        from audio_backends import sounddevice_backend
+        self.module = sounddevice_backend
+        patches = [
+            mock.patch.object(sounddevice_backend.sd, "RawOutputStream", FakeStream),
+            mock.patch.object(sounddevice_backend.sd, "check_output_settings", lambda **kwargs: None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.backend = get_backend("sounddevice")
+        self.backend.init()
+
+    def tearDown(self):
+        self.backend.quit()
+
+    def _wait_until_done(self, timeout_s: float = 5):
+        end = time.monotonic() + timeout_s
+        while self.backend.get_busy() and time.monotonic() < end:
+            time.sleep(0.05)
+        self.assertFalse(self.backend.get_busy())
+
+    def test_play(self):
+        self.backend.load(resource_dir + "1sec.mp3")
+        self.backend.play()
+        stream = self.backend._stream
+        self.assertTrue(self.backend.get_busy())
+        self.assertEqual(self.module._open_streams, 1)
+
+        time.sleep(0.5)
+        self.assertGreater(self.backend.get_pos(), 0.1)
+        self.assertLess(self.backend.get_pos(), 0.6)
+
+        # Plays the whole file, in whole frames, with silence after it, and stops the stream itself.
+        self._wait_until_done()
+        self.assertAlmostEqual(self.backend.get_pos(), 1, delta=0.1)
+        self.assertEqual(self.backend.underflows, 0)
+        self.assertEqual(len(stream.played) % self.module.FRAME_BYTES, 0)
+        self.assertTrue(any(stream.played))
+        self.assertFalse(any(stream.played[-self.module.FRAME_BYTES:]))
+
+    def test_seek(self):
+        self.backend.load(resource_dir + "2sec.mp3")
+        self.backend.play(1.5)
+        first_stream = self.backend._stream
+        time.sleep(0.2)
+
+        # Seeking starts a new stream (and decoder) from the new position, the old ones stop.
+        self.backend.play(1)
+        self.assertTrue(first_stream.aborted)
+        self.assertEqual(self.module._open_streams, 1)
+        self._wait_until_done()
+        self.assertAlmostEqual(self.backend.get_pos(), 1, delta=0.1)
+
+    def test_stop(self):
+        self.backend.load(resource_dir + "5sec.mp3")
+        self.backend.play()
+        stream = self.backend._stream
+        decoder = self.backend._decoder
+        time.sleep(0.2)
+
+        self.backend.stop()
+        self.assertFalse(self.backend.get_busy())
+        self.assertTrue(stream.aborted)
+        self.assertEqual(self.module._open_streams, 0)
+        # The decoder's thread finishes up, even though it was still ahead of playback.
+        end = time.monotonic() + 5
+        while decoder._process and decoder._process.poll() is None and time.monotonic() < end:
+            time.sleep(0.05)
+        self.assertIsNotNone(decoder._process.poll())
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty
+from threading import Thread
+import unittest
+import multiprocessing
+import time
+import os
+import json
+
+from audio_engine import AudioEngine
+from baps_types.message import Message
+from helpers.logging_manager import LoggingManager
+from helpers.state_manager import StateManager
+
+# How long to wait (by default) in secs for the engine to respond.
+TIMEOUT_MSG_MAX_S = 10
+TIMEOUT_QUIT_S = 10
+CHANNELS = 2
+
+resource_dir = os.path.dirname(os.path.realpath(__file__)) + "/resources/"
+# How long the stand in for MyRadio takes to say it hasn't got a file.
+SLOW_RESPONSE_S = 2
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(SLOW_RESPONSE_S)
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAudioEngine(unittest.TestCase):
+
+    engine: multiprocessing.Process
+    to_q: list
+    from_q: list
+    logger: LoggingManager
+    server_state: StateManager
+
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_AudioEngine")
+        cls.myradio = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+        Thread(target=cls.myradio.serve_forever, daemon=True).start()
+        cls.server_state = StateManager(
+            "Test_AudioEngine", cls.logger, default_state={"tracklist_mode": "off", "audio_backend": "dummy"}
+        )
+        cls.server_state.update("myradio_base_url", "http://127.0.0.1:{}".format(cls.myradio.server_port))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.myradio.shutdown()
+        cls.myradio.server_close()
+
+    def setUp(self):
+        self.to_q = [multiprocessing.Queue() for _ in range(CHANNELS)]
+        self.from_q = [multiprocessing.Queue() for _ in range(CHANNELS)]
+        self.engine = multiprocessing.Process(
+            target=AudioEngine,
+            args=(self.to_q, self.from_q, self.server_state),
+        )
+        self.engine.start()
+        for channel in range(CHANNELS):
+            self._send_msg_wait_OKAY(channel, "CLEAR")
+            self._send_msg_wait_OKAY(channel, "UNLOAD")
+            self._send_msg_wait_OKAY(channel, "PLAYONLOAD:False")
+
+    def tearDown(self):
+        if self.engine.is_alive():
+            self.engine.terminate()
+
+    def _send_msg_wait_OKAY(self, channel: int, msg: str) -> str:
+        self.to_q[channel].put("TEST:{}".format(msg))
+        response = self._wait_for_reply(channel)
+        self.assertTrue(response.ok, "{} failed on channel {}".format(msg, channel))
+        return response.payload
+
+    def _wait_for_reply(self, channel: int) -> Message:
+        deadline = time.monotonic() + TIMEOUT_MSG_MAX_S
+        while time.monotonic() < deadline:
+            try:
+                response: Message = self.from_q[channel].get(timeout=0.1)
+            except Empty:
+                continue
+            if response.source == "TEST":
+                return response
+        self.fail("No response from channel {}".format(channel))
+
+    def _status(self, channel: int):
+        return json.loads(self._send_msg_wait_OKAY(channel, "STATUS"))
+
+    def test_channels(self):
+        item = {
+            "timeslotitemid": 0,
+            "managedid": "2",
+            "filename": resource_dir + "2sec.mp3",
+            "weight": 0,
+            "title": "2sec",
+            "length": "00:00:02",
+        }
+        self._send_msg_wait_OKAY(0, "ADD:" + json.dumps(item))
+        self._send_msg_wait_OKAY(0, "LOAD:0")
+        self._send_msg_wait_OKAY(0, "PLAY")
+        time.sleep(0.5)
+
+        # Each channel is still its own player.
+        status = self._status(0)
+        self.assertTrue(status["playing"])
+        self.assertEqual(status["channel"], 0)
+        self.assertGreater(status["pos_true"], 0)
+        status = self._status(1)
+        self.assertFalse(status["playing"])
+        self.assertEqual(status["channel"], 1)
+        self.assertEqual(status["show_plan"], [])
+
+        # Plays through to the end, as it would in its own process.
+        time.sleep(2)
+        self.assertFalse(self._status(0)["playing"])
+
+        # The other channels keep going until they're told to quit too.
+        self.to_q[0].put("TEST:QUIT")
+        time.sleep(0.5)
+        self.assertTrue(self.engine.is_alive())
+        self.assertTrue(self._status(1)["initialised"])
+
+        self.to_q[1].put("TEST:QUIT")
+        self.engine.join(timeout=TIMEOUT_QUIT_S)
+        self.assertEqual(self.engine.exitcode, 0)
+
+    def test_backend_fallback(self):
+        self.assertEqual(self._status(0)["audio_backend"], "dummy")
+        self.assertIsNone(self._status(0)["audio_backend_failed"])
+
+        # A backend that won't start leaves the channels going on the dummy one, but says so.
+        self.engine.terminate()
+        self.engine.join()
+        self.server_state.update("audio_backend", "gramophone")
+        self.addCleanup(self.server_state.update, "audio_backend", "dummy")
+        self.setUp()
+        for channel in range(CHANNELS):
+            status = self._status(channel)
+            self.assertTrue(status["initialised"])
+            self.assertEqual(status["audio_backend"], "dummy")
+            self.assertIn("gramophone", status["audio_backend_failed"])
+
+    def test_slow_download(self):
+        # Not downloaded yet, so loading it has to ask MyRadio, which takes its time.
+        item = {"timeslotitemid": 0, "managedid": "9999", "weight": 0, "title": "Slow", "length": "00:00:02"}
+        self._send_msg_wait_OKAY(0, "ADD:" + json.dumps(item))
+        self.to_q[0].put("TEST:LOAD:0")
+        self.to_q[0].put("TEST:PLAYONLOAD:True")
+        time.sleep(0.2)
+
+        # Meanwhile, every channel still answers straight away.
+        start = time.monotonic()
+        self.assertFalse(self._status(1)["playing"])
+        self.assertEqual(self._status(0)["loaded_item"]["weight"], 0)
+        self.assertLess(time.monotonic() - start, SLOW_RESPONSE_S / 2)
+
+        # Then the load fails, and only after that, the command that came in behind it is run.
+        load = self._wait_for_reply(0)
+        self.assertEqual(load.command, "LOAD")
+        self.assertFalse(load.ok)
+        play_on_load = self._wait_for_reply(0)
+        self.assertEqual(play_on_load.command, "PLAYONLOAD")
+        self.assertTrue(play_on_load.ok)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from baps_types.message import Command, Message, Source
+from helpers.command_registry import CommandRegistry, float_arg
+
+
+class TestCommandRegistry(unittest.TestCase):
+
+    registry: CommandRegistry
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.registry = CommandRegistry()
+        self.seeks = []
+
+        def seek(pos: float) -> bool:
+            self.seeks.append(pos)
+            return pos >= 0
+
+        self.registry.register(Command.SEEK, seek, float_arg)
+        self.registry.register(Command.STATUS, lambda: "{}", okay_str=True)
+
+    def _run(self, message: Message):
+        registered = self.registry.get(message.command)
+        self.assertIsNotNone(registered)
+        return self.registry.run(registered, message)
+
+    def test_run(self):
+        self.assertEqual(self._run(Message(Source.TEST, Command.SEEK, ("1.5",))), (True, False))
+        self.assertEqual(self.seeks, [1.5])
+
+        self.assertEqual(self._run(Message(Source.TEST, Command.STATUS)), ("{}", True))
+
+        self.assertIsNone(self.registry.get(Command.PLAY))
+
+    def test_stats(self):
+        self._run(Message(Source.TEST, Command.SEEK, ("1",)))
+        self._run(Message(Source.TEST, Command.SEEK, ("-1",)))
+        with self.assertRaises(ValueError):
+            self._run(Message(Source.TEST, Command.SEEK, ("nope",)))
+
+        stats = self.registry.get(Command.SEEK).stats
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.failures, 2)
+        # These are all quick.
+        self.assertEqual(stats.histogram[0], 3)
+
+        self.assertIn("SEEK: 3 calls (2 failed)", self.registry.stats_summary())
+        self.assertNotIn("STATUS", self.registry.stats_summary())
+
+        self.registry.reset_stats()
+        self.assertEqual(self.registry.stats_summary(), "")
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import time
+import unittest
+from threading import Thread
+
+import psutil
+
+from helpers.download_registry import ERROR_KEEP_S, DownloadRegistry
+
+
+class TestDownloadRegistry(unittest.TestCase):
+
+    registry: DownloadRegistry
+
+    def setUp(self):
+        self.registry = DownloadRegistry()
+
+    def test_claim(self):
+        self.assertTrue(self.registry.claim("track-1", os.getpid()))
+        self.assertFalse(self.registry.claim("track-1", os.getpid()))
+        self.assertTrue(self.registry.claim("track-2", os.getpid()))
+        self.assertEqual(sorted(self.registry.in_progress()), ["track-1", "track-2"])
+
+        self.registry.finish("track-1")
+        self.assertTrue(self.registry.claim("track-1", os.getpid()))
+
+    def test_wait(self):
+        # Nothing to wait for.
+        self.assertEqual(self.registry.wait("track-1", 1), (True, None))
+
+        self.registry.claim("track-1", os.getpid())
+        self.assertEqual(self.registry.wait("track-1", 0.1), (False, None))
+
+        def finish():
+            time.sleep(0.2)
+            self.registry.finish("track-1", "Status code: 404")
+
+        Thread(target=finish).start()
+        start = time.monotonic()
+        self.assertEqual(self.registry.wait("track-1", 5), (True, "Status code: 404"))
+        # Woken as soon as it finished, not on the next check.
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_errors_forgotten(self):
+        # Only failures are kept, and not forever.
+        self.registry.claim("track-1", os.getpid())
+        self.registry.finish("track-1")
+        self.registry.claim("track-2", os.getpid())
+        self.registry.finish("track-2", "Status code: 404")
+        self.assertEqual(list(self.registry._errors.keys()), ["track-2"])
+        self.assertEqual(self.registry.wait("track-2", 1), (True, "Status code: 404"))
+
+        self.registry._errors["track-2"] = ("Status code: 404", time.monotonic() - ERROR_KEEP_S)
+        self.assertEqual(self.registry.wait("track-2", 1), (True, None))
+        self.registry.claim("track-3", os.getpid())
+        self.registry.finish("track-3")
+        self.assertEqual(self.registry._errors, {})
+
+    def test_owner_stopped(self):
+        pid = max(psutil.pids()) + 1000
+        while psutil.pid_exists(pid):
+            pid += 1
+        self.registry.claim("track-1", pid)
+
+        finished, error = self.registry.wait("track-1", 5)
+        self.assertTrue(finished)
+        self.assertTrue(error)
+        self.assertTrue(self.registry.claim("track-1", os.getpid()))
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import Executor, Future
+from typing import Dict, List, Optional, Tuple
+
+from baps_types.message import Command, Message, Source
+from baps_types.plan import PlanItem
+from file_manager import MAX_CONCURRENT_DOWNLOADS, NORMALISE_WORKERS, FileManager, _download_key
+from helpers.logging_manager import LoggingManager
+from helpers.music_cache import MusicCache
+
+
+def plan_item(weight: int, trackid: int, filename: Optional[str] = None) -> Dict:
+    item = {
+        "timeslotitemid": str(weight),
+        "trackid": trackid,
+        "weight": weight,
+        "title": "Track {}".format(trackid),
+        "length": "00:00:10",
+    }
+    if filename:
+        item["filename"] = filename
+    return item
+
+
+def status_message(plan: List[Dict], loaded: Optional[int] = None, loaded_item: Optional[Dict] = None) -> Message:
+    status = {
+        "show_plan": plan,
+        "loaded_item": loaded_item or next((item for item in plan if item["weight"] == loaded), None),
+    }
+    return Message(Source.TEST, Command.STATUS, payload=json.dumps(status), ok=True)
+
+
+# Downloads block until the test lets them finish.
+class StandInAPI:
+    def __init__(self):
+        self.started: List[str] = []
+        self.cancelled: List[str] = []
+        self.finish: Dict[str, asyncio.Event] = {}
+
+    async def get_filename(self, item: PlanItem, did_download=False, redownload=False, progress=None):
+        key = _download_key(item)
+        self.started.append(key)
+        self.finish[key] = asyncio.Event()
+        try:
+            await self.finish[key].wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(key)
+            raise
+        return "/music-tmp/{}.mp3".format(key), False
+
+
+# Everything FileManager.__init__ sets up, without starting its loop.
+class StandInFileManager(FileManager):
+    def __init__(self, channel_count: int, path: str):
+        self.logger = LoggingManager("Test_FileManager")
+        self.api = StandInAPI()
+        self.file_state = None
+        self.channel_count = channel_count
+        self.last_known_show_plan = [[]] * channel_count
+        self.last_known_loaded = [None] * channel_count
+        self.last_known_loaded_keys = [None] * channel_count
+        self.last_known_status = [None] * channel_count
+        self.last_known_item_ids = [[]] * channel_count
+        self.download_queue = []
+        self.wanted = {}
+        self.downloading = {}
+        self.download_progress = {}
+        self.downloaded = {}
+        self.failed = set()
+        self.in_plans = {}
+        self.normalising = {}
+        self.normalise_abandoned = {}
+        self.normalised = {}
+        self.normalise_failed = set()
+        self.cache = MusicCache(path, 1024 * 1024 * 1024)
+
+    def send_status(
+        self, channel: int, plan: List[Dict], loaded: Optional[int] = None, loaded_item: Optional[Dict] = None
+    ):
+        # As the main loop does, once it's woken up.
+        if self._handle_message(channel, status_message(plan, loaded, loaded_item)):
+            self._update_downloads()
+
+
+class TestFileManagerDownloads(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.path = tempfile.mkdtemp()
+        self.manager = StandInFileManager(2, self.path)
+        self.manager.download_ready = asyncio.Event()
+        self.workers = [
+            asyncio.ensure_future(self.manager._download_worker()) for _ in range(MAX_CONCURRENT_DOWNLOADS)
+        ]
+
+    async def asyncTearDown(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        shutil.rmtree(self.path)
+
+    async def _finish(self, key: str):
+        self.manager.api.finish[key].set()
+        await asyncio.sleep(0.01)
+
+    async def test_priority(self):
+        plan = [plan_item(weight, 100 + weight) for weight in range(7)]
+        self.manager.send_status(1, [])
+        self.manager.send_status(0, plan, loaded=3)
+        await asyncio.sleep(0.01)
+
+        # Loaded first, then next up, then the rest in plan order, only so many at once.
+        self.assertEqual(self.manager.api.started, ["track-103", "track-104", "track-100", "track-101"])
+        self.assertEqual(len(self.manager.downloading), MAX_CONCURRENT_DOWNLOADS)
+
+        await self._finish("track-100")
+        self.assertEqual(self.manager.api.started[4:], ["track-102"])
+        for key in ["track-101", "track-102", "track-103", "track-104"]:
+            await self._finish(key)
+        self.assertEqual(self.manager.api.started[5:], ["track-105", "track-106"])
+        self.assertIn("track-103", self.manager.downloaded)
+
+    async def test_newly_loaded_first(self):
+        plan = [plan_item(weight, 100 + weight) for weight in range(8)]
+        self.manager.send_status(1, [])
+        self.manager.send_status(0, plan)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.manager.api.started, ["track-100", "track-101", "track-102", "track-103"])
+
+        # Loading something further down jumps it (and what's after it) ahead of the rest of the queue.
+        self.manager.send_status(0, plan, loaded=6)
+        await self._finish("track-102")
+        await self._finish("track-103")
+        self.assertEqual(self.manager.api.started[4:], ["track-106", "track-107"])
+
+    async def test_shared_between_channels(self):
+        # The same track in both channels is only downloaded once, as urgently as either needs it.
+        self.manager.send_status(0, [plan_item(0, 200), plan_item(1, 201), plan_item(2, 300)])
+        self.manager.send_status(1, [plan_item(0, 300)], loaded=0)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.manager.api.started, ["track-300", "track-200", "track-201"])
+        self.assertEqual(self.manager.wanted["track-300"][0][0], 0)
+
+        await self._finish("track-300")
+        self.assertEqual(self.manager.api.started.count("track-300"), 1)
+
+    async def test_cancel_removed(self):
+        plan = [plan_item(weight, 100 + weight) for weight in range(6)]
+        self.manager.send_status(1, [])
+        self.manager.send_status(0, plan)
+        await asyncio.sleep(0.01)
+
+        # One being downloaded, and one still queued, are taken out of the plan.
+        self.manager.send_status(0, [item for item in plan if item["trackid"] not in [101, 104]])
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.manager.api.cancelled, ["track-101"])
+        self.assertNotIn("track-101", self.manager.downloading)
+
+        # Its place goes to the next one, and the removed one never starts.
+        self.assertEqual(self.manager.api.started[4:], ["track-105"])
+        for key in ["track-100", "track-102", "track-103", "track-105"]:
+            await self._finish(key)
+        self.assertNotIn("track-104", self.manager.api.started)
+        self.assertNotIn("track-101", self.manager.downloaded)
+        self.assertNotIn("track-101", self.manager.failed)
+
+
+class TestFileManagerEviction(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.manager = StandInFileManager(1, self.path)
+        self.manager.cache = MusicCache(self.path, 250)
+        self.manager.download_ready = asyncio.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_loaded_kept(self):
+        for trackid in [1, 2, 3]:
+            with open(os.path.join(self.path, "track-{}.mp3".format(trackid)), "wb") as file:
+                file.write(b"\0" * 100)
+            self.manager.cache.add("track-{}".format(trackid))
+
+        # Track 1 is still loaded (and maybe playing), but it's been taken out of the plan.
+        self.manager.send_status(0, [plan_item(0, 2)], loaded_item=plan_item(5, 1))
+        self.manager._evict()
+
+        self.assertTrue(os.path.isfile(os.path.join(self.path, "track-1.mp3")))
+        self.assertTrue(os.path.isfile(os.path.join(self.path, "track-2.mp3")))
+        self.assertFalse(os.path.isfile(os.path.join(self.path, "track-3.mp3")))
+
+
+# Normalisation jobs only finish when the test says so.
+class StandInPool(Executor):
+    def __init__(self):
+        self.jobs: List[Tuple[str, Future]] = []
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+        self.jobs.append((args[0], future))
+        return future
+
+    def started(self) -> List[str]:
+        return [os.path.basename(filename) for filename, _ in self.jobs]
+
+    def finish(self, name: str):
+        for filename, future in self.jobs:
+            if os.path.basename(filename) == name:
+                future.set_result((filename.replace(".mp3", "-normalised.mp3"), 0.5))
+
+
+class TestFileManagerNormalisation(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.path = tempfile.mkdtemp()
+        self.manager = StandInFileManager(1, self.path)
+        self.manager.normalise_pool = StandInPool()
+
+    async def asyncTearDown(self):
+        tasks = list(self.manager.normalising.values()) + list(self.manager.normalise_abandoned.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        shutil.rmtree(self.path)
+
+    # A plan of files the player already has, so there's nothing to download.
+    def _plan(self, count: int) -> List[Dict]:
+        plan = []
+        for weight in range(count):
+            filename = os.path.join(self.path, "track-{}.mp3".format(100 + weight))
+            open(filename, "wb").close()
+            plan.append(plan_item(weight, 100 + weight, filename))
+        return plan
+
+    def _send_status(self, plan: List[Dict], loaded: Optional[int] = None):
+        self.manager.send_status(0, plan, loaded)
+        self.manager._update_normalisation()
+
+    async def _finish(self, name: str):
+        self.manager.normalise_pool.finish(name)
+        # Give the indexing thread time to give up on the (empty) file.
+        await asyncio.sleep(0.2)
+
+    async def test_priority(self):
+        plan = self._plan(NORMALISE_WORKERS + 2)
+        loaded = NORMALISE_WORKERS
+        self._send_status(plan, loaded)
+        await asyncio.sleep(0.01)
+
+        # Most urgent first, and only as many as there are workers, the rest wait their turn.
+        expected = ["track-{}.mp3".format(100 + weight) for weight in [loaded, loaded + 1] + list(range(loaded))]
+        pool = self.manager.normalise_pool
+        self.assertEqual(pool.started(), expected[:NORMALISE_WORKERS])
+
+        await self._finish(expected[0])
+        self.assertEqual(self.manager.normalised, {"track-{}".format(100 + loaded): 0.5})
+        self.assertEqual(pool.started(), expected[:NORMALISE_WORKERS + 1])
+
+    async def test_dropped(self):
+        plan = self._plan(NORMALISE_WORKERS + 2)
+        self._send_status(plan)
+        await asyncio.sleep(0.01)
+        pool = self.manager.normalise_pool
+        running = pool.started()
+        self.assertEqual(len(running), NORMALISE_WORKERS)
+
+        # One that's running, and one still queued, leave the plan.
+        queued = "track-{}.mp3".format(100 + NORMALISE_WORKERS)
+        removed = [running[0], queued]
+        self._send_status([item for item in plan if os.path.basename(item["filename"]) not in removed])
+        await asyncio.sleep(0.01)
+        self.assertIn("track-100", self.manager.normalise_abandoned)
+        # Its job carries on, so its worker's still busy.
+        self.assertEqual(len(pool.started()), NORMALISE_WORKERS)
+
+        # Once it's done, its result is forgotten, and the worker goes to the next, skipping the dropped one.
+        await self._finish(running[0])
+        self.assertEqual(self.manager.normalise_abandoned, {})
+        self.assertNotIn("track-100", self.manager.normalised)
+        self.assertEqual(pool.started()[NORMALISE_WORKERS:], ["track-{}.mp3".format(101 + NORMALISE_WORKERS)])
+        self.assertNotIn(queued, pool.started())
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
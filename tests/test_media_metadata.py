@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from helpers.media_metadata import MediaInfo, get_media_info, probe_media_info, read_media_info, write_media_info
+
+resource_dir = os.path.dirname(os.path.realpath(__file__)) + "/resources/"
+
+
+class TestMediaMetadata(unittest.TestCase):
+
+    temp_dir: str
+    filename: str
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, "2sec.mp3")
+        shutil.copyfile(resource_dir + "2sec.mp3", self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_probe(self):
+        info = probe_media_info(self.filename)
+        self.assertAlmostEqual(info.duration, 2, places=1)
+        self.assertEqual(info.codec, "mp3")
+        self.assertEqual(info.sample_rate, 44100)
+        self.assertEqual(info.channels, 2)
+        self.assertIsNone(info.loudness_dbfs)
+
+        with open(os.path.join(self.temp_dir, "junk.mp3"), "wb") as file:
+            file.write(b"Not really audio.")
+        with self.assertRaises(ValueError):
+            probe_media_info(file.name)
+
+    def test_index(self):
+        self.assertIsNone(read_media_info(self.filename))
+
+        info = MediaInfo(duration=1.5, codec="mp3", sample_rate=48000, channels=1, loudness_dbfs=-20)
+        write_media_info(self.filename, info)
+        self.assertEqual(read_media_info(self.filename), info)
+        # Indexed entries are used over probing the file.
+        self.assertEqual(get_media_info(self.filename), info)
+
+        # Once the file changes, the old entry no longer applies.
+        with open(self.filename, "ab") as file:
+            file.write(b"\0")
+        self.assertIsNone(read_media_info(self.filename))
+        self.assertAlmostEqual(get_media_info(self.filename).duration, 2, places=1)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import pickle
+import json
+
+from baps_types.message import Command, Message, MessageQueue, Source
+
+
+class TestMessage(unittest.TestCase):
+
+    def test_parse_legacy(self):
+        message = Message.parse("WEBSOCKET:LOAD:3")
+        self.assertEqual(message.source, Source.WEBSOCKET)
+        self.assertEqual(message.command, Command.LOAD)
+        self.assertEqual(message.args, ("3",))
+        self.assertIsNone(message.payload)
+        self.assertEqual(str(message), "WEBSOCKET:LOAD:3")
+
+        # Commands are still just strings underneath, so old comparisons work.
+        self.assertEqual(Message.parse("UI:LOADED?").command, "LOADED?")
+
+    def test_payload_with_colons(self):
+        marker = json.dumps({"name": "Intro: part 1", "time": 1.5})
+        message = Message.parse("TEST:SETMARKER:123:" + marker)
+        self.assertEqual(message.args, ("123",))
+        self.assertEqual(message.payload, marker)
+        self.assertEqual(message.data["name"], "Intro: part 1")
+
+        message = Message.parse("TEST:ADD:" + marker)
+        self.assertEqual(message.args, ())
+        self.assertEqual(message.payload, marker)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Message.parse("NOBODY:PLAY")
+        with self.assertRaises(ValueError):
+            Message.parse("UI:DANCE")
+        with self.assertRaises(ValueError):
+            Message.parse("UI:LOAD")
+        with self.assertRaises(ValueError):
+            Message.parse("UI:PLAY:now")
+        with self.assertRaises(ValueError):
+            Message.parse("UI:SETMARKER:123")
+
+        # Enough to tell the sender it failed, where we can.
+        self.assertEqual(str(Message.parse_failed("UI:DANCE").reply(False)), "UI:UNKNOWN:FAIL")
+        self.assertEqual(str(Message.parse_failed("UI:LOAD").reply(False)), "UI:LOAD:FAIL")
+        self.assertIsNone(Message.parse_failed("NOBODY:PLAY"))
+
+    def test_reply(self):
+        request = Message(Source.UI, Command.STATUS, request_id="abc")
+        reply = request.reply(True, json.dumps({"playing": True}))
+        self.assertEqual(reply.source, Source.UI)
+        self.assertEqual(reply.request_id, "abc")
+        self.assertTrue(reply.ok)
+        self.assertEqual(str(reply), 'UI:STATUS:OKAY:{"playing": true}')
+
+        self.assertEqual(str(request.reply(False)), "UI:STATUS:FAIL")
+
+    def test_pickle(self):
+        message = Message(Source.ALL, Command.POS, payload="12.5", ok=None)
+        unpickled = pickle.loads(pickle.dumps(message))
+        self.assertEqual(unpickled, message)
+        self.assertIs(unpickled.command, Command.POS)
+
+        # Anything left as the default isn't sent at all, so it's no bigger than the old string.
+        seek = Message(Source.WEBSOCKET, Command.SEEK, (12.5,))
+        self.assertLessEqual(len(pickle.dumps(seek)), len(pickle.dumps("WEBSOCKET:SEEK:12.5")))
+        self.assertEqual(pickle.loads(pickle.dumps(seek)), seek)
+
+        reply = Message(Source.UI, Command.STATUS, request_id="abc").reply(False)
+        self.assertEqual(pickle.loads(pickle.dumps(reply)), reply)
+
+        # When it was sent goes along with it, but doesn't make it a different message.
+        reply.sent_at = 1234.5
+        unpickled = pickle.loads(pickle.dumps(reply))
+        self.assertEqual(unpickled.sent_at, 1234.5)
+        self.assertEqual(unpickled, reply)
+        self.assertIsNone(unpickled.reply(True).sent_at)
+
+    def test_queue(self):
+        queue = MessageQueue()
+        seek = Message(Source.WEBSOCKET, Command.SEEK, (12.5,))
+        reply = Message(Source.UI, Command.STATUS, request_id="abc").reply(True, "{}")
+        reply.sent_at = 1234.5
+        for message in [seek, reply, "WEBSOCKET:SEEK:12.5"]:
+            queue.put(message)
+        self.assertEqual(queue.get(timeout=1), seek)
+        self.assertIs(queue.get(timeout=1).command, Command.STATUS)
+        # Old format strings still go through untouched.
+        self.assertEqual(queue.get(timeout=1), "WEBSOCKET:SEEK:12.5")
+        queue.close()
+
+        # Args are kept as given, but it's the same message as one parsed from the old strings.
+        self.assertEqual(seek, Message.parse("WEBSOCKET:SEEK:12.5"))
+        self.assertEqual(str(seek), "WEBSOCKET:SEEK:12.5")
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
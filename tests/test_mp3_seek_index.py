@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from helpers.mp3_seek_index import build_seek_index, read_seek_index, write_seek_index
+
+resource_dir = os.path.dirname(os.path.realpath(__file__)) + "/resources/"
+
+
+class TestMP3SeekIndex(unittest.TestCase):
+
+    temp_dir: str
+    filename: str
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, "5sec.mp3")
+        shutil.copyfile(resource_dir + "5sec.mp3", self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_build(self):
+        index = build_seek_index(self.filename)
+        self.assertEqual(index.sample_rate, 44100)
+        self.assertEqual(index.samples_per_frame, 1152)
+        self.assertAlmostEqual(index.duration, 5, delta=0.1)
+
+        with open(self.filename, "rb") as file:
+            data = file.read()
+        # Every offset should be the start of a frame.
+        for offset in index.offsets:
+            self.assertEqual(data[offset], 0xFF)
+
+        offset, frame_pos = index.lookup(2.5)
+        self.assertLessEqual(frame_pos, 2.5)
+        self.assertGreater(frame_pos, 2.5 - index.frame_s)
+        self.assertEqual(index.lookup(0), (index.offsets[0], 0))
+        self.assertEqual(index.lookup(1000)[0], index.offsets[-1])
+
+        with open(os.path.join(self.temp_dir, "junk.mp3"), "wb") as file:
+            file.write(b"Not really audio.")
+        with self.assertRaises(ValueError):
+            build_seek_index(file.name)
+
+    def test_stored(self):
+        self.assertIsNone(read_seek_index(self.filename))
+
+        index = build_seek_index(self.filename)
+        write_seek_index(self.filename, index)
+        stored = read_seek_index(self.filename)
+        self.assertIsNotNone(stored)
+        self.assertEqual(list(stored.offsets), list(index.offsets))
+        self.assertEqual(stored.frame_s, index.frame_s)
+
+        # Once the file changes, the old index no longer applies.
+        with open(self.filename, "ab") as file:
+            file.write(b"\0")
+        self.assertIsNone(read_seek_index(self.filename))
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
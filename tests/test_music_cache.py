@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from helpers.music_cache import MusicCache, cache_key
+
+
+class TestMusicCache(unittest.TestCase):
+
+    path: str
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, name: str, size: int):
+        with open(os.path.join(self.path, name), "wb") as file:
+            file.write(b"\0" * size)
+
+    def test_cache_key(self):
+        self.assertEqual(cache_key("track-123.mp3"), "track-123")
+        self.assertEqual(cache_key("track-123-normalised.mp3.peaks"), "track-123")
+        self.assertEqual(cache_key("managed-45.mp3.downloading"), "managed-45")
+        self.assertIsNone(cache_key("cache-index.json"))
+
+    def test_use(self):
+        cache = MusicCache(self.path, 1000)
+        self.assertFalse(cache.use("track-1"))
+        self._write("track-1.mp3", 10)
+        cache.add("track-1")
+        self.assertTrue(cache.use("track-1"))
+        self.assertEqual(cache.entries["track-1"]["uses"], 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Changed underneath us, so it's not the file we downloaded.
+        self._write("track-1.mp3", 20)
+        self.assertFalse(cache.use("track-1"))
+        self.assertFalse(os.path.exists(os.path.join(self.path, "track-1.mp3")))
+
+    def test_evict(self):
+        cache = MusicCache(self.path, 250)
+        for key in ["track-1", "track-2", "track-3", "managed-4"]:
+            self._write(key + ".mp3", 100)
+            cache.add(key)
+            cache.use(key)
+        self._write("track-1-normalised.mp3", 100)
+        now = time.time()
+        cache.entries["track-1"]["last_used"] = now - 300
+        cache.entries["track-2"]["last_used"] = now - 200
+        cache.entries["track-3"]["last_used"] = now - 200
+        cache.entries["track-3"]["uses"] = 5
+        cache.entries["managed-4"]["last_used"] = now - 100
+        # A download on its way.
+        self._write("track-5.mp3.downloading", 100)
+
+        # Oldest first (normalised copy and all), apart from what's still wanted, then least used.
+        self.assertEqual(cache.evict(keep=["track-1"]), ["track-2", "track-3", "managed-4"])
+        self.assertEqual(sorted(os.listdir(self.path)), ["track-1-normalised.mp3", "track-1.mp3", "track-5.mp3.downloading"])
+        self.assertEqual(cache.evictions, 3)
+
+    def test_index(self):
+        cache = MusicCache(self.path, 1000)
+        self._write("track-1.mp3", 10)
+        cache.add("track-1")
+        cache.use("track-1")
+        cache.use("track-2")
+        cache.save()
+
+        loaded = MusicCache(self.path, 1000)
+        self.assertEqual(loaded.entries, cache.entries)
+        self.assertEqual((loaded.hits, loaded.misses), (1, 1))
+        self.assertEqual(loaded.stats()["files"], 1)
+        self.assertEqual(loaded.stats()["size_bytes"], 10)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from helpers.logging_manager import LoggingManager
+from helpers.myradio_api import VALIDATOR_SUFFIX, DownloadError, MyRadioAPI, close_async_session
+
+CONTENT = bytes(range(256)) * 4096  # 1MB
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Settings for the next request, reset after.
+    cut_off_after = None
+    ranges = True
+    missing = False
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        start = 0
+        requested = self.headers.get("Range")
+        StandInHandler.requests.append(requested)
+        if self.headers.get("If-Range") != StandInHandler.etag:
+            # Not the file they think they've got part of (anymore), so they get the whole thing.
+            requested = None
+        if StandInHandler.missing:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if requested and StandInHandler.ranges:
+            start = int(requested.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(CONTENT) - 1, len(CONTENT)))
+        else:
+            self.send_response(200)
+        self.send_header("ETag", StandInHandler.etag)
+        self.send_header("Content-Length", str(len(CONTENT) - start))
+        self.end_headers()
+
+        body = CONTENT[start:]
+        if StandInHandler.cut_off_after:
+            body = body[:StandInHandler.cut_off_after]
+            StandInHandler.cut_off_after = None
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestMyRadioDownload(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.api = MyRadioAPI(LoggingManager("Test_MyRadioDownload"), None)
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:{}/file".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, "file.mp3.downloading")
+        StandInHandler.requests = []
+        StandInHandler.ranges = True
+        StandInHandler.missing = False
+        StandInHandler.etag = '"v1"'
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _download(self, progress=None):
+        async def download():
+            try:
+                return await self.api.async_download(self.url, self.filename, progress)
+            finally:
+                await close_async_session()
+
+        return asyncio.run(download())
+
+    def _downloaded(self) -> bytes:
+        with open(self.filename, "rb") as file:
+            return file.read()
+
+    def _partial(self, data: bytes, validator=None):
+        with open(self.filename, "wb") as file:
+            file.write(data)
+        if validator:
+            with open(self.filename + VALIDATOR_SUFFIX, "w") as file:
+                file.write(validator)
+
+    def test_download(self):
+        progress = []
+        self._download(lambda done, total: progress.append((done, total)))
+        self.assertEqual(self._downloaded(), CONTENT)
+        self.assertEqual(progress[-1], (len(CONTENT), len(CONTENT)))
+        # Written as it came in, not all at once.
+        self.assertGreater(len(progress), 1)
+
+    def test_resume(self):
+        StandInHandler.cut_off_after = 300000
+        self._download()
+        self.assertEqual(self._downloaded(), CONTENT)
+        self.assertEqual(StandInHandler.requests, [None, "bytes=300000-"])
+        # Done with once it's finished.
+        self.assertFalse(os.path.exists(self.filename + VALIDATOR_SUFFIX))
+
+        # Something left from an earlier try is carried on from too.
+        StandInHandler.requests = []
+        self._partial(CONTENT[:1000], '"v1"')
+        self._download()
+        self.assertEqual(self._downloaded(), CONTENT)
+        self.assertEqual(StandInHandler.requests, ["bytes=1000-"])
+
+    def test_changed(self):
+        # The file's changed since the partial was downloaded, so the server sends all of the new one.
+        StandInHandler.etag = '"v2"'
+        self._partial(b"\xff" * 1000, '"v1"')
+        self._download()
+        self.assertEqual(self._downloaded(), CONTENT)
+
+    def test_no_validator(self):
+        # No way to know what the partial is part of, so it's not carried on from.
+        self._partial(b"\xff" * 1000)
+        self._download()
+        self.assertEqual(self._downloaded(), CONTENT)
+        self.assertEqual(StandInHandler.requests, [None])
+
+    def test_no_ranges(self):
+        # If the server can't carry on, it sends the whole thing again, which mustn't be added onto what we had.
+        StandInHandler.ranges = False
+        self._partial(CONTENT[:1000], '"v1"')
+        self._download()
+        self.assertEqual(self._downloaded(), CONTENT)
+
+    def test_failed(self):
+        StandInHandler.missing = True
+        with self.assertRaisesRegex(DownloadError, "404"):
+            self._download()
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from helpers.playback_position import PlaybackClock
+
+LATENCY_S = 0.02
+GRANULARITY_S = 0.02
+
+
+class TestPlaybackClock(unittest.TestCase):
+
+    clock: PlaybackClock
+
+    def setUp(self):
+        self.clock = PlaybackClock(output_latency_s=LATENCY_S, granularity_s=GRANULARITY_S)
+
+    def test_runs_from_start(self):
+        self.clock.start(10, now=100)
+        # Nothing's audible until it's made it through the output buffer.
+        self.assertEqual(self.clock.position(now=100.01), 10)
+        self.assertAlmostEqual(self.clock.position(now=102), 12 - LATENCY_S)
+
+        self.clock.stop(now=103)
+        self.assertFalse(self.clock.running)
+        self.assertAlmostEqual(self.clock.position(now=200), 13 - LATENCY_S)
+
+    def test_corrections(self):
+        self.clock.start(0, now=0)
+
+        # The backend being a buffer behind is expected, nothing changes.
+        self.clock.correct(0.98, now=1)
+        self.assertAlmostEqual(self.clock.position(now=1), 1 - LATENCY_S)
+
+        # The backend is ahead, so we must be behind, catch up.
+        self.clock.correct(1.05, now=1)
+        self.assertAlmostEqual(self.clock.position(now=1), 1.05 - LATENCY_S)
+
+        # Running fast, ease back a little at a time, rather than jumping back.
+        self.clock.correct(1.95, now=2)
+        position = self.clock.position(now=2)
+        self.assertLess(position, 2.05 - LATENCY_S)
+        self.assertGreater(position, 1.95 - LATENCY_S)
+
+        # Way out, the backend must have jumped.
+        self.clock.correct(30, now=3)
+        self.assertAlmostEqual(self.clock.position(now=3), 30 - LATENCY_S)
+
+    def test_stopped(self):
+        self.clock.correct(5, now=1)
+        self.assertEqual(self.clock.position(now=1), 0)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
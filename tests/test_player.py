@@ -7,8 +7,10 @@ import os
 import json
 
 from player import Player
+from baps_types.message import Message
 from helpers.logging_manager import LoggingManager
 from helpers.state_manager import StateManager
+from helpers.shared_status import StatusSlot
 from helpers.os_environment import isMacOS
 
 # How long to wait (by default) in secs for the player to respond.
@@ -60,6 +62,7 @@ class TestPlayer(unittest.TestCase):
     player: multiprocessing.Process
     player_from_q: multiprocessing.Queue
     player_to_q: multiprocessing.Queue
+    status_slot: StatusSlot
     logger: LoggingManager
     server_state: StateManager
 
@@ -83,9 +86,10 @@ class TestPlayer(unittest.TestCase):
     def setUp(self):
         self.player_from_q = multiprocessing.Queue()
         self.player_to_q = multiprocessing.Queue()
+        self.status_slot = StatusSlot()
         self.player = multiprocessing.Process(
             target=Player,
-            args=(-1, self.player_to_q, self.player_from_q, self.server_state),
+            args=(-1, self.player_to_q, self.player_from_q, self.server_state, self.status_slot),
         )
         self.player.start()
         self._send_msg_wait_OKAY("CLEAR")  # Empty any previous track items.
@@ -106,6 +110,7 @@ class TestPlayer(unittest.TestCase):
             self.logger.log.error("No response on teardown, terminating player.")
             # It's brain dead :/
             self.player.terminate()
+        self.status_slot.close()
 
     def _send_msg(self, msg: str):
         self.player_to_q.put("TEST:{}".format(msg))
@@ -117,7 +122,7 @@ class TestPlayer(unittest.TestCase):
         got_anything = False
         while elapsed < timeout:
             try:
-                response: str = self.player_from_q.get_nowait()
+                response: Message = self.player_from_q.get_nowait()
                 if response:
                     self.logger.log.info(
                         "Received response: {}\nWas looking for {}:{}".format(
@@ -125,11 +130,12 @@ class TestPlayer(unittest.TestCase):
                         )
                     )
                     got_anything = True
-                    source = response[: response.index(":")]
-                    if source in sources_filter:
-                        return response[
-                            len(source + ":" + msg) + 1:
-                        ]  # +1 to remove trailing : on source.
+                    if response.source in sources_filter:
+                        # Give back the result in the old OKAY:payload string format.
+                        result = "OKAY" if response.ok else "FAIL"
+                        if response.payload is not None:
+                            result += ":" + response.payload
+                        return result
             except Empty:
                 pass
             finally:
@@ -169,6 +175,33 @@ class TestPlayer(unittest.TestCase):
 
         self.assertTrue(json_obj["initialised"])
 
+    def test_status_slot(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(5, 0))
+        self._send_msg_wait_OKAY("LOAD:0")
+        self._send_msg_wait_OKAY("PLAY")
+
+        # The shared status follows what's playing, but isn't republished just for the position moving,
+        # that's what the position clock is for.
+        time.sleep(1)
+        first = self.status_slot.read()
+        time.sleep(1)
+        second = self.status_slot.read()
+        self.assertTrue(json.loads(second)["playing"])
+        self.assertEqual(first, second)
+
+        self._send_msg_wait_OKAY("PAUSE")
+        time.sleep(0.5)
+        self.assertFalse(json.loads(self.status_slot.read())["playing"])
+
+    def test_bad_command(self):
+        # Bad args fail the command, but shouldn't take the channel down with it.
+        self.assertEqual(self._send_msg_and_wait("SEEK:nope"), "FAIL")
+        self.assertEqual(self._send_msg_and_wait("LOAD:first"), "FAIL")
+        # As are ones that don't make sense at all, the sender still gets told.
+        self.assertEqual(self._send_msg_and_wait("DANCE"), "FAIL:Unknown Command")
+        self.assertEqual(self._send_msg_and_wait("SEEK"), "FAIL:Command SEEK needs 1 args, got 0.")
+        self._send_msg_wait_OKAY("STATUS")
+
     def test_player_play(self):
 
         response = self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(2, 0))
@@ -247,6 +280,66 @@ class TestPlayer(unittest.TestCase):
         self.assertFalse(json_obj["playing"])
         self.assertEqual(json_obj["loaded_item"]["weight"], 0)
 
+    # This test checks the next item is prepared in advance, and the player moves straight onto it.
+    def test_gapless_auto_advance(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(2, 0))
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(2, 1))
+
+        self._send_msg_wait_OKAY("PLAYONLOAD:True")
+
+        self._send_msg_wait_OKAY("LOAD:0")
+
+        time.sleep(1)
+
+        # The second item should be ready to go.
+        response = self._send_msg_wait_OKAY("STATUS")
+        self.assertTrue(response)
+        json_obj = json.loads(response)
+        self.assertTrue(json_obj["playing"])
+        self.assertEqual(json_obj["loaded_item"]["weight"], 0)
+        self.assertTrue(json_obj["next_ready"])
+
+        time.sleep(1.5)
+
+        # We should have carried straight on into the second item.
+        response = self._send_msg_wait_OKAY("STATUS")
+        self.assertTrue(response)
+        json_obj = json.loads(response)
+        self.assertTrue(json_obj["playing"])
+        self.assertEqual(json_obj["loaded_item"]["weight"], 1)
+        self.assertLess(json_obj["pos_true"], 1)
+        # Nothing after the last item.
+        self.assertFalse(json_obj["next_ready"])
+
+    # This test checks a plan change after the next item was queued doesn't play the wrong item, or upset the live one.
+    def test_gapless_plan_change(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(2, 0))
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(2, 1))
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(1, 2))
+
+        self._send_msg_wait_OKAY("PLAYONLOAD:True")
+
+        self._send_msg_wait_OKAY("LOAD:0")
+
+        time.sleep(1)
+
+        # The second item's queued by now, take it out.
+        self._send_msg_wait_OKAY("REMOVE:1")
+        response = self._send_msg_wait_OKAY("STATUS")
+        json_obj = json.loads(response)
+        self.assertTrue(json_obj["playing"])
+        self.assertEqual(json_obj["loaded_item"]["weight"], 0)
+        self.assertGreater(json_obj["pos_true"], 0.5)
+
+        time.sleep(1.5)
+
+        # We should have moved onto what's next now, the third item.
+        response = self._send_msg_wait_OKAY("STATUS")
+        json_obj = json.loads(response)
+        self.assertTrue(json_obj["playing"])
+        self.assertEqual(json_obj["loaded_item"]["title"], "1sec")
+        self.assertEqual(json_obj["loaded_item"]["weight"], 1)
+
     # This test checks that the player repeats the first item without moving onto the second.
     def test_repeat_one(self):
         self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(5, 0))
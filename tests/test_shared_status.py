@@ -0,0 +1,140 @@
+import unittest
+import multiprocessing
+import json
+import time
+
+from helpers.shared_status import HEADER, PositionClock, StatusSlot
+
+
+def read_in_other_process(slot: StatusSlot, out_q: multiprocessing.Queue):
+    out_q.put(slot.read())
+    slot.close()
+
+
+def read_clock_in_other_process(clock: PositionClock, out_q: multiprocessing.Queue):
+    out_q.put(tuple(clock.read()))
+    clock.close()
+
+
+# Every value the same, so a reader can tell if it got parts of two different updates.
+def write_clock_in_other_process(clock: PositionClock, stop):
+    i = 0
+    while not stop.is_set():
+        i += 1
+        clock.update(i, i, i, True)
+    clock.close()
+
+
+class TestSharedStatus(unittest.TestCase):
+
+    slot: StatusSlot
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.slot = StatusSlot(size=1024)
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        self.slot.close()
+
+    def test_publish_read(self):
+        # Nothing published yet.
+        self.assertIsNone(self.slot.read())
+
+        self.slot.publish(json.dumps({"playing": True}))
+        self.assertEqual(json.loads(self.slot.read()), {"playing": True})
+
+        # Shorter statuses don't leave anything of the last one behind.
+        self.slot.publish(json.dumps({}))
+        self.assertEqual(json.loads(self.slot.read()), {})
+
+    def test_too_big(self):
+        self.slot.publish(json.dumps({"playing": True}))
+        self.slot.publish("x" * (1024 - HEADER.size + 1))
+        # Better nothing than an out of date status.
+        self.assertIsNone(self.slot.read())
+
+    def test_other_process(self):
+        self.slot.publish(json.dumps({"channel": 1}))
+
+        # Spawn, so the slot really is pickled over by name, like on Windows and MacOS.
+        context = multiprocessing.get_context("spawn")
+        out_q = context.Queue()
+        process = context.Process(
+            target=read_in_other_process, args=(self.slot, out_q)
+        )
+        process.start()
+        self.assertEqual(json.loads(out_q.get(timeout=10)), {"channel": 1})
+        process.join(timeout=10)
+
+
+class TestPositionClock(unittest.TestCase):
+
+    clock: PositionClock
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.clock = PositionClock()
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        self.clock.close()
+
+    def test_update_read(self):
+        # The player hasn't written anything yet.
+        self.assertIsNone(self.clock.read())
+
+        self.clock.update(1.5, 3.5, 5, False)
+        position = self.clock.read()
+        self.assertEqual(position.pos_true, 1.5)
+        self.assertEqual(position.remaining, 3.5)
+        self.assertEqual(position.length, 5)
+        self.assertFalse(position.playing)
+        # Not playing, so it's not going anywhere.
+        self.assertEqual(position.pos_now(position.updated + 10), 1.5)
+
+    def test_pos_now(self):
+        self.clock.update(1.5, 3.5, 5, True)
+        position = self.clock.read()
+        self.assertAlmostEqual(position.pos_now(position.updated + 1), 2.5)
+        # Never past the end of the item.
+        self.assertEqual(position.pos_now(position.updated + 10), 5)
+
+    def test_other_process(self):
+        self.clock.update(2, 3, 5, True)
+
+        context = multiprocessing.get_context("spawn")
+        out_q = context.Queue()
+        process = context.Process(
+            target=read_clock_in_other_process, args=(self.clock, out_q)
+        )
+        process.start()
+        self.assertEqual(out_q.get(timeout=10), tuple(self.clock.read()))
+        process.join(timeout=10)
+
+    def test_no_torn_reads(self):
+        context = multiprocessing.get_context("spawn")
+        stop = context.Event()
+        process = context.Process(target=write_clock_in_other_process, args=(self.clock, stop))
+        process.start()
+        try:
+            deadline = time.monotonic() + 10
+            reads = 0
+            while reads < 20000 and time.monotonic() < deadline:
+                position = self.clock.read()
+                if position:
+                    reads += 1
+                    self.assertEqual(position.pos_true, position.remaining)
+                    self.assertEqual(position.pos_true, position.length)
+        finally:
+            stop.set()
+            process.join(timeout=10)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
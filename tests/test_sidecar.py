@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from helpers.os_environment import resolve_external_file_path
+from helpers.sidecar import atomic_write, file_key, get_or_build, in_music_cache
+
+
+class TestSidecar(unittest.TestCase):
+
+    temp_dir: str
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_atomic_write(self):
+        filename = os.path.join(self.temp_dir, "test.peaks")
+        with atomic_write(filename) as file:
+            file.write(b"first")
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), b"first")
+
+        # If writing fails part way, the old copy is left alone, with nothing left behind.
+        with self.assertRaises(RuntimeError):
+            with atomic_write(filename) as file:
+                file.write(b"sec")
+                raise RuntimeError("Failed part way.")
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), b"first")
+        self.assertEqual(os.listdir(self.temp_dir), ["test.peaks"])
+
+    def test_file_key(self):
+        filename = os.path.join(self.temp_dir, "test.mp3")
+        with open(filename, "wb") as file:
+            file.write(b"audio")
+        key = file_key(filename)
+        self.assertEqual(key[0], 5)
+
+        with open(filename, "ab") as file:
+            file.write(b"more")
+        self.assertNotEqual(file_key(filename), key)
+
+    def test_get_or_build(self):
+        stored = {}
+        built = []
+
+        def build(filename: str) -> str:
+            built.append(filename)
+            return "built"
+
+        def write(filename: str, value: str):
+            stored[filename] = value
+
+        # Outside the music cache, it's built every time, and never stored.
+        filename = os.path.join(self.temp_dir, "test.mp3")
+        self.assertFalse(in_music_cache(filename))
+        self.assertEqual(get_or_build(filename, stored.get, build, write), "built")
+        self.assertEqual(get_or_build(filename, stored.get, build, write), "built")
+        self.assertEqual(len(built), 2)
+        self.assertEqual(stored, {})
+
+        # In it, it's stored, then read back.
+        filename = resolve_external_file_path("/music-tmp/test-sidecar.mp3")
+        self.assertTrue(in_music_cache(filename))
+        self.assertEqual(get_or_build(filename, stored.get, build, write), "built")
+        self.assertEqual(get_or_build(filename, stored.get, build, write), "built")
+        self.assertEqual(len(built), 3)
+        self.assertEqual(stored, {filename: "built"})
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
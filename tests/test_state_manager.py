@@ -0,0 +1,182 @@
+import unittest
+import os
+import json
+import time
+
+from helpers.logging_manager import LoggingManager
+from helpers.state_manager import StateManager
+from helpers.os_environment import resolve_external_file_path
+
+STATE_NAME = "Test_StateManager"
+WRITE_INTERVAL_S = 0.2
+
+
+class CountingStateManager(StateManager):
+    writes = 0
+
+    def write_to_file(self, state):
+        self.writes += 1
+        super().write_to_file(state)
+
+
+class TestStateManager(unittest.TestCase):
+
+    logger: LoggingManager
+    state: StateManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_StateManager")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        # Start from a fresh state file each time.
+        self.filepath = resolve_external_file_path("/state/" + STATE_NAME + ".json")
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+
+        self.state = CountingStateManager(
+            STATE_NAME,
+            self.logger,
+            default_state={"playing": False, "pos": 0, "show_plan": []},
+            write_interval_s=WRITE_INTERVAL_S,
+        )
+
+    def _read_file(self):
+        with open(self.filepath) as file:
+            return json.loads(file.read())
+
+    def test_get_value(self):
+        self.assertEqual(self.state.get_value("playing"), False)
+        self.state.update("playing", True)
+        self.assertEqual(self.state.get_value("playing"), True)
+
+        # Missing keys fall back to the default, like dict.get()
+        self.assertIsNone(self.state.get_value("missing"))
+        self.assertEqual(self.state.get_value("missing", 5), 5)
+
+    def test_version(self):
+        version = self.state.version
+        self.assertFalse(self.state.changed_since(version))
+
+        self.state.update("pos", 10)
+        self.assertTrue(self.state.changed_since(version))
+        self.assertGreater(self.state.version, version)
+
+        # Updating with the same value isn't a change.
+        version = self.state.version
+        self.state.update("pos", 10)
+        self.assertFalse(self.state.changed_since(version))
+
+    def test_snapshot(self):
+        snapshot = self.state.snapshot()
+        self.assertEqual(snapshot.version, self.state.version)
+        self.assertEqual(snapshot["pos"], 0)
+
+        self.state.update("pos", 20)
+        self.state.update("show_plan", ["item"])
+        self.state.update("show_plan", "new item", index=0)
+
+        # The old snapshot should stay exactly as it was.
+        self.assertEqual(snapshot["pos"], 0)
+        self.assertEqual(snapshot["show_plan"], [])
+        self.assertNotEqual(snapshot.version, self.state.version)
+
+        snapshot = self.state.snapshot()
+        self.assertEqual(snapshot["pos"], 20)
+        self.assertEqual(snapshot["show_plan"], ["new item"])
+
+        # Snapshots are read-only.
+        with self.assertRaises(TypeError):
+            snapshot["pos"] = 30  # type: ignore
+
+    def test_write_coalescing(self):
+        for pos in range(100):
+            self.state.update("pos", pos)
+
+        # Give the writer time to catch up with the burst.
+        time.sleep(WRITE_INTERVAL_S * 3)
+
+        # A burst of updates should only cause a write or two, not one per update.
+        self.assertLessEqual(self.state.writes, 3)
+        self.assertEqual(self._read_file()["pos"], 99)
+
+    def test_flush(self):
+        # Flushing writes straight away, rather than waiting for the writer's interval.
+        self.state.update("pos", 1)
+        self.state.flush()
+        self.assertEqual(self._read_file()["pos"], 1)
+
+        self.state.update("pos", 2)
+        self.state.flush()
+        self.assertEqual(self._read_file()["pos"], 2)
+
+        # Nothing has changed, so nothing to write.
+        writes = self.state.writes
+        self.state.flush()
+        self.assertEqual(self.state.writes, writes)
+
+    def test_separate_instances(self):
+        # Several channels' state managers share a process in the audio engine, they mustn't share callbacks.
+        other = StateManager(
+            STATE_NAME + "_Other",
+            self.logger,
+            default_state={"playing": False, "pos": 0, "show_plan": []},
+            write_interval_s=WRITE_INTERVAL_S,
+        )
+        self.addCleanup(os.remove, resolve_external_file_path("/state/" + STATE_NAME + "_Other.json"))
+        called = []
+        self.state.add_callback(lambda: called.append("state"))
+        other.add_callback(lambda: called.append("other"))
+        version = self.state.version
+
+        other.update("playing", True)
+        other.flush()
+        self.assertEqual(called, ["other"])
+        self.assertEqual(self.state.changed_keys_since(version), [])
+
+    def test_transient_params(self):
+        # Kept in memory, for anything in the process to read, but never written to disk.
+        other = StateManager(
+            STATE_NAME + "_Transient",
+            self.logger,
+            default_state={"pos": 0, "progress": {}},
+            write_interval_s=WRITE_INTERVAL_S,
+            transient_params=["progress"],
+        )
+        filepath = resolve_external_file_path("/state/" + STATE_NAME + "_Transient.json")
+        self.addCleanup(os.remove, filepath)
+        called = []
+        other.add_callback(lambda: called.append(True))
+
+        other.update("progress", {"track-1": 100})
+        self.assertEqual(other.get_value("progress"), {"track-1": 100})
+        self.assertEqual(called, [True])
+
+        other.update("pos", 1)
+        other.flush()
+        with open(filepath) as file:
+            written = json.loads(file.read())
+        self.assertEqual(written["pos"], 1)
+        self.assertNotIn("progress", written)
+
+        # Anything left in the file from before starts from the default again.
+        written["progress"] = {"track-1": 100}
+        with open(filepath, "w") as file:
+            file.write(json.dumps(written))
+        reloaded = StateManager(
+            STATE_NAME + "_Transient",
+            self.logger,
+            default_state={"pos": 0, "progress": {}},
+            transient_params=["progress"],
+        )
+        self.assertEqual(reloaded.get_value("progress"), {})
+        self.assertEqual(reloaded.get_value("pos"), 1)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import os
+
+from baps_types.plan import PlanItem
+from helpers.logging_manager import LoggingManager
+from helpers.state_manager import StateManager
+from helpers.status_delta import StatusDeltaTracker, apply_status_delta, serialise_status
+from helpers.os_environment import resolve_external_file_path
+
+STATE_NAME = "Test_StatusDelta"
+
+
+def getPlanItem(weight: int):
+    return PlanItem(
+        {
+            "timeslotitemid": weight,
+            "managedid": 1,
+            "weight": weight,
+            "title": "Item {}".format(weight),
+            "length": "00:00:01",
+        }
+    )
+
+
+class TestStatusDelta(unittest.TestCase):
+
+    logger: LoggingManager
+    state: StateManager
+    tracker: StatusDeltaTracker
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_StatusDelta")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        filepath = resolve_external_file_path("/state/" + STATE_NAME + ".json")
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+
+        self.state = StateManager(
+            STATE_NAME,
+            self.logger,
+            default_state={
+                "channel": 0,
+                "playing": False,
+                "loaded_item": None,
+                "show_plan": [getPlanItem(0), getPlanItem(1)],
+            },
+        )
+        self.tracker = StatusDeltaTracker()
+
+    def _full_status(self):
+        status = serialise_status(self.state.snapshot())
+        status["status_seq"] = self.tracker.seq
+        return status
+
+    def test_no_change(self):
+        self.tracker.delta(self.state)
+        self.assertIsNone(self.tracker.delta(self.state))
+
+    def test_round_trip(self):
+        self.tracker.delta(self.state)
+        client_status = self._full_status()
+
+        # Just a top level key.
+        self.state.update("playing", True)
+        delta = self.tracker.delta(self.state)
+        self.assertEqual(delta["changed"], {"playing": True})
+        self.assertEqual(delta["plan_items"], {})
+        self.assertNotIn("plan_order", delta)
+        client_status = apply_status_delta(client_status, delta)
+
+        # Change an item in place, only that item should be sent.
+        plan = self.state.get_value("show_plan")
+        plan[1].play_count_increment()
+        delta = self.tracker.delta(self.state)
+        self.assertEqual(list(delta["plan_items"].keys()), ["1"])
+        self.assertNotIn("plan_order", delta)
+        client_status = apply_status_delta(client_status, delta)
+
+        # Add an item, and remove another.
+        self.state.update("show_plan", [plan[1], getPlanItem(2)])
+        delta = self.tracker.delta(self.state)
+        self.assertEqual(list(delta["plan_items"].keys()), ["2"])
+        self.assertEqual(delta["plan_order"], ["1", "2"])
+        client_status = apply_status_delta(client_status, delta)
+
+        self.assertEqual(client_status, self._full_status())
+
+    def test_missed_delta(self):
+        self.tracker.delta(self.state)
+        client_status = self._full_status()
+
+        self.state.update("playing", True)
+        self.tracker.delta(self.state)  # This one gets lost.
+        self.state.update("playing", False)
+        delta = self.tracker.delta(self.state)
+
+        # Client needs a full resync.
+        self.assertIsNone(apply_status_delta(client_status, delta))
+
+        # A full status newer than the delta makes the delta redundant.
+        client_status = self._full_status()
+        self.assertEqual(apply_status_delta(client_status, delta), client_status)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from helpers.waveform_peaks import (
+    MIN_LEVEL_PEAKS,
+    WaveformPeaks,
+    compute_peaks,
+    read_pcm_peaks,
+    read_peaks,
+    write_peaks,
+)
+
+
+class TestWaveformPeaks(unittest.TestCase):
+
+    def test_compute(self):
+        samples = np.array([[0, 0], [1000, -1000], [-2000, 500], [300, 300], [32767, -32768]], dtype=np.int16)
+        peaks = compute_peaks(samples, samples_per_peak=2)
+        # The last peak only has one sample, the padding mustn't count.
+        np.testing.assert_array_equal(peaks, [[-4, 3], [-8, 1], [-128, 127]])
+        self.assertEqual(peaks.dtype, np.int8)
+
+        with self.assertRaises(ValueError):
+            compute_peaks(samples[:0])
+
+    def test_read_pcm(self):
+        rng = np.random.default_rng(0)
+        samples = rng.integers(-32768, 32767, size=(1000, 2), dtype=np.int16)
+        # Read a few peaks at a time, it comes out the same as all at once, including the short last peak.
+        peaks = read_pcm_peaks(io.BytesIO(samples.tobytes()), 2, samples_per_peak=16, chunk_peaks=3)
+        np.testing.assert_array_equal(peaks, compute_peaks(samples, samples_per_peak=16))
+
+        # A part frame at the end is left off.
+        peaks = read_pcm_peaks(io.BytesIO(samples.tobytes() + b"\0"), 2, samples_per_peak=16, chunk_peaks=3)
+        np.testing.assert_array_equal(peaks, compute_peaks(samples, samples_per_peak=16))
+
+        with self.assertRaises(ValueError):
+            read_pcm_peaks(io.BytesIO(b"\0\0"), 2)
+
+    def test_levels(self):
+        rng = np.random.default_rng(0)
+        samples = rng.integers(-32768, 32767, size=(44100 * 10, 2), dtype=np.int16)
+        peaks = WaveformPeaks.from_samples(samples, 44100, samples_per_peak=256)
+
+        self.assertLessEqual(len(peaks.levels[-1]), MIN_LEVEL_PEAKS)
+        for zoom in range(1, len(peaks.levels)):
+            before, after = peaks.levels[zoom - 1], peaks.levels[zoom]
+            self.assertEqual(len(after), -(-len(before) // 2))
+            self.assertEqual(after[:, 0].min(), before[:, 0].min())
+            self.assertEqual(after[:, 1].max(), before[:, 1].max())
+
+        waveform = peaks.as_json(2)
+        self.assertEqual(waveform["samples_per_pixel"], 1024)
+        self.assertEqual(len(waveform["data"]), waveform["length"] * 2)
+        with self.assertRaises(ValueError):
+            peaks.as_json(len(peaks.levels))
+
+    def test_stored(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_dir, "audio.mp3")
+            with open(filename, "wb") as file:
+                file.write(b"Pretend this is audio.")
+            self.assertIsNone(read_peaks(filename))
+
+            samples = np.arange(-30000, 30000, 7, dtype=np.int16)
+            peaks = WaveformPeaks.from_samples(samples, 48000, samples_per_peak=8)
+            write_peaks(filename, peaks)
+            stored = read_peaks(filename)
+            self.assertIsNotNone(stored)
+            self.assertEqual(stored.sample_rate, 48000)
+            self.assertEqual(len(stored.levels), len(peaks.levels))
+            for level, stored_level in zip(peaks.levels, stored.levels):
+                np.testing.assert_array_equal(level, stored_level)
+
+            # Once the file changes, the old peaks no longer apply.
+            with open(filename, "ab") as file:
+                file.write(b"\0")
+            self.assertIsNone(read_peaks(filename))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
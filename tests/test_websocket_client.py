@@ -0,0 +1,134 @@
+import unittest
+import asyncio
+import json
+from typing import Dict, List
+
+import websocket_server
+from baps_types.message import Command, Message, Source
+from helpers.logging_manager import LoggingManager
+from websocket_server import WebsocketClient, WebsocketServer
+
+
+class FakeWebsocket:
+    def __init__(self, block: bool = False):
+        self.sent: List[str] = []
+        self.block = block
+        self.closed = False
+
+    async def send(self, data: str):
+        if self.block:
+            # A client that's stopped reading.
+            await asyncio.sleep(3600)
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    def __init__(self):
+        self.disconnected: List[str] = []
+        self.status_seq = 0
+        self.logger = None
+
+    def disconnect(self, client: WebsocketClient, reason: str):
+        if not self.disconnected:
+            self.disconnected.append(reason)
+            client.writer.cancel()
+
+    def status_message(self, channel: int) -> str:
+        return json.dumps({"command": "STATUS", "channel": channel, "data": {"status_seq": self.status_seq}})
+
+
+class TestWebsocketClient(unittest.IsolatedAsyncioTestCase):
+
+    async def test_coalescing(self):
+        server = FakeServer()
+        websocket = FakeWebsocket()
+        client = WebsocketClient(server, websocket)
+
+        # All of this happens before the writer gets a look in.
+        client.send("delta 1")
+        client.send_status(0)
+        server.status_seq = 2
+        client.send_status(0)
+        for pos in range(10):
+            client.send_position(1, "pos {}".format(pos))
+        client.send("delta 2")
+
+        await asyncio.sleep(0.1)
+        # One (latest) status first, the rest in order, then just the latest position.
+        self.assertEqual(
+            websocket.sent,
+            [server.status_message(0), "delta 1", "delta 2", "pos 9"],
+        )
+        client.writer.cancel()
+
+    async def test_slow_client(self):
+        server = FakeServer()
+        client = WebsocketClient(server, FakeWebsocket(block=True))
+
+        for i in range(websocket_server.CLIENT_QUEUE_LIMIT + 2):
+            client.send("delta {}".format(i))
+        self.assertEqual(server.disconnected, ["fell too far behind"])
+
+    async def test_send_timeout(self):
+        original_timeout = websocket_server.CLIENT_SEND_TIMEOUT_S
+        websocket_server.CLIENT_SEND_TIMEOUT_S = 0.05
+        try:
+            server = FakeServer()
+            client = WebsocketClient(server, FakeWebsocket(block=True))
+            client.send("hello")
+            await asyncio.sleep(0.2)
+            self.assertEqual(server.disconnected, ["timed out sending"])
+        finally:
+            websocket_server.CLIENT_SEND_TIMEOUT_S = original_timeout
+
+
+# Just enough of a server to handle what the players send, without starting it.
+class StandInWebsocketServer(WebsocketServer):
+    def __init__(self, status: Dict):
+        self.logger = LoggingManager("Test_WebsocketServer")
+        self.clients = {}
+        self.channel_to_q = [None]
+        self.channel_status = [status]
+        self.channel_status_requested = [False]
+
+    def __del__(self):
+        pass
+
+
+class TestStatusDeltas(unittest.IsolatedAsyncioTestCase):
+
+    async def test_opt_in(self):
+        server = StandInWebsocketServer({"status_seq": 1, "playing": False, "show_plan": []})
+
+        webstudio = FakeWebsocket()
+        follower = FakeWebsocket()
+        server.clients[webstudio] = WebsocketClient(server, webstudio)
+        server.clients[follower] = WebsocketClient(server, follower)
+        server.clients[follower].deltas = True
+
+        delta = json.dumps({"seq": 2, "changed": {"playing": True}, "plan_items": {}})
+        server.handle_player_message(0, Message(Source.ALL, Command.STATUSDELTA, payload=delta, ok=True))
+        await asyncio.sleep(0.1)
+
+        # WebStudio only understands full statuses, so it gets the whole (updated) thing.
+        self.assertEqual(len(webstudio.sent), 1)
+        sent = json.loads(webstudio.sent[0])
+        self.assertEqual(sent["command"], "STATUS")
+        self.assertTrue(sent["data"]["playing"])
+        self.assertEqual(sent["data"]["status_seq"], 2)
+
+        self.assertEqual(len(follower.sent), 1)
+        self.assertEqual(
+            json.loads(follower.sent[0]), {"command": "STATUSDELTA", "data": json.loads(delta), "channel": 0}
+        )
+
+        for client in server.clients.values():
+            client.writer.cancel()
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -12,7 +12,8 @@ from setproctitle import setproctitle
 from typing import Any, Optional, List
 from multiprocessing.queues import Queue
 from queue import Empty
-from time import sleep
+from time import monotonic
+from uuid import uuid4
 import json
 import os
 
@@ -26,16 +27,23 @@ from helpers.device_manager import DeviceManager
 from helpers.state_manager import StateManager
 from helpers.the_terminator import Terminator
 from helpers.normalisation import get_normalised_filename_if_available
-from helpers.myradio_api import MyRadioAPI
+from helpers.waveform_peaks import read_peaks
+from helpers.myradio_api import MyRadioAPI, close_async_session
 from helpers.alert_manager import AlertManager
+from helpers.shared_status import PositionClock, StatusSlot
+from audio_backends import SELECTABLE_AUDIO_BACKENDS, SHARED_PROCESS_AUDIO_BACKENDS, SILENT_AUDIO_BACKENDS
 import package
 from baps_types.happytime import happytime
+from baps_types.message import Command, Message, Source
 
 env = Environment(
     loader=FileSystemLoader("%s/ui-templates/" % os.path.dirname(__file__)),
     autoescape=select_autoescape(),
 )
 
+# How long to wait for a player to reply with its status.
+STATUS_TIMEOUT_S = 0.8
+
 LOG_FILEPATH = resolve_external_file_path("logs")
 LOG_FILENAME = LOG_FILEPATH + "/WebServer.log"
 # From Sanic's default, but set to log to file.
@@ -110,6 +118,9 @@ alerts: AlertManager
 
 player_to_q: List[Queue] = []
 player_from_q: List[Queue] = []
+status_slots: List[StatusSlot] = []
+position_clocks: List[PositionClock] = []
+file_state: Optional[StateManager] = None
 
 # General UI Endpoints
 
@@ -188,15 +199,35 @@ def ui_config_player(request):
     return render_template("config_player.html", data=data)
 
 
+# Single-process is only offered if one of the backends on offer can play several channels from one process
+# (and be heard doing it). It can be chosen along with that backend, saving makes sure they go together.
+# Keep showing the current mode, even if it's been set by hand.
+def audio_engine_modes(state) -> List[str]:
+    modes = ["per-channel"]
+    if any(
+        backend in SHARED_PROCESS_AUDIO_BACKENDS and backend not in SILENT_AUDIO_BACKENDS
+        for backend in SELECTABLE_AUDIO_BACKENDS
+    ) or state["audio_engine_mode"] == "single-process":
+        modes.append("single-process")
+    return modes
+
+
 @app.route("/config/server")
 def ui_config_server(request):
+    state = server_state.get()
     data = {
         "ui_page": "server",
         "ui_title": "Server Config",
-        "state": server_state.get(),
+        "state": state,
         "ser_ports": DeviceManager.getSerialPorts(),
         "tracklist_modes": ["off", "on", "delayed", "fader-live"],
         "normalisation_modes": ["off", "on"],
+        # Keep showing the current backend, even if it's been set by hand.
+        "audio_backends": SELECTABLE_AUDIO_BACKENDS + [
+            backend for backend in [state["audio_backend"]] if backend not in SELECTABLE_AUDIO_BACKENDS
+        ],
+        "audio_engine_modes": audio_engine_modes(state),
+        "cache": file_state.get_value("cache") if file_state else None,
     }
     return render_template("config_server.html", data=data)
 
@@ -210,6 +241,7 @@ def ui_config_server_update(request):
     server_state.update("port", int(request.form.get("port")))
     server_state.update("num_channels", int(request.form.get("channels")))
     server_state.update("ws_port", int(request.form.get("ws_port")))
+    server_state.update("ws_pos_update_hz", float(request.form.get("ws_pos_update_hz")))
 
     serial_port = request.form.get("serial_port")
     server_state.update("serial_port", None if serial_port ==
@@ -229,6 +261,15 @@ def ui_config_server_update(request):
     )
     server_state.update("tracklist_mode", request.form.get("tracklist_mode"))
     server_state.update("normalisation_mode", request.form.get("normalisation_mode"))
+    audio_backend = request.form.get("audio_backend")
+    audio_engine_mode = request.form.get("audio_engine_mode")
+    if audio_engine_mode == "single-process" and audio_backend not in SHARED_PROCESS_AUDIO_BACKENDS:
+        # It would only fall back to a process per channel on start up anyway, so save what will actually happen.
+        audio_engine_mode = "per-channel"
+    server_state.update("audio_backend", audio_backend)
+    server_state.update("audio_buffer_frames", int(request.form.get("audio_buffer_frames")))
+    server_state.update("audio_engine_mode", audio_engine_mode)
+    server_state.update("music_cache_budget_mb", int(request.form.get("music_cache_budget_mb")))
 
     return redirect("/restart")
 
@@ -281,7 +322,7 @@ def player_simple(request, channel: int, command: str):
 
     simple_endpoints = ["play", "pause", "unpause", "stop", "unload", "clear"]
     if command in simple_endpoints:
-        player_to_q[channel].put("UI:" + command.upper())
+        player_to_q[channel].put(Message(Source.UI, command.upper()))
         return redirect("/status")
 
     abort(404)
@@ -290,7 +331,7 @@ def player_simple(request, channel: int, command: str):
 @app.route("/player/<channel:int>/seek/<pos:number>")
 def player_seek(request, channel: int, pos: float):
 
-    player_to_q[channel].put("UI:SEEK:" + str(pos))
+    player_to_q[channel].put(Message(Source.UI, Command.SEEK, (pos,)))
 
     return redirect("/status")
 
@@ -298,38 +339,38 @@ def player_seek(request, channel: int, pos: float):
 @app.route("/player/<channel:int>/load/<channel_weight:int>")
 def player_load(request, channel: int, channel_weight: int):
 
-    player_to_q[channel].put("UI:LOAD:" + str(channel_weight))
+    player_to_q[channel].put(Message(Source.UI, Command.LOAD, (channel_weight,)))
     return redirect("/status")
 
 
 @app.route("/player/<channel:int>/remove/<channel_weight:int>")
 def player_remove(request, channel: int, channel_weight: int):
-    player_to_q[channel].put("UI:REMOVE:" + str(channel_weight))
+    player_to_q[channel].put(Message(Source.UI, Command.REMOVE, (channel_weight,)))
 
     return redirect("/status")
 
 
 @app.route("/player/<channel:int>/output/<name:string>")
 def player_output(request, channel: int, name: Optional[str]):
-    player_to_q[channel].put("UI:OUTPUT:" + unquote(str(name)))
+    player_to_q[channel].put(Message(Source.UI, Command.OUTPUT, (unquote(str(name)),)))
     return redirect("/config/player")
 
 
 @app.route("/player/<channel:int>/autoadvance/<state:int>")
 def player_autoadvance(request, channel: int, state: int):
-    player_to_q[channel].put("UI:AUTOADVANCE:" + str(state))
+    player_to_q[channel].put(Message(Source.UI, Command.AUTOADVANCE, (state,)))
     return redirect("/status")
 
 
 @app.route("/player/<channel:int>/repeat/<state:string>")
 def player_repeat(request, channel: int, state: str):
-    player_to_q[channel].put("UI:REPEAT:" + state.upper())
+    player_to_q[channel].put(Message(Source.UI, Command.REPEAT, (state.upper(),)))
     return redirect("/status")
 
 
 @app.route("/player/<channel:int>/playonload/<state:int>")
 def player_playonload(request, channel: int, state: int):
-    player_to_q[channel].put("UI:PLAYONLOAD:" + str(state))
+    player_to_q[channel].put(Message(Source.UI, Command.PLAYONLOAD, (state,)))
     return redirect("/status")
 
 
@@ -343,7 +384,7 @@ def player_status_json(request, channel: int):
 def player_all_stop(request):
 
     for channel in player_to_q:
-        channel.put("UI:STOP")
+        channel.put(Message(Source.UI, Command.STOP))
     return redirect("/status")
 
 
@@ -354,7 +395,7 @@ def player_all_stop(request):
 def plan_load(request, timeslotid: int):
 
     for channel in player_to_q:
-        channel.put("UI:GETPLAN:" + str(timeslotid))
+        channel.put(Message(Source.UI, Command.GETPLAN, (timeslotid,)))
 
     return redirect("/status")
 
@@ -362,7 +403,7 @@ def plan_load(request, timeslotid: int):
 @app.route("/plan/clear")
 def plan_clear(request):
     for channel in player_to_q:
-        channel.put("UI:CLEAR")
+        channel.put(Message(Source.UI, Command.CLEAR))
     return redirect("/status")
 
 
@@ -417,7 +458,11 @@ def json_status(request):
     channel_states = []
     for i in range(server_state.get()["num_channels"]):
         channel_states.append(status(i))
-    return resp_json({"server": server_state.get(), "channels": channel_states})
+    downloads = file_state.get_value("downloads") if file_state else {}
+    normalisation = file_state.get_value("normalisation", {}) if file_state else {}
+    return resp_json(
+        {"server": server_state.get(), "channels": channel_states, "downloads": downloads, "normalisation": normalisation}
+    )
 
 
 # Get audio for UI to generate waveforms.
@@ -442,6 +487,26 @@ async def audio_file(request, type: str, id: int):
     return response
 
 
+# The waveform of a cached file, so clients don't have to download and decode the whole thing to draw it.
+# ?zoom=0 (the default) is the most detailed, each zoom after that has half as many peaks.
+@app.route("/waveform/<type:string>/<id:int>")
+def audio_waveform(request, type: str, id: int):
+    if type not in ["managed", "track"]:
+        abort(404)
+    filename = resolve_external_file_path(
+        "music-tmp/{}-{}.mp3".format(type, id))
+
+    # The file manager works these out after downloading, 404 if it's not got to this one yet.
+    peaks = read_peaks(get_normalised_filename_if_available(filename)) or read_peaks(filename)
+    if not peaks:
+        abort(404)
+
+    try:
+        return resp_json(peaks.as_json(int(request.args.get("zoom", 0))))
+    except ValueError as e:
+        abort(400, str(e))
+
+
 # Static Files
 app.static(
     "/favicon.ico", resolve_local_file_path("ui-static/favicon.ico"), name="ui-favicon"
@@ -463,31 +528,37 @@ app.static(
 
 
 def status(channel: int):
-    while not player_from_q[channel].empty():
-        # Just waste any previous status responses.
-        player_from_q[channel].get()
-
-    player_to_q[channel].put("UI:STATUS")
-    retries = 0
-    while retries < 40:
+    if status_slots:
+        # The player keeps this up to date, no need to bother it.
+        response = status_slots[channel].read()
+        if response:
+            status = json.loads(response)
+            # The player doesn't republish its status just for the position moving, that's in the position clock.
+            position = position_clocks[channel].read() if position_clocks else None
+            if position:
+                pos_true = position.pos_now()
+                status["pos_true"] = pos_true
+                status["pos"] = pos_true - status["pos_offset"]
+                status["remaining"] = max(0, position.remaining - (pos_true - position.pos_true))
+            return status
+
+    # Tag the request, so we can tell our reply apart from any older ones still in the queue.
+    request = Message(Source.UI, Command.STATUS, request_id=uuid4().hex)
+    player_to_q[channel].put(request)
+
+    deadline = monotonic() + STATUS_TIMEOUT_S
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return None
         try:
-            response = player_from_q[channel].get_nowait()
-            if response.startswith("UI:STATUS:"):
-                response = response.split(":", 2)[2]
-                # TODO: Handle OKAY / FAIL
-                response = response[response.index(":") + 1:]
-                try:
-                    response = json.loads(response)
-                except Exception as e:
-                    raise e
-                return response
-
+            response = player_from_q[channel].get(timeout=remaining)
         except Empty:
-            pass
-
-        retries += 1
+            return None
 
-        sleep(0.02)
+        if response.command == Command.STATUS and response.request_id == request.request_id:
+            # TODO: Handle OKAY / FAIL
+            return response.data
 
 
 # WebServer Start / Stop Functions
@@ -528,13 +599,28 @@ def restart(request):
     return render_template("message.html", data)
 
 
-# Don't use reloader, it causes Nested Processes!
-def WebServer(player_to: List[Queue], player_from: List[Queue], state: StateManager):
+@app.listener("after_server_stop")
+async def close_connections(app, loop):
+    await close_async_session()
 
-    global player_to_q, player_from_q, server_state, api, app, alerts
+
+# Don't use reloader, it causes Nested Processes!
+def WebServer(
+    player_to: List[Queue],
+    player_from: List[Queue],
+    state: StateManager,
+    slots: Optional[List[StatusSlot]] = None,
+    file_manager_state: Optional[StateManager] = None,
+    clocks: Optional[List[PositionClock]] = None,
+):
+
+    global player_to_q, player_from_q, status_slots, position_clocks, server_state, file_state, api, app, alerts
     player_to_q = player_to
     player_from_q = player_from
+    status_slots = slots or []
+    position_clocks = clocks or []
     server_state = state
+    file_state = file_manager_state
 
     logger = LoggingManager("WebServer")
     api = MyRadioAPI(logger, state)
@@ -1,9 +1,12 @@
 import asyncio
 from asyncio.futures import Future
 from asyncio.tasks import Task, shield
+from collections import deque
 import multiprocessing
+from multiprocessing.connection import wait
 import queue
-from typing import List
+from threading import Thread
+from typing import Any, Deque, Dict, List, Optional, Set
 import websockets
 import json
 from os import _exit
@@ -12,25 +15,123 @@ from setproctitle import setproctitle
 from multiprocessing import current_process
 
 from helpers.logging_manager import LoggingManager
+from helpers.os_environment import isWindows
+from helpers.status_delta import apply_status_delta
+from helpers.shared_status import PositionClock
 from helpers.the_terminator import Terminator
+from baps_types.message import Command, Message, Source
+
+
+# Don't let a silly config value spin the position updates.
+MIN_POS_UPDATE_HZ = 0.1
+# How many messages a client can have waiting to be sent before we give up on it.
+CLIENT_QUEUE_LIMIT = 200
+# How long a client gets to take a single message before we give up on it.
+CLIENT_SEND_TIMEOUT_S = 5
+# How often to check if we've been told to quit.
+TERMINATE_CHECK_S = 1
+
+
+# Each client gets its own queue of things to send, and a task sending them,
+# so one slow client can't hold up everyone else.
+class WebsocketClient:
+    websocket: Any
+    # Messages that must arrive in order (status deltas, command echoes...)
+    messages: Deque[str]
+    # Channels that need a full status. The latest one is sent when we get to it, so they never pile up.
+    statuses: Set[int]
+    # Latest position per channel, older ones are just replaced.
+    positions: Dict[int, str]
+    # Asked for status deltas (see status_delta.py). Otherwise, like WebStudio, it only understands full statuses,
+    # so gets the latest one whenever something changes.
+    deltas: bool
+    wake: asyncio.Event
+    writer: Task
+
+    def __init__(self, server: "WebsocketServer", websocket):
+        self.server = server
+        self.websocket = websocket
+        self.messages = deque()
+        self.statuses = set()
+        self.positions = {}
+        self.deltas = False
+        self.wake = asyncio.Event()
+        self.writer = asyncio.create_task(self.write())
+
+    def send(self, data: str):
+        if len(self.messages) >= CLIENT_QUEUE_LIMIT:
+            self.server.disconnect(self, "fell too far behind")
+            return
+        self.messages.append(data)
+        self.wake.set()
+
+    def send_status(self, channel: int):
+        self.statuses.add(channel)
+        self.wake.set()
+
+    def send_position(self, channel: int, data: str):
+        self.positions[channel] = data
+        self.wake.set()
+
+    def _next(self) -> Optional[str]:
+        # Full statuses first, any older deltas still queued are ignored by the client once it has them.
+        while self.statuses:
+            data = self.server.status_message(self.statuses.pop())
+            if data:
+                return data
+        if self.messages:
+            return self.messages.popleft()
+        if self.positions:
+            return self.positions.pop(next(iter(self.positions)))
+        return None
+
+    async def write(self):
+        try:
+            while True:
+                await self.wake.wait()
+                self.wake.clear()
+                data = self._next()
+                while data:
+                    await asyncio.wait_for(self.websocket.send(data), CLIENT_SEND_TIMEOUT_S)
+                    data = self._next()
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self.server.disconnect(self, "timed out sending")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            self.server.logger.log.exception(
+                "Exception sending to client {}: {}".format(self.websocket, e)
+            )
+            self.server.disconnect(self, "failed sending")
 
 
 class WebsocketServer:
 
     threads = Future
-    baps_clients = set()
+    clients: Dict[Any, WebsocketClient]
     channel_to_q: List[multiprocessing.Queue]
     webstudio_to_q: List[multiprocessing.Queue]
+    # The latest full status of each channel, kept up to date with the deltas from the players.
+    channel_status: List[Optional[Dict[str, Any]]]
+    channel_status_requested: List[bool]
+    position_clocks: List[PositionClock]
+    pos_update_s: float
     server_name: str
     logger: LoggingManager
     to_webstudio: Task
     from_webstudio: Task
     websocket_server: Serve
 
-    def __init__(self, in_q, out_q, state):
+    def __init__(self, in_q, out_q, state, position_clocks: Optional[List[PositionClock]] = None):
 
         self.channel_to_q = in_q
         self.webstudio_to_q = out_q
+        self.position_clocks = position_clocks or []
+        self.clients = {}
+        self.channel_status = [None] * len(in_q)
+        self.channel_status_requested = [False] * len(in_q)
 
         process_title = "Websockets Servr"
         setproctitle(process_title)
@@ -38,19 +139,23 @@ class WebsocketServer:
 
         self.logger = LoggingManager("Websockets")
         self.server_name = state.get()["server_name"]
+        self.pos_update_s = 1 / max(MIN_POS_UPDATE_HZ, float(state.get()["ws_pos_update_hz"]))
 
         self.websocket_server = websockets.serve(
             self.websocket_handler, state.get()["host"], state.get()["ws_port"]
         )
 
-        asyncio.get_event_loop().run_until_complete(self.websocket_server)
-        asyncio.get_event_loop().run_until_complete(self.handle_to_webstudio())
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.websocket_server)
+        self.watch_player_queues(loop)
+        loop.create_task(self.handle_positions())
 
         try:
-            asyncio.get_event_loop().run_forever()
+            loop.run_until_complete(self.wait_for_terminate())
         except Exception:
             # Sever died somehow, just quit out.
-            self.quit()
+            pass
+        self.quit()
 
     def quit(self):
         self.logger.log.info("Quitting.")
@@ -62,14 +167,20 @@ class WebsocketServer:
         self.logger.log.info("Deleting websocket server")
         self.quit()
 
+    async def wait_for_terminate(self):
+        terminator = Terminator()
+        while not terminator.terminate:
+            await asyncio.sleep(TERMINATE_CHECK_S)
+
     async def websocket_handler(self, websocket, path):
-        self.baps_clients.add(websocket)
-        await websocket.send(
+        client = WebsocketClient(self, websocket)
+        self.clients[websocket] = client
+        client.send(
             json.dumps({"message": "Hello", "serverName": self.server_name})
         )
         self.logger.log.info("New Client: {}".format(websocket))
-        for channel in self.channel_to_q:
-            channel.put("WEBSOCKET:STATUS")
+        for channel in range(len(self.channel_to_q)):
+            self.send_status(client, channel)
 
         self.from_webstudio = asyncio.create_task(
             self.handle_from_webstudio(websocket))
@@ -83,6 +194,25 @@ class WebsocketServer:
         try:
             async for message in websocket:
                 data = json.loads(message)
+                client = self.clients.get(websocket)
+                if not client:
+                    # We've disconnected them.
+                    break
+
+                if data.get("command") == Command.STATUSDELTA.value:
+                    # The client can keep its own copy of the status up to date, just send it what's changed.
+                    client.deltas = bool(data.get("enabled", True))
+                    continue
+
+                if data.get("command") == "RESYNC":
+                    # The client has missed a status delta, send it the full status again.
+                    if "channel" not in data:
+                        for channel in range(len(self.channel_to_q)):
+                            self.send_status(client, channel)
+                    else:
+                        self.send_status(client, int(data["channel"]))
+                    continue
+
                 if "channel" not in data:
                     # Didn't specify a channel, send to all.
                     for channel in range(len(self.channel_to_q)):
@@ -91,7 +221,7 @@ class WebsocketServer:
                     channel = int(data["channel"])
                     self.sendCommand(channel, data)
 
-                await asyncio.wait([conn.send(message) for conn in self.baps_clients])
+                self.broadcast(message)
 
         except websockets.exceptions.ConnectionClosedError as e:
             self.logger.log.error(
@@ -104,7 +234,52 @@ class WebsocketServer:
 
         finally:
             self.logger.log.info("Removing client: {}".format(websocket))
-            self.baps_clients.remove(websocket)
+            client = self.clients.pop(websocket, None)
+            if client:
+                client.writer.cancel()
+
+    def broadcast(self, data: str):
+        # Some may get disconnected as we go.
+        for client in list(self.clients.values()):
+            client.send(data)
+
+    def disconnect(self, client: WebsocketClient, reason: str):
+        if self.clients.pop(client.websocket, None) is None:
+            return
+        self.logger.log.warning(
+            "Disconnecting client {}, {}.".format(client.websocket, reason)
+        )
+        client.writer.cancel()
+        # It's probably not listening, don't wait around for it to agree to close.
+        asyncio.ensure_future(
+            asyncio.wait_for(client.websocket.close(), CLIENT_SEND_TIMEOUT_S)
+        )
+
+    # Queues the latest full status for a channel to one client.
+    def send_status(self, client: WebsocketClient, channel: int):
+        if channel not in range(len(self.channel_to_q)):
+            self.logger.log.error(
+                "Received status request for invalid channel {}.".format(channel)
+            )
+            return
+
+        if not self.channel_status[channel]:
+            # We don't know it yet, the player will send it to all clients when it replies.
+            self.request_status(channel)
+            return
+
+        client.send_status(channel)
+
+    def status_message(self, channel: int) -> Optional[str]:
+        status = self.channel_status[channel]
+        if not status:
+            return None
+        return json.dumps({"command": "STATUS", "data": status, "channel": channel})
+
+    def request_status(self, channel: int):
+        if not self.channel_status_requested[channel]:
+            self.channel_status_requested[channel] = True
+            self.channel_to_q[channel].put(Message(Source.WEBSOCKET, Command.STATUS))
 
     def sendCommand(self, channel, data):
         if channel not in range(len(self.channel_to_q)):
@@ -116,41 +291,35 @@ class WebsocketServer:
         if "command" in data.keys():
             command = data["command"]
 
-            # Handle the general case
-            # Message format:
-            # SOURCE:COMMAND:EXTRADATA
-
-            message = "WEBSOCKET:"
-
             # If we just want PLAY, PAUSE etc, we're all done.
             # Else, let's pipe in some extra info.
-            extra = ""
+            args: List[Any] = []
+            payload: Optional[str] = None
 
             try:
                 if command == "SEEK":
-                    extra += str(data["time"])
+                    args.append(data["time"])
                 elif command == "LOAD":
-                    extra += str(data["weight"])
+                    args.append(data["weight"])
                 elif command == "AUTOADVANCE":
-                    extra += str(data["enabled"])
+                    args.append(data["enabled"])
                 elif command == "PLAYONLOAD":
-                    extra += str(data["enabled"])
+                    args.append(data["enabled"])
                 elif command == "REPEAT":
-                    extra += str(data["mode"]).lower()
+                    args.append(str(data["mode"]).lower())
                 elif command == "ADD":
-                    extra += json.dumps(data["newItem"])
+                    payload = json.dumps(data["newItem"])
                 elif command == "REMOVE":
-                    extra += str(data["weight"])
+                    args.append(data["weight"])
                 elif command == "RESETPLAYED":
-                    extra += str(data["weight"])
+                    args.append(data["weight"])
                 elif command == "SETPLAYED":
-                    extra += str(data["weight"])
+                    args.append(data["weight"])
                 elif command == "GETPLAN":
-                    extra += str(data["timeslotId"])
+                    args.append(data["timeslotId"])
                 elif command == "SETMARKER":
-                    extra += "{}:{}".format(
-                        data["timeslotitemid"], json.dumps(data["marker"])
-                    )
+                    args.append(data["timeslotitemid"])
+                    payload = json.dumps(data["marker"])
 
                 # TODO: Move this to player handler.
                 # SPECIAL CASE ALERT! We need to talk to two channels here.
@@ -158,7 +327,7 @@ class WebsocketServer:
 
                     # remove the exiting item first
                     self.channel_to_q[channel].put(
-                        "{}REMOVE:{}".format(message, data["weight"])
+                        Message(Source.WEBSOCKET, Command.REMOVE, (data["weight"],))
                     )
 
                     # Now hijack to send the new add on the new channel.
@@ -170,7 +339,7 @@ class WebsocketServer:
 
                     # Now send the special case.
                     self.channel_to_q[new_channel].put(
-                        "WEBSOCKET:ADD:" + json.dumps(item)
+                        Message(Source.WEBSOCKET, Command.ADD, payload=json.dumps(item))
                     )
 
                     # Don't bother, we should be done.
@@ -183,13 +352,13 @@ class WebsocketServer:
                 )
                 pass
 
-            # Stick the message together and send!
-            message += (
-                # Put the command in at the end, in case MOVE etc changed it.
-                command
-            )
-            if extra != "":
-                message += ":" + extra
+            try:
+                message = Message(Source.WEBSOCKET, command, tuple(args), payload)
+            except ValueError:
+                self.logger.log.error(
+                    "Received unknown command {}. Data: {}".format(command, data)
+                )
+                return
 
             try:
                 self.channel_to_q[channel].put(message)
@@ -204,57 +373,108 @@ class WebsocketServer:
             self.logger.log.error(
                 "Command missing from message. Data: {}".format(data))
 
-    async def handle_to_webstudio(self):
+    # The payload is already JSON, so drop it straight in, rather than decoding and encoding it all again.
+    def _client_message(self, command: Command, payload: Optional[str], channel: int) -> str:
+        return '{{"command": "{}", "data": {}, "channel": {}}}'.format(
+            command.value, payload, channel
+        )
+
+    # Sample the players' position clocks, and let the clients know where they've got to.
+    async def handle_positions(self):
+        last_sent: List[Optional[float]] = [None] * len(self.position_clocks)
+        while True:
+            for channel, clock in enumerate(self.position_clocks):
+                position = clock.read()
+                if not position:
+                    continue
 
-        terminator = Terminator()
-        while not terminator.terminate:
+                pos = round(position.pos_now(), 2)
+                if pos == last_sent[channel]:
+                    # Nothing's moved, don't bother anyone.
+                    continue
+                last_sent[channel] = pos
+
+                data = json.dumps({"command": Command.POS.value, "data": str(pos), "channel": channel})
+                for client in self.clients.values():
+                    client.send_position(channel, data)
+            await asyncio.sleep(self.pos_update_s)
+
+    # Wake up as soon as a player has something for us, rather than polling the queues.
+    def watch_player_queues(self, loop: asyncio.AbstractEventLoop):
+        if isWindows():
+            # The Windows event loops can't watch pipes, leave the waiting to a thread.
+            Thread(target=self._wait_for_player_messages, args=(loop,), daemon=True).start()
+            return
 
-            for channel in range(len(self.webstudio_to_q)):
+        for channel, player_q in enumerate(self.webstudio_to_q):
+            loop.add_reader(player_q._reader.fileno(), self._drain_player_queue, channel)
+
+    def _wait_for_player_messages(self, loop: asyncio.AbstractEventLoop):
+        readers = {player_q._reader: channel for channel, player_q in enumerate(self.webstudio_to_q)}
+        while True:
+            for reader in wait(list(readers.keys())):
+                channel = readers[reader]
                 try:
                     message = self.webstudio_to_q[channel].get_nowait()
-                    source = message.split(":")[0]
-                    # TODO ENUM
-                    if source not in ["WEBSOCKET", "ALL"]:
-                        self.logger.log.error(
-                            "ERROR: Message received from invalid source to websocket_handler. Ignored.",
-                            source,
-                            message,
-                        )
-                        continue
-
-                    command = message.split(":")[1]
-                    if command == "STATUS":
-                        try:
-                            message = message.split("OKAY:")[1]
-                            message = json.loads(message)
-                        except Exception:
-                            continue  # TODO more logging
-                    elif command == "POS":
-                        try:
-                            message = message.split(":", 2)[2]
-                        except Exception:
-                            continue
-                    elif command == "QUIT":
-                        self.quit()
-                    else:
-                        continue
-
-                    data = json.dumps(
-                        {"command": command, "data": message, "channel": channel}
-                    )
-                    await asyncio.wait([conn.send(data) for conn in self.baps_clients])
                 except queue.Empty:
                     continue
-                except ValueError:
-                    # Typically a "Set of coroutines/Futures is empty." when sending to a dead client.
-                    continue
-                except Exception as e:
-                    self.logger.log.exception(
-                        "Exception trying to send to websocket:", e
-                    )
-            await asyncio.sleep(0.02)
+                loop.call_soon_threadsafe(self.handle_player_message, channel, message)
 
-        self.quit()
+    def _drain_player_queue(self, channel: int):
+        while True:
+            try:
+                message = self.webstudio_to_q[channel].get_nowait()
+            except queue.Empty:
+                return
+            self.handle_player_message(channel, message)
+
+    def handle_player_message(self, channel: int, message: Message):
+        try:
+            source = message.source
+            if source not in [Source.WEBSOCKET, Source.ALL]:
+                self.logger.log.error(
+                    "ERROR: Message received from invalid source to websocket_handler. Ignored.",
+                    source,
+                    message,
+                )
+                return
+
+            command = message.command
+            if command == Command.STATUS:
+                if not message.ok:
+                    return  # TODO more logging
+                try:
+                    status = message.data
+                except Exception:
+                    return
+                self.channel_status[channel] = status
+                self.channel_status_requested[channel] = False
+                if source == Source.ALL:
+                    # Just the player's periodic full status, clients are already up to date from deltas.
+                    return
+                for client in self.clients.values():
+                    client.send_status(channel)
+            elif command == Command.STATUSDELTA:
+                try:
+                    status = apply_status_delta(self.channel_status[channel], message.data)
+                except Exception:
+                    return
+                self.channel_status[channel] = status
+                if status is None:
+                    # We've lost track somehow, get the full status again.
+                    self.request_status(channel)
+                data = self._client_message(command, message.payload, channel)
+                for client in list(self.clients.values()):
+                    if client.deltas:
+                        client.send(data)
+                    else:
+                        client.send_status(channel)
+            elif command == Command.QUIT:
+                self.quit()
+        except Exception as e:
+            self.logger.log.exception(
+                "Exception trying to send to websocket: {}".format(e)
+            )
 
 
 if __name__ == "__main__":